@@ -1,6 +1,10 @@
+import asyncio
+import json
 import logging
+import re
+import time
 from openai import AsyncOpenAI
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, NamedTuple, Callable
 from config import (
     AI_API_KEY,
     AI_MODEL,
@@ -9,40 +13,61 @@ from config import (
     AI_TEMPERATURE,
     FAQ_QUESTIONS,
     TRANSLATIONS,
+    TOPICS,
+    EMOTION_KEYWORDS,
+    EMOTION_ESCALATION_SCORE,
+    AI_RESPONSE_KEYWORDS,
+    AI_ANSWER_CACHE_ENABLED,
+    AI_ANSWER_CACHE_SIZE,
+    AI_ANSWER_CACHE_TTL,
+    AI_ANSWER_CACHE_SIMILARITY,
+    AI_STRUCTURED_OUTPUT,
+    AI_STREAMING,
+    AI_CONCURRENCY,
+    AI_REQUEST_TIMEOUT,
+    AI_RETRIES,
+    AI_RETRY_BASE_DELAY,
+    AI_BREAKER_THRESHOLD,
+    AI_BREAKER_RESET,
+    AI_BACKEND,
+    AI_FAKE_LATENCY,
+    AI_FAKE_TOKEN_MS,
+    AI_REPLAY_PATH,
 )
+from answer_cache import AnswerCache
+from ai_backends import AIBackend, FakeBackend, LatencyModel, OpenAIBackend, ReplayBackend
+from ai_governor import AIGovernor, CircuitOpenError
+from keyword_matcher import KeywordMatcher, KeywordMatch
 
 logger = logging.getLogger(__name__)
 
 
+class CompiledPrompt(NamedTuple):
+    text: str
+    chars: int
+    approx_tokens: int
+    build_ms: float
+
+
+# Словари компилируются один раз при импорте
+_emotion_matcher = KeywordMatcher(EMOTION_KEYWORDS)
+_response_matcher = KeywordMatcher(AI_RESPONSE_KEYWORDS)
+
+
+def match_emotion(message: str) -> KeywordMatch:
+    """Все категории EMOTION_KEYWORDS в сообщении клиента: по одной проверке "in" на каждое слово"""
+    return _emotion_matcher.match(message)
+
+
 def ai_wants_to_escalate(ai_response: str) -> bool:
     """
     Проверяет, хочет ли AI передать вопрос оператору.
     Если AI написал про передачу/уточнение - возвращает True.
     """
-    response_lower = ai_response.lower()
-    
-    escalation_phrases = [
-        "передаю",
-        "передам",
-        "уточню",
-        "уточн",
-        "коллег",
-        "коллеге",
-        "специалист",
-        "оператор",
-        "детальн",
-        "рассмотр",
-        "занимаемся",
-        "изучением",
-        "вернёмся",
-        "решением"
-    ]
-    
-    for phrase in escalation_phrases:
-        if phrase in response_lower:
-            logger.info(f"🔄 AI wants to escalate: detected '{phrase}' in response")
-            return True
-    
+    found = _response_matcher.match(ai_response)
+    if "handoff" in found:
+        logger.info(f"🔄 AI wants to escalate: detected {sorted(found.hits['handoff'])} in response")
+        return True
     return False
 
 
@@ -51,98 +76,163 @@ def detect_strong_emotion(message: str) -> bool:
     Определяет наличие сильных негативных эмоций, мата или технических проблем.
     Если обнаружено - пользователя лучше передать оператору.
     """
-    message_lower = message.lower()
-    
-    # Мат и грубая лексика
-    profanity = [
-        "блять", "бля", "блядь", "ебать", "ебал", "хуй", "пизд", "сука", 
-        "гавно", "говно", "дерьм", "fuck", "shit", "damn", "asshole"
-    ]
-    
-    # Сильные негативные эмоции
-    strong_negative = [
-        "ненавижу", "отвратительн", "ужасн", "кошмар", "отстой",
-        "мошенник", "развод", "обман", "украл", "жалоб", "суд",
-        "возмущён", "возмущен", "жду уже", "часов", "дней", "недел",
-        "бред", "дебил"
-    ]
-    
-    # Технические проблемы требующие оператора (ошибки из приложения)
-    technical_issues = [
-        "обратитесь в поддержку",
-        "обратитесь в службу",
-        "обратитесь к поддержке",
-        "свяжитесь с поддержкой",
-        "ошибка",
-        "не могу вывести",
-        "не могу поставить на вывод",
-        "не выводится",
-        "не работает вывод"
-    ]
-    
-    # Вопросы про ожидание ответа оператора (пользователь хочет говорить с человеком)
-    waiting_questions = [
-        "как скоро проверят",
-        "когда проверят",
-        "сколько ждать",
-        "когда ответ",
-        "когда решат",
-        "долго ждать",
-        "когда рассмотрят"
-    ]
-    
-    # Проверяем мат
-    for word in profanity:
-        if word in message_lower:
-            logger.info(f"🔥 Обнаружен мат в сообщении: '{word}'")
-            return True
-    
-    # Проверяем технические проблемы (требуют оператора)
-    for phrase in technical_issues:
-        if phrase in message_lower:
-            logger.info(f"⚠️ Обнаружена техническая проблема: '{phrase}'")
-            return True
-    
-    # Проверяем вопросы про ожидание (пользователь хочет человека)
-    for phrase in waiting_questions:
-        if phrase in message_lower:
-            logger.info(f"⏰ Пользователь спрашивает про ожидание: '{phrase}'")
-            return True
-    
-    # Проверяем сильные негативные эмоции (минимум 2 упоминания)
-    negative_count = sum(1 for word in strong_negative if word in message_lower)
-    if negative_count >= 2:
-        logger.info(f"😡 Обнаружена сильная негативная эмоция (count={negative_count})")
-        return True
-    
-    # Проверка на повторяющиеся сообщения (признак раздражения)
-    if "уже" in message_lower and any(time_word in message_lower for time_word in ["час", "день", "недел", "сутки"]):
-        logger.info(f"⏰ Пользователь долго ждет решения")
+    found = match_emotion(message)
+    # Пользователь долго ждет решения: "уже" вместе со временем ожидания
+    long_wait = "already" in found and "wait_time" in found
+    if found.score >= EMOTION_ESCALATION_SCORE or long_wait:
+        logger.info(
+            f"😡 Escalation keywords: score={found.score:.1f}, long_wait={long_wait}, "
+            f"hits={ {name: sorted(words) for name, words in found.hits.items()} }"
+        )
         return True
-    
     return False
 
 
+SENTIMENTS = ("positive", "neutral", "negative")
+
+_STRUCTURED_FIELDS = (
+    '\n- "reply": текст ответа клиенту по правилам выше'
+    '\n- "escalate": true, если вопрос нужно передать оператору (ты не знаешь ответа или нужна проверка), иначе false'
+    '\n- "sentiment": тональность сообщения клиента: "positive", "neutral" или "negative"'
+)
+
+STRUCTURED_FORMAT = f"\n\nФОРМАТ ОТВЕТА: верни только JSON-объект с полями:{_STRUCTURED_FIELDS}"
+
+STRUCTURED_FORMAT_WITH_TITLE = (
+    f"{STRUCTURED_FORMAT}"
+    '\n- "title": очень краткое название тикета на русском (до 5-6 слов), начинается с подходящего эмодзи'
+)
+
+
+class AIReply(NamedTuple):
+    text: str
+    escalate: bool
+    sentiment: str
+    title: Optional[str]
+
+
+def _plain_reply(content: str) -> Optional[AIReply]:
+    text = content.strip()
+    if not text:
+        return None
+    return AIReply(text, ai_wants_to_escalate(text), "neutral", None)
+
+
+_REPLY_FIELD_RE = re.compile(r'"reply"\s*:\s*"')
+# Тело JSON-строки до закрывающей кавычки; одиночный "\" в конце не захватывается
+_JSON_STRING_BODY_RE = re.compile(r'(?:[^"\\]|\\.)*')
+_PARTIAL_ESCAPE_RE = re.compile(r'\\u[0-9a-fA-F]{0,3}$')
+
+
+def partial_reply_text(buffer: str) -> str:
+    """Уже пришедшая часть поля "reply" из недописанного JSON-ответа"""
+    field = _REPLY_FIELD_RE.search(buffer)
+    if field is None:
+        return ""
+    body = _JSON_STRING_BODY_RE.match(buffer, field.end()).group()
+    body = _PARTIAL_ESCAPE_RE.sub("", body)
+    try:
+        return json.loads(f'"{body}"')
+    except ValueError:
+        return ""
+
+
+def parse_structured_reply(content: str) -> Optional[AIReply]:
+    """
+    Разбирает JSON-ответ модели. Недостающие поля заменяются: escalate — проверкой
+    по ключевым словам, sentiment — neutral, title — None. Не-JSON считается текстом ответа.
+    """
+    try:
+        data = json.loads(content)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        logger.warning("⚠️ AI reply is not a JSON object, using it as plain text")
+        return _plain_reply(content)
+
+    text = data.get("reply")
+    text = text.strip() if isinstance(text, str) else ""
+    if not text:
+        return None
+    escalate = data.get("escalate")
+    # Если в тексте клиенту обещан оператор, передаём даже при escalate=false
+    escalate = escalate is True or ai_wants_to_escalate(text)
+    sentiment = data.get("sentiment")
+    if sentiment not in SENTIMENTS:
+        sentiment = "neutral"
+    title = data.get("title")
+    title = title.strip() if isinstance(title, str) and title.strip() else None
+    if title and len(title) > 50:
+        title = title[:47] + "..."
+    return AIReply(text, escalate, sentiment, title)
+
+
+def create_backend() -> Optional[AIBackend]:
+    """Бэкенд по AI_BACKEND; None, если для OpenAI не задан ключ"""
+    if AI_BACKEND == "fake":
+        return FakeBackend(LatencyModel(AI_FAKE_LATENCY), token_ms=AI_FAKE_TOKEN_MS)
+    if AI_BACKEND == "replay":
+        return ReplayBackend(AI_REPLAY_PATH)
+    if AI_BACKEND not in ("openai", "record"):
+        raise ValueError(f"Unknown AI_BACKEND: {AI_BACKEND}")
+    if not AI_API_KEY:
+        return None
+    # Повторы делает governor, у клиента — только таймаут
+    backend = OpenAIBackend(AsyncOpenAI(api_key=AI_API_KEY, timeout=AI_REQUEST_TIMEOUT, max_retries=0))
+    if AI_BACKEND == "record":
+        return ReplayBackend(AI_REPLAY_PATH, inner=backend)
+    return backend
+
+
 class AIAssistant:
     """ИИ-ассистент для автоматических ответов клиентам"""
     
-    def __init__(self):
+    def __init__(self, backend: Optional[AIBackend] = None):
         print(f"[DEBUG] Initializing AI Assistant... AI_ENABLED={AI_ENABLED}, API_KEY={'SET' if AI_API_KEY else 'EMPTY'}")
         self.enabled = AI_ENABLED
-        self.client = None
-        if self.enabled and AI_API_KEY:
-            self.client = AsyncOpenAI(api_key=AI_API_KEY)
-            logger.info(f"✅ AI Assistant initialized with model: {AI_MODEL}")
+        # (lang, topic) -> готовый системный промпт со всем FAQ
+        self._prompts: dict[tuple[str, Optional[str]], CompiledPrompt] = {}
+        # (lang, topic) -> готовый префикс промпта, к которому дописываются найденные записи FAQ
+        self._prefixes: dict[tuple[str, Optional[str]], CompiledPrompt] = {}
+        self.prompt_hits = 0
+        self.prompt_builds = 0
+        self.prompt_build_ms = 0.0
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_prompt_tokens = 0
+        # Ответы на повторяющиеся и почти одинаковые вопросы — без похода в API
+        self.answer_cache = AnswerCache(
+            AI_ANSWER_CACHE_SIZE, AI_ANSWER_CACHE_TTL, AI_ANSWER_CACHE_SIMILARITY
+        ) if AI_ANSWER_CACHE_ENABLED else None
+        # Все запросы к API идут через governor: лимит параллельных вызовов, дедлайны, повторы, предохранитель
+        self.governor = AIGovernor(
+            concurrency=AI_CONCURRENCY,
+            timeout=AI_REQUEST_TIMEOUT,
+            retries=AI_RETRIES,
+            retry_base_delay=AI_RETRY_BASE_DELAY,
+            breaker_threshold=AI_BREAKER_THRESHOLD,
+            breaker_reset=AI_BREAKER_RESET,
+        )
+        # Источник completions: OpenAI или локальная замена (fake, replay) для нагрузочных прогонов
+        self.backend = backend or (create_backend() if self.enabled else None)
+        if self.enabled and self.backend is not None:
+            logger.info(f"✅ AI Assistant initialized with model: {AI_MODEL}, backend: {self.backend.name}")
             print(f"[DEBUG] AI Assistant initialized successfully with model: {AI_MODEL}")
         else:
+            self.backend = None
             logger.warning(f"⚠️  AI Assistant is disabled (enabled={AI_ENABLED}, api_key={'set' if AI_API_KEY else 'empty'})")
             print(f"[DEBUG] AI Assistant NOT initialized: enabled={AI_ENABLED}, api_key={'set' if AI_API_KEY else 'empty'}")
     
-    def _build_system_prompt(self, lang: str = "ru") -> str:
-        """Создает системный промпт с базой знаний"""
+    def _build_system_prompt(self, lang: str = "ru", with_faq: bool = True) -> str:
+        """
+        Инструкция и база знаний со всем FAQ языка (with_faq=False — только инструкция).
+        Инструкция одинакова для всех языков и идёт первой, переменные части (база знаний,
+        язык, тема) — в конце, чтобы префикс совпадал байт в байт между запросами
+        и попадал под кеширование префикса у провайдера.
+        """
         
         # Базовая инструкция
-        system_prompt = f"""Ты - оператор службы поддержки Majestic Game Bot. Общайся как живой человек.
+        system_prompt = """Ты - оператор службы поддержки Majestic Game Bot. Общайся как живой человек.
 
 КРИТИЧЕСКИ ВАЖНО - ЗАПРЕЩЕННЫЕ ФРАЗЫ:
 🚫 "Я здесь, чтобы помочь"
@@ -157,7 +247,7 @@ class AIAssistant:
 - Ты ПЕРВАЯ линия поддержки
 - Отвечай ТОЛЬКО на простые вопросы из FAQ
 - Пиши максимально коротко (1-2 предложения)
-- Язык: {lang}
+- Язык ответа указан в конце инструкции
 
 ПРАВИЛА ОТВЕТОВ:
 1. Простой вопрос из FAQ → дай короткий ответ
@@ -166,14 +256,24 @@ class AIAssistant:
 4. Эмодзи: НЕ используй совсем
 5. Если не знаешь ответа → напиши: "Занимаемся изучением вашей проблемы. Скоро вернёмся с решением."
 
-БАЗА ЗНАНИЙ:
+ПРИМЕРЫ ОТВЕТОВ:
+- Пользователь: "Как пополнить?" → Дай инструкцию из базы знаний
+- Пользователь: "Не пришли деньги" → "Транзакции могут занять до 15 минут. Проверьте позже."
+- Пользователь: "Как скоро проверят мой вопрос?" → "Ваше обращение уже в обработке. Время ответа зависит от загрузки поддержки."
+- Пользователь: "its wrong me have 2 accounts only" → "Занимаемся изучением вашей проблемы. Скоро вернёмся с решением."
+
+ВАЖНО: Когда пишешь про изучение проблемы - система реально передаст вопрос оператору!
 """
         
+        if not with_faq:
+            return system_prompt
+        
+        parts = [system_prompt, "\nБАЗА ЗНАНИЙ:\n"]
         # Добавляем FAQ в промпт
         for topic, questions in FAQ_QUESTIONS.items():
             if lang in questions:
                 topic_name = TRANSLATIONS[lang]["topics"].get(topic, topic)
-                system_prompt += f"\n\n📌 {topic_name.upper()}:\n"
+                parts.append(f"\n\n📌 {topic_name.upper()}:\n")
                 
                 lang_questions = questions[lang]
                 for i in range(1, 10):
@@ -183,20 +283,132 @@ class AIAssistant:
                         question = lang_questions[q_key]
                         answer = lang_questions[a_key]
                         if answer:  # Только если есть ответ
-                            system_prompt += f"\nВопрос: {question}\nОтвет: {answer}\n"
-        
-        system_prompt += """
-
-ПРИМЕРЫ ОТВЕТОВ:
-- Пользователь: "Как пополнить?" → Дай инструкцию из базы знаний
-- Пользователь: "Не пришли деньги" → "Транзакции могут занять до 15 минут. Проверьте позже."
-- Пользователь: "Как скоро проверят мой вопрос?" → "Ваше обращение уже в обработке. Время ответа зависит от загрузки поддержки."
-- Пользователь: "its wrong me have 2 accounts only" → "Занимаемся изучением вашей проблемы. Скоро вернёмся с решением."
-
-ВАЖНО: Когда пишешь про изучение проблемы - система реально передаст вопрос оператору!
-"""
+                            parts.append(f"\nВопрос: {question}\nОтвет: {answer}\n")
         
-        return system_prompt
+        return "".join(parts)
+    
+    def _compile_prompt(self, lang: str, topic: Optional[str], with_faq: bool = True) -> CompiledPrompt:
+        """
+        with_faq=True — полный промпт со всем FAQ. with_faq=False — префикс для найденных
+        записей: язык и тема идут до базы знаний, потому что записи у каждого запроса свои
+        """
+        started = time.perf_counter()
+        # Промпт без темы — префикс промпта с любой темой того же языка
+        text = self._build_system_prompt(lang, with_faq) + f"\nЯзык: {lang}"
+        if topic:
+            topic_name = TRANSLATIONS.get(lang, {}).get("topics", {}).get(topic, topic)
+            text += f"\n\nТекущая тема обращения: {topic_name}"
+        if not with_faq:
+            text += "\n\nБАЗА ЗНАНИЙ:\n"
+        build_ms = (time.perf_counter() - started) * 1000
+        self.prompt_builds += 1
+        self.prompt_build_ms += build_ms
+        # Грубая оценка: ~4 байта UTF-8 на токен (кириллица — 2 байта на символ)
+        return CompiledPrompt(text, len(text), len(text.encode("utf-8")) // 4, build_ms)
+    
+    def compile_prompts(self) -> int:
+        """Собирает промпты и префиксы для всех (язык, тема) заранее; возвращает их количество"""
+        self.invalidate_prompts()
+        for lang in TRANSLATIONS:
+            for topic in (None, *TOPICS):
+                self._prompts[(lang, topic)] = self._compile_prompt(lang, topic)
+                self._prefixes[(lang, topic)] = self._compile_prompt(lang, topic, with_faq=False)
+        if self._prompts:
+            sizes = [prompt.approx_tokens for prompt in self._prompts.values()]
+            prefix_sizes = [prefix.approx_tokens for prefix in self._prefixes.values()]
+            logger.info(
+                f"🧩 Compiled {len(self._prompts)} system prompts: ~{min(sizes)}-{max(sizes)} tokens, "
+                f"{len(self._prefixes)} prefixes: ~{min(prefix_sizes)}-{max(prefix_sizes)} tokens, "
+                f"{self.prompt_build_ms:.1f} ms total"
+            )
+        return len(self._prompts) + len(self._prefixes)
+    
+    def invalidate_prompts(self):
+        """Сбрасывает собранные промпты и префиксы (после изменения FAQ_QUESTIONS / TRANSLATIONS)"""
+        self._prompts.clear()
+        self._prefixes.clear()
+    
+    def get_system_prompt(
+        self,
+        lang: str = "ru",
+        topic: Optional[str] = None,
+        faq_entries: Optional[list] = None,
+    ) -> CompiledPrompt:
+        if faq_entries:
+            # Набор записей свой у каждого запроса — к готовому префиксу дописываются только они
+            prefix = self._prefixes.get((lang, topic))
+            if prefix is None:
+                prefix = self._prefixes[(lang, topic)] = self._compile_prompt(lang, topic, with_faq=False)
+            else:
+                self.prompt_hits += 1
+            text = prefix.text + "".join(
+                f"\nВопрос: {entry.question}\nОтвет: {entry.answer}\n" for entry in faq_entries
+            )
+            return CompiledPrompt(text, len(text), len(text.encode("utf-8")) // 4, 0.0)
+        prompt = self._prompts.get((lang, topic))
+        if prompt is None:
+            prompt = self._prompts[(lang, topic)] = self._compile_prompt(lang, topic)
+        else:
+            self.prompt_hits += 1
+        return prompt
+    
+    def prompt_stats(self) -> dict:
+        """Размер промптов, время сборки и сколько токенов промпта провайдер взял из кеша"""
+        avg_build_ms = self.prompt_build_ms / self.prompt_builds if self.prompt_builds else 0.0
+        return {
+            "compiled": len(self._prompts) + len(self._prefixes),
+            "hits": self.prompt_hits,
+            "builds": self.prompt_builds,
+            "build_ms_total": round(self.prompt_build_ms, 2),
+            "build_ms_saved": round(self.prompt_hits * avg_build_ms, 2),
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_prompt_tokens": self.cached_prompt_tokens,
+            "cached_ratio": round(self.cached_prompt_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+        }
+    
+    def _record_usage(self, response):
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        self.requests += 1
+        self.prompt_tokens += usage.prompt_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details else 0
+        self.cached_prompt_tokens += cached
+        logger.debug(f"Prompt tokens: {usage.prompt_tokens}, cached: {cached}")
+    
+    async def _stream_completion(
+        self,
+        messages: list,
+        extra: dict,
+        on_text: Callable[[str], None],
+        started: float,
+    ) -> str:
+        """Читает ответ потоком и передаёт в on_text текст для клиента (из JSON — только поле reply)"""
+        stream = await self.backend.create(
+            model=AI_MODEL,
+            messages=messages,
+            max_tokens=AI_MAX_TOKENS,
+            temperature=AI_TEMPERATURE,
+            stream=True,
+            stream_options={"include_usage": True},
+            **extra,
+        )
+        parts = []
+        async for chunk in stream:
+            self._record_usage(chunk)
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            if not parts:
+                logger.info(f"⚡ First AI token in {(time.perf_counter() - started) * 1000:.0f} ms")
+            parts.append(delta)
+            content = "".join(parts)
+            text = partial_reply_text(content) if AI_STRUCTURED_OUTPUT else content
+            if text:
+                on_text(text)
+        return "".join(parts)
     
     async def get_ai_response(
         self,
@@ -215,58 +427,116 @@ class AIAssistant:
         Returns:
             Ответ ИИ или None в случае ошибки
         """
-        logger.info(f"📥 get_ai_response called: message='{user_message[:50]}...', lang={lang}, context={context}")
+        reply = await self.get_ai_reply(user_message, lang, context)
+        return reply.text if reply else None
+    
+    async def get_ai_reply(
+        self,
+        user_message: str,
+        lang: str = "ru",
+        context: Optional[Dict[str, Any]] = None,
+        with_title: bool = False,
+        on_text: Optional[Callable[[str], None]] = None,
+    ) -> Optional[AIReply]:
+        """
+        Ответ ИИ вместе с решением об эскалации, тональностью и (with_title) названием тикета.
+        При AI_STRUCTURED_OUTPUT всё приходит одним запросом в JSON; иначе эскалация
+        определяется по ключевым словам, тональность — neutral, названия нет.
+        on_text (при AI_STREAMING) получает накопленный текст ответа по мере генерации;
+        при ответе из кеша не вызывается.
+        
+        Returns:
+            AIReply или None в случае ошибки
+        """
+        logger.info(f"📥 get_ai_reply called: message='{user_message[:50]}...', lang={lang}, topic={context.get('topic') if context else None}")
         
         if not self.enabled:
             logger.warning("⚠️  AI is disabled, skipping response generation")
             return None
         
-        if not AI_API_KEY:
-            logger.error("❌ AI API key is not configured")
-            return None
-        
-        if not self.client:
-            logger.error("❌ OpenAI client is not initialized")
+        if self.backend is None:
+            logger.error("❌ AI backend is not configured (no API key?)")
             return None
         
         try:
-            logger.info(f"🔨 Building system prompt for lang={lang}...")
-            system_prompt = self._build_system_prompt(lang)
-            logger.info(f"✅ System prompt built, length={len(system_prompt)}")
+            topic = context.get("topic") if context else None
+            faq_entries = context.get("faq") if context else None
+            history = context.get("history") if context else None
+            # Ответ в середине диалога зависит от предыдущих реплик — кеш только для первого вопроса
+            use_cache = self.answer_cache is not None and not (history and (history.summary or history.turns))
+            if use_cache:
+                cached = self.answer_cache.get(user_message, lang, topic)
+                if cached is not None:
+                    logger.info(f"♻️ AI answer served from cache (lang={lang}, topic={topic})")
+                    return cached
             
-            # Добавляем контекст если есть
-            if context:
-                topic = context.get("topic")
-                if topic:
-                    topic_name = TRANSLATIONS[lang]["topics"].get(topic, topic)
-                    system_prompt += f"\n\nТекущая тема обращения: {topic_name}"
-                    logger.info(f"📌 Added topic context: {topic_name}")
+            prompt = self.get_system_prompt(lang, topic, faq_entries)
+            logger.info(
+                f"✅ System prompt ready: lang={lang}, topic={topic}, faq_entries={len(faq_entries) if faq_entries else 'all'}, "
+                f"length={prompt.chars}, ~{prompt.approx_tokens} tokens"
+            )
             
-            # Создаем запрос к API
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
+            # Формат ответа — в самом конце, после кешируемого префикса
+            system_prompt = prompt.text
+            extra = {}
+            if AI_STRUCTURED_OUTPUT:
+                system_prompt += STRUCTURED_FORMAT_WITH_TITLE if with_title else STRUCTURED_FORMAT
+                extra["response_format"] = {"type": "json_object"}
             
-            logger.info(f"🌐 Requesting AI response from OpenAI (model={AI_MODEL})...")
+            # Создаем запрос к API: промпт, резюме и последние реплики тикета, текущее сообщение
+            messages = [{"role": "system", "content": system_prompt}]
+            if history:
+                if history.summary:
+                    messages.append({"role": "system", "content": f"Начало диалога (кратко):\n{history.summary}"})
+                for turn in history.turns:
+                    role = "user" if turn.role == "user" else "assistant"
+                    messages.append({"role": role, "content": turn.text})
+                logger.info(f"🧵 Conversation history: {len(history.turns)} turns, summary={bool(history.summary)}")
+            messages.append({"role": "user", "content": user_message})
+            
+            logger.info(f"🌐 Requesting AI response from OpenAI (model={AI_MODEL}, structured={AI_STRUCTURED_OUTPUT})...")
             logger.info(f"📝 User message: {user_message}")
             
-            response = await self.client.chat.completions.create(
-                model=AI_MODEL,
-                messages=messages,
-                max_tokens=AI_MAX_TOKENS,
-                temperature=AI_TEMPERATURE,
-            )
+            started = time.perf_counter()
+            if on_text is not None and AI_STREAMING:
+                content = await self.governor.call(
+                    lambda: self._stream_completion(messages, extra, on_text, started)
+                )
+            else:
+                response = await self.governor.call(lambda: self.backend.create(
+                    model=AI_MODEL,
+                    messages=messages,
+                    max_tokens=AI_MAX_TOKENS,
+                    temperature=AI_TEMPERATURE,
+                    **extra,
+                ))
+                self._record_usage(response)
+                content = response.choices[0].message.content or ""
+            latency_ms = (time.perf_counter() - started) * 1000
             
-            ai_message = response.choices[0].message.content.strip()
-            logger.info(f"✅ AI response received! Length={len(ai_message)}")
-            logger.info(f"💬 AI response preview: {ai_message[:100]}...")
+            reply = parse_structured_reply(content) if AI_STRUCTURED_OUTPUT else _plain_reply(content)
+            if reply is None:
+                logger.error(f"❌ AI returned an empty reply in {latency_ms:.0f} ms")
+                return None
+            logger.info(
+                f"✅ AI response received in {latency_ms:.0f} ms! Length={len(reply.text)}, "
+                f"escalate={reply.escalate}, sentiment={reply.sentiment}, title={reply.title!r}"
+            )
+            if use_cache:
+                self.answer_cache.set(user_message, lang, topic, reply, latency_ms)
+            logger.info(f"💬 AI response preview: {reply.text[:100]}...")
             
-            return ai_message
+            return reply
         
+        except CircuitOpenError:
+            logger.warning("🔌 AI circuit breaker is open, request skipped")
+            return None
+        except asyncio.TimeoutError:
+            logger.error(f"⏱️ AI request exceeded the {AI_REQUEST_TIMEOUT:.0f}s deadline")
+            return None
         except Exception as e:
             error_msg = str(e)
-            logger.error(f"❌ Error in get_ai_response: {e}", exc_info=True)
+            logger.error(f"❌ Error in get_ai_reply: {e}", exc_info=True)
             if "authentication" in error_msg.lower() or "api_key" in error_msg.lower():
                 logger.error("🔑 OpenAI Authentication failed - check your API key")
             elif "rate" in error_msg.lower() or "limit" in error_msg.lower():
@@ -274,9 +544,6 @@ class AIAssistant:
             else:
                 logger.error(f"💥 OpenAI API error: {e}")
             return None
-        except Exception as e:
-            logger.error(f"Unexpected error in AI response generation: {e}", exc_info=True)
-            return None
     
     def should_escalate_to_human(self, ai_response: str) -> bool:
         """
@@ -288,18 +555,7 @@ class AIAssistant:
         Returns:
             True если нужно передать оператору
         """
-        escalation_keywords = [
-            "оператор",
-            "специалист",
-            "поддержк",
-            "свяж",
-            "не могу помочь",
-            "не уверен",
-            "рекомендую обратиться",
-        ]
-        
-        ai_response_lower = ai_response.lower()
-        return any(keyword in ai_response_lower for keyword in escalation_keywords)
+        return "referral" in _response_matcher.match(ai_response)
     
     async def analyze_sentiment(self, user_message: str, lang: str = "ru") -> str:
         """
@@ -312,7 +568,7 @@ class AIAssistant:
         Returns:
             Тональность: "positive", "neutral", "negative"
         """
-        if not self.enabled or not AI_API_KEY or not self.client:
+        if not self.enabled or self.backend is None:
             return "neutral"
         
         try:
@@ -323,12 +579,12 @@ class AIAssistant:
 
 Тональность:"""
             
-            response = await self.client.chat.completions.create(
+            response = await self.governor.call(lambda: self.backend.create(
                 model=AI_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=10,
                 temperature=0.3,
-            )
+            ))
             
             sentiment = response.choices[0].message.content.strip().lower()
             if sentiment in ["positive", "neutral", "negative"]:
@@ -339,7 +595,50 @@ class AIAssistant:
             logger.error(f"Error analyzing sentiment: {e}")
             return "neutral"
     
-    async def generate_thread_title(self, user_message: str, topic: str, lang: str = "ru") -> str:
+    async def summarize_conversation(self, summary: Optional[str], turns: list) -> Optional[str]:
+        """
+        Сжимает вытесненные из истории реплики тикета вместе с прежним резюме
+        
+        Args:
+            summary: прежнее резюме или None
+            turns: реплики (conversation.Turn) от старых к новым
+        
+        Returns:
+            Новое резюме или None, если ИИ недоступен
+        """
+        if not self.enabled or self.backend is None:
+            return None
+        
+        speakers = {"user": "Клиент", "assistant": "Поддержка", "operator": "Оператор"}
+        dialog = "\n".join(f"{speakers.get(turn.role, 'Клиент')}: {turn.text}" for turn in turns)
+        prompt = f"""Кратко (2-4 предложения) перескажи начало диалога службы поддержки:
+суть проблемы клиента, что ему уже ответили и что осталось нерешённым.
+
+Прежнее резюме: {summary or "нет"}
+
+Новые реплики:
+{dialog}
+
+Резюме:"""
+        try:
+            response = await self.governor.call(lambda: self.backend.create(
+                model=AI_MODEL,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=200,
+                temperature=0.3,
+            ))
+            return (response.choices[0].message.content or "").strip() or None
+        except Exception as e:
+            logger.error(f"Error summarizing conversation: {e}")
+            return None
+    
+    async def generate_thread_title(
+        self,
+        user_message: str,
+        topic: str,
+        lang: str = "ru",
+        fallback: bool = True,
+    ) -> Optional[str]:
         """
         Генерирует краткое название темы на основе сообщения пользователя
         
@@ -347,11 +646,14 @@ class AIAssistant:
             user_message: первое сообщение пользователя
             topic: тема тикета
             lang: язык
+            fallback: вернуть шаблонное название, если ИИ недоступен или ошибся (иначе None)
             
         Returns:
             Краткое название с эмодзи (максимум 50 символов)
         """
-        if not self.enabled or not AI_API_KEY or not self.client:
+        if not self.enabled or self.backend is None:
+            if not fallback:
+                return None
             # Fallback названия с эмодзи
             emoji_map = {
                 "balance": "💰",
@@ -378,12 +680,12 @@ class AIAssistant:
 
 Название (максимум 50 символов):"""
             
-            response = await self.client.chat.completions.create(
+            response = await self.governor.call(lambda: self.backend.create(
                 model=AI_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 max_tokens=30,
                 temperature=0.7,
-            )
+            ))
             
             title = response.choices[0].message.content.strip()
             
@@ -396,6 +698,8 @@ class AIAssistant:
         
         except Exception as e:
             logger.error(f"Error generating thread title: {e}")
+            if not fallback:
+                return None
             # Fallback
             emoji_map = {
                 "balance": "💰",
@@ -0,0 +1,295 @@
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import random
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Optional, Protocol
+
+logger = logging.getLogger(__name__)
+
+
+class AIBackend(Protocol):
+    """
+    Источник completions для AIAssistant. create() принимает те же аргументы, что
+    AsyncOpenAI.chat.completions.create, и возвращает объект с тем же интерфейсом:
+    choices[0].message.content и usage, а при stream=True — асинхронный поток чанков
+    с choices[0].delta.content (usage — в последнем чанке).
+    """
+
+    name: str
+
+    async def create(self, **request) -> Any:
+        ...
+
+
+class OpenAIBackend:
+    name = "openai"
+
+    def __init__(self, client):
+        self.client = client
+
+    async def create(self, **request) -> Any:
+        return await self.client.chat.completions.create(**request)
+
+
+def _completion(content: str, prompt_tokens: int, completion_tokens: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content), delta=None)],
+        usage=_usage(prompt_tokens, completion_tokens),
+    )
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        prompt_tokens_details=SimpleNamespace(cached_tokens=0),
+    )
+
+
+def _chunk(delta: Optional[str], usage: Optional[SimpleNamespace] = None) -> SimpleNamespace:
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=delta))] if delta is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+def _pieces(content: str) -> list[str]:
+    """Текст по словам с пробелами — примерно как чанки потокового API"""
+    words = content.split(" ")
+    return [word + " " for word in words[:-1]] + [words[-1]]
+
+
+def request_key(request: dict) -> str:
+    """Ключ запроса для записи/воспроизведения: модель, сообщения и формат ответа"""
+    payload = {
+        "model": request.get("model"),
+        "messages": request.get("messages"),
+        "response_format": request.get("response_format"),
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _approx_tokens(text: str) -> int:
+    return len(text.encode("utf-8")) // 4
+
+
+class LatencyModel:
+    """
+    Распределение задержки в миллисекундах, задаётся строкой:
+    "fixed:800", "uniform:300:1500", "normal:800:200", "lognormal:800:0.5" (медиана и sigma)
+    """
+
+    def __init__(self, spec: str):
+        kind, *args = spec.split(":")
+        params = [float(arg) for arg in args]
+        expected = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2}
+        if kind not in expected or len(params) != expected[kind]:
+            raise ValueError(f"Bad latency spec: {spec!r}")
+        self.spec = spec
+        self.kind = kind
+        self.params = params
+
+    def sample(self, rnd: random.Random) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rnd.uniform(*self.params)
+        if self.kind == "normal":
+            return max(0.0, rnd.gauss(*self.params))
+        median, sigma = self.params
+        return rnd.lognormvariate(math.log(median), sigma)
+
+
+_FAKE_SENTENCES = [
+    "Проверьте, пожалуйста, историю операций в профиле.",
+    "Обычно зачисление занимает до 15 минут.",
+    "Убедитесь, что указали правильный адрес кошелька.",
+    "Попробуйте перезапустить приложение и повторить попытку.",
+    "Если проблема останется, пришлите скриншот экрана.",
+    "Вывод подарков доступен после подтверждения аккаунта.",
+    "Бонус начисляется автоматически после первого пополнения.",
+]
+_FAKE_HANDOFF = "Передам ваш вопрос специалисту, он скоро ответит."
+_FAKE_TITLES = ["💰 Проблема с пополнением", "🎁 Вопрос про вывод", "🐛 Ошибка в приложении", "📝 Общий вопрос"]
+
+
+class FakeBackend:
+    """
+    Локальная замена LLM для нагрузочных прогонов: ответ и задержка детерминированы
+    содержимым запроса (один и тот же запрос — тот же ответ и та же задержка при том же seed).
+    latency — время до первого токена, token_ms — пауза между чанками; error_rate — доля
+    запросов, падающих с APITimeoutError, escalate_rate — доля ответов с передачей оператору.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        latency: LatencyModel,
+        token_ms: float = 15,
+        error_rate: float = 0.0,
+        escalate_rate: float = 0.1,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.token_ms = token_ms
+        self.error_rate = error_rate
+        self.escalate_rate = escalate_rate
+        self.seed = seed
+        self.requests = 0
+
+    def _answer(self, request: dict, rnd: random.Random) -> str:
+        escalate = rnd.random() < self.escalate_rate
+        text = " ".join(rnd.sample(_FAKE_SENTENCES, rnd.randint(1, 3)))
+        if escalate:
+            text = f"{text} {_FAKE_HANDOFF}"
+        if request.get("response_format", {}).get("type") != "json_object":
+            return text
+        return json.dumps({
+            "reply": text,
+            "escalate": escalate,
+            "sentiment": rnd.choice(["positive", "neutral", "neutral", "negative"]),
+            "title": rnd.choice(_FAKE_TITLES),
+        }, ensure_ascii=False)
+
+    async def create(self, **request) -> Any:
+        self.requests += 1
+        rnd = random.Random(f"{self.seed}:{request_key(request)}")
+        first_token_ms = self.latency.sample(rnd)
+        if rnd.random() < self.error_rate:
+            await asyncio.sleep(first_token_ms / 1000)
+            import httpx
+            from openai import APITimeoutError
+            raise APITimeoutError(request=httpx.Request("POST", "https://fake-backend.local/v1/chat/completions"))
+        content = self._answer(request, rnd)
+        prompt_tokens = sum(_approx_tokens(str(message.get("content", ""))) for message in request["messages"])
+        pieces = _pieces(content)
+        if request.get("stream"):
+            return self._stream(pieces, first_token_ms, _usage(prompt_tokens, len(pieces)))
+        await asyncio.sleep((first_token_ms + self.token_ms * len(pieces)) / 1000)
+        return _completion(content, prompt_tokens, len(pieces))
+
+    async def _stream(self, pieces: list[str], first_token_ms: float, usage) -> AsyncIterator:
+        await asyncio.sleep(first_token_ms / 1000)
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(self.token_ms / 1000)
+            yield _chunk(piece)
+        yield _chunk(None, usage)
+
+    def stats(self) -> dict:
+        return {"latency": self.latency.spec, "requests": self.requests}
+
+
+class ReplayBackend:
+    """
+    Записанные completions из JSONL-файла по ключу запроса (request_key).
+    С inner — режим записи: промахи уходят во inner, ответ и его задержка дописываются в файл.
+    Без inner промах — LookupError (или fallback, если задан).
+    replay_latency: воспроизводить записанную задержку, иначе ответ сразу.
+    """
+
+    name = "replay"
+
+    def __init__(
+        self,
+        path: str,
+        inner: Optional[AIBackend] = None,
+        fallback: Optional[AIBackend] = None,
+        replay_latency: bool = True,
+    ):
+        self.path = Path(path)
+        self.name = "record" if inner is not None else "replay"
+        self.inner = inner
+        self.fallback = fallback
+        self.replay_latency = replay_latency
+        self._records: dict[str, dict] = {}
+        if self.path.exists():
+            with self.path.open(encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._records[record["key"]] = record
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        logger.info(f"Replay backend: {len(self._records)} completions loaded from {self.path}")
+
+    async def create(self, **request) -> Any:
+        key = request_key(request)
+        record = self._records.get(key)
+        if record is not None:
+            self.hits += 1
+            return await self._serve(record, request.get("stream"))
+        self.misses += 1
+        if self.inner is not None:
+            return await self._record(key, request)
+        if self.fallback is not None:
+            return await self.fallback.create(**request)
+        raise LookupError(f"No recorded completion for request {key[:12]}")
+
+    async def _serve(self, record: dict, stream: bool) -> Any:
+        content = record["content"]
+        pieces = _pieces(content)
+        usage = _usage(record.get("prompt_tokens", 0), len(pieces))
+        if not stream:
+            if self.replay_latency:
+                await asyncio.sleep(record["latency_ms"] / 1000)
+            return _completion(content, usage.prompt_tokens, len(pieces))
+
+        async def chunks():
+            if self.replay_latency:
+                await asyncio.sleep(record.get("first_token_ms", record["latency_ms"]) / 1000)
+            for piece in pieces:
+                yield _chunk(piece)
+            yield _chunk(None, usage)
+        return chunks()
+
+    def _save(self, key: str, content: str, latency_ms: float, first_token_ms: float, prompt_tokens: int):
+        record = {
+            "key": key,
+            "content": content,
+            "latency_ms": round(latency_ms, 1),
+            "first_token_ms": round(first_token_ms, 1),
+            "prompt_tokens": prompt_tokens,
+        }
+        self._records[key] = record
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.recorded += 1
+
+    async def _record(self, key: str, request: dict) -> Any:
+        started = time.perf_counter()
+        response = await self.inner.create(**request)
+        if not request.get("stream"):
+            usage = getattr(response, "usage", None)
+            self._save(
+                key,
+                response.choices[0].message.content or "",
+                (time.perf_counter() - started) * 1000,
+                (time.perf_counter() - started) * 1000,
+                getattr(usage, "prompt_tokens", 0) if usage else 0,
+            )
+            return response
+
+        async def tee():
+            parts = []
+            first_token_ms = None
+            prompt_tokens = 0
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - started) * 1000
+                    parts.append(chunk.choices[0].delta.content)
+                if getattr(chunk, "usage", None):
+                    prompt_tokens = chunk.usage.prompt_tokens
+                yield chunk
+            latency_ms = (time.perf_counter() - started) * 1000
+            self._save(key, "".join(parts), latency_ms, first_token_ms or latency_ms, prompt_tokens)
+        return tee()
+
+    def stats(self) -> dict:
+        return {"records": len(self._records), "hits": self.hits, "misses": self.misses, "recorded": self.recorded}
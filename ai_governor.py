@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Coroutine, Optional, TypeVar
+
+from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Ошибки, говорящие о недоступности провайдера: их считает предохранитель
+_OUTAGE_ERRORS = (asyncio.TimeoutError, APITimeoutError, APIConnectionError, InternalServerError, RateLimitError)
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: провайдер ИИ считается недоступным"""
+
+
+class CircuitBreaker:
+    """
+    closed -> open после threshold сбоев подряд; через reset_timeout — half-open:
+    запросы снова пропускаются, первый успех закрывает предохранитель, первый сбой открывает заново.
+    """
+
+    def __init__(self, threshold: int = 5, reset_timeout: float = 60):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_until = 0.0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.threshold:
+            return "closed"
+        return "open" if time.monotonic() < self.opened_until else "half-open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def record_success(self):
+        if self.failures >= self.threshold:
+            logger.info("✅ AI provider is back, circuit breaker closed")
+        self.failures = 0
+
+    def record_failure(self):
+        was_open = self.state == "open"
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_until = time.monotonic() + self.reset_timeout
+            if not was_open:
+                self.opened += 1
+                logger.warning(
+                    f"🔌 AI circuit breaker open for {self.reset_timeout:.0f}s after {self.failures} failures in a row"
+                )
+
+
+class AIGovernor:
+    """
+    Слой выполнения запросов к ИИ: не больше concurrency одновременных вызовов,
+    общий дедлайн на вызов (ожидание слота и повторы входят в него), повтор со случайной
+    задержкой при RateLimitError и предохранитель при сбоях провайдера.
+    Фоновые задачи ответов запускаются через spawn() и дожидаются при остановке в drain().
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 8,
+        timeout: float = 30,
+        retries: int = 2,
+        retry_base_delay: float = 1.0,
+        breaker_threshold: int = 5,
+        breaker_reset: float = 60,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_base_delay = retry_base_delay
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.concurrency = concurrency
+        self._tasks: set[asyncio.Task] = set()
+        self.active = 0
+        self.calls = 0
+        self.retried = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def is_open(self) -> bool:
+        return not self.breaker.allow()
+
+    async def _run(self, request: Callable[[], Awaitable[T]]) -> T:
+        async with self._semaphore:
+            self.active += 1
+            try:
+                return await request()
+            finally:
+                self.active -= 1
+
+    async def call(self, request: Callable[[], Awaitable[T]], timeout: Optional[float] = None) -> T:
+        """
+        Выполняет request() в рамках лимитов. Бросает CircuitOpenError, если предохранитель открыт,
+        и asyncio.TimeoutError по дедлайну.
+        """
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError("AI provider circuit breaker is open")
+        self.calls += 1
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        attempt = 0
+        try:
+            while True:
+                try:
+                    result = await asyncio.wait_for(self._run(request), deadline - loop.time())
+                except RateLimitError:
+                    attempt += 1
+                    # Full jitter: одновременно упёршиеся в лимит запросы не повторяются пачкой
+                    delay = random.uniform(0, self.retry_base_delay * 2 ** attempt)
+                    if attempt > self.retries or loop.time() + delay >= deadline:
+                        raise
+                    self.retried += 1
+                    logger.warning(f"⏱️ AI rate limit, retry {attempt}/{self.retries} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                self.breaker.record_success()
+                return result
+        except _OUTAGE_ERRORS as e:
+            if isinstance(e, asyncio.TimeoutError):
+                self.timeouts += 1
+            self.failures += 1
+            self.breaker.record_failure()
+            raise
+
+    def spawn(self, coro: Coroutine) -> asyncio.Task:
+        """Запускает фоновую задачу и держит ссылку на неё до завершения"""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def drain(self, timeout: float):
+        """При остановке даёт начатым ответам до timeout секунд, остальное отменяет"""
+        if not self._tasks:
+            return
+        logger.info(f"⏳ Waiting for {len(self._tasks)} AI tasks to finish...")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        logger.info(f"AI tasks drained ({len(pending)} cancelled), stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "breaker": self.breaker.state,
+            "breaker_opened": self.breaker.opened,
+            "tasks": len(self._tasks),
+            "active": self.active,
+            "concurrency": self.concurrency,
+            "calls": self.calls,
+            "retried": self.retried,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,160 @@
+import random
+import re
+from typing import Any, NamedTuple, Optional
+
+from cache import TTLCache, MISSING
+
+_PUNCT_RE = re.compile(r"[^\w\s]+")
+_SPACE_RE = re.compile(r"\s+")
+_NUMBER_RE = re.compile(r"\d+")
+
+# Слова, меняющие смысл при почти одинаковом тексте ("пришёл" / "не пришёл")
+_NEGATIONS = frozenset({"не", "нет", "ни", "никак", "not", "no", "dont", "cant", "never"})
+
+_MERSENNE = (1 << 61) - 1
+_SHINGLE = 3
+
+
+def normalize(text: str) -> str:
+    """Нижний регистр, ё → е, без пунктуации и эмодзи, одиночные пробелы"""
+    text = text.lower().replace("ё", "е")
+    text = _PUNCT_RE.sub(" ", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def _shingles(norm: str) -> frozenset:
+    padded = f" {norm} "
+    return frozenset(padded[i:i + _SHINGLE] for i in range(len(padded) - _SHINGLE + 1))
+
+
+def _guard(norm: str) -> tuple[frozenset, frozenset]:
+    words = norm.split()
+    return frozenset(_NUMBER_RE.findall(norm)), _NEGATIONS.intersection(words)
+
+
+class CachedAnswer(NamedTuple):
+    answer: Any         # Текст или AIReply — что вернул ИИ
+    latency_ms: float
+    shingles: frozenset
+    guard: tuple[frozenset, frozenset]
+    bands: tuple
+
+
+class AnswerCache:
+    """
+    Кеш ответов ИИ по (язык, тема, нормализованный текст).
+    Первый уровень — точное совпадение, второй — похожие сообщения: MinHash по символьным
+    триграммам с LSH-корзинами, кандидат подтверждается точным коэффициентом Жаккара.
+    Числа и отрицания должны совпадать, иначе "пришёл" и "не пришёл" дали бы один ответ.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 5000,
+        ttl: Optional[float] = 21600,
+        threshold: float = 0.8,
+        num_perm: int = 64,
+        bands: int = 16,
+        min_fuzzy_chars: int = 8,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        self._entries = TTLCache(maxsize, ttl, on_evict=self._unindex)
+        # (lang, topic, номер полосы, хеш полосы) -> ключи записей
+        self._buckets: dict[tuple, set] = {}
+        self.threshold = threshold
+        self.min_fuzzy_chars = min_fuzzy_chars
+        self._rows = num_perm // bands
+        rnd = random.Random(0x616E73)
+        self._perms = [(rnd.randrange(1, _MERSENNE), rnd.randrange(0, _MERSENNE)) for _ in range(num_perm)]
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.latency_saved_ms = 0.0
+
+    def _signature(self, shingles: frozenset) -> list[int]:
+        hashes = [hash(shingle) & _MERSENNE for shingle in shingles]
+        return [min((a * h + b) % _MERSENNE for h in hashes) for a, b in self._perms]
+
+    def _band_keys(self, lang: str, topic: Optional[str], shingles: frozenset) -> tuple:
+        signature = self._signature(shingles)
+        rows = self._rows
+        return tuple(
+            (lang, topic, i, hash(tuple(signature[i * rows:(i + 1) * rows])))
+            for i in range(len(signature) // rows)
+        )
+
+    def _unindex(self, key, entry: CachedAnswer):
+        for band in entry.bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band]
+
+    def get(self, text: str, lang: str, topic: Optional[str] = None) -> Any:
+        norm = normalize(text)
+        if not norm:
+            return None
+        entry = self._entries.get((lang, topic, norm))
+        if entry is not MISSING:
+            self.exact_hits += 1
+            self.latency_saved_ms += entry.latency_ms
+            return entry.answer
+
+        if self.threshold < 1 and len(norm) >= self.min_fuzzy_chars:
+            shingles = _shingles(norm)
+            guard = _guard(norm)
+            best_key, best_score = None, self.threshold
+            candidates = set()
+            for band in self._band_keys(lang, topic, shingles):
+                candidates.update(self._buckets.get(band, ()))
+            for key in candidates:
+                candidate = self._entries.peek(key)
+                if candidate is MISSING or candidate.guard != guard:
+                    continue
+                score = len(shingles & candidate.shingles) / len(shingles | candidate.shingles)
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is not None:
+                entry = self._entries.get(best_key)
+                self.similar_hits += 1
+                self.latency_saved_ms += entry.latency_ms
+                return entry.answer
+
+        self.misses += 1
+        return None
+
+    def set(self, text: str, lang: str, topic: Optional[str], answer: Any, latency_ms: float):
+        norm = normalize(text)
+        if not norm:
+            return
+        key = (lang, topic, norm)
+        shingles = _shingles(norm)
+        bands = self._band_keys(lang, topic, shingles) if len(norm) >= self.min_fuzzy_chars else ()
+        # Старую запись снимаем из индекса до замены (pop вызывает _unindex)
+        self._entries.pop(key)
+        self._entries.set(key, CachedAnswer(answer, latency_ms, shingles, _guard(norm), bands))
+        for band in bands:
+            self._buckets.setdefault(band, set()).add(key)
+        self.stores += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._buckets.clear()
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self._entries.maxsize,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self._entries.evictions,
+            "expirations": self._entries.expirations,
+            "hit_ratio": round((self.exact_hits + self.similar_hits) / lookups, 3) if lookups else 0.0,
+            "latency_saved_ms": round(self.latency_saved_ms, 1),
+        }
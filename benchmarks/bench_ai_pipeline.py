@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный прогон ответа ИИ на сообщения клиентов в открытых тикетах. Сообщение входит так же,
+как из forward_to_support: сохранение в историю и message_coalescer.add; дальше — окно склейки,
+FAQ-поиск, история диалога, governor, потоковая отправка, очередь исходящих с её лимитами,
+пересылка в чат поддержки и пометки тикета.
+Не входят: разбор апдейта aiogram, FSM, create_ticket/forward_to_support и запись в PostgreSQL
+(вместо БД — словари в памяти, вместо LLM — fake или записанные ответы, вместо Telegram — заглушка
+с заданной задержкой), так что прогон не требует сети и ключей.
+Использование: python benchmarks/bench_ai_pipeline.py [--tickets 50] [--turns 3] [--backend fake]
+    [--latency lognormal:800:0.5] [--token-ms 15] [--tg-latency 40] [--window 2] [--error-rate 0] [--seed 1]
+Печатает p50/p95/p99: до первого сообщения клиенту, ход целиком, из них запрос к ИИ и остальное
+(Telegram и очередь исходящих), а также ожидание в очереди исходящих по приоритетам
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickets", type=int, default=50, help="одновременных тикетов")
+    parser.add_argument("--turns", type=int, default=3, help="сообщений клиента в каждом тикете")
+    parser.add_argument("--backend", choices=["fake", "replay", "record"], default="fake")
+    parser.add_argument("--replay-path", default="ai_replay.jsonl", help="файл записанных ответов")
+    parser.add_argument("--latency", default="lognormal:800:0.5", help="задержка fake до первого токена, мс")
+    parser.add_argument("--token-ms", type=float, default=15, help="пауза между чанками fake, мс")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля запросов fake с таймаутом")
+    parser.add_argument("--tg-latency", type=float, default=40, help="задержка ответа Telegram API, мс")
+    parser.add_argument("--window", type=float, default=None, help="окно склейки сообщений, сек (по умолчанию из конфига)")
+    parser.add_argument("--think", type=float, default=0.5, help="пауза клиента между сообщениями, сек")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+args = parse_args()
+
+# Конфигурация читается при импорте модулей бота — окружение задаётся до них
+os.environ.setdefault("API_TOKEN", "123456789:BENCHMARKbenchmarkBENCHMARKbenchmark")
+os.environ["AI_BACKEND"] = args.backend
+os.environ["AI_REPLAY_PATH"] = args.replay_path
+os.environ["AI_FAKE_LATENCY"] = args.latency
+os.environ["AI_FAKE_TOKEN_MS"] = str(args.token_ms)
+
+from aiogram.methods import SendMessage  # noqa: E402
+from aiogram.types import Chat, Message  # noqa: E402
+
+import database  # noqa: E402
+import handlers  # noqa: E402
+from ai_assistant import ai_assistant  # noqa: E402
+from ai_backends import FakeBackend, LatencyModel  # noqa: E402
+from config import FAQ_QUESTIONS, SUPPORT_CHAT_ID  # noqa: E402
+from faq_index import faq_index  # noqa: E402
+
+FILLER = [
+    "Здравствуйте, подскажите пожалуйста",
+    "пока ничего не пришло на баланс",
+    "сделал всё по инструкции из профиля",
+    "а можно как-то быстрее?",
+    "спасибо, а что делать если не помогло",
+]
+
+
+class FakeTelegram:
+    """Ответы Telegram API с задержкой; первая отправка в личный чат фиксирует время до ответа клиенту"""
+
+    def __init__(self, latency_ms: float):
+        self.latency_ms = latency_ms
+        self.message_id = 0
+        self.calls = 0
+        self.first_reply: dict[int, float] = {}
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        await asyncio.sleep(self.latency_ms / 1000)
+        if not isinstance(method, SendMessage):
+            return True
+        chat_id = int(method.chat_id)
+        if chat_id != SUPPORT_CHAT_ID:
+            self.first_reply.setdefault(chat_id, time.perf_counter())
+        self.message_id += 1
+        return Message(
+            message_id=self.message_id,
+            date=datetime.now(),
+            chat=Chat(id=chat_id, type="supergroup" if chat_id == SUPPORT_CHAT_ID else "private"),
+        )
+
+
+class TicketStore:
+    """Открытые тикеты в памяти вместо PostgreSQL — ровно те функции, что вызывает путь ответа ИИ"""
+
+    def __init__(self, tickets: int):
+        topics = list(FAQ_QUESTIONS)
+        self.tickets = {
+            user_id: {"thread_id": 10_000 + user_id, "topic": topics[user_id % len(topics)], "human": False, "ai": 0}
+            for user_id in range(1, tickets + 1)
+        }
+        self.messages: dict[int, list[tuple]] = {}
+        # Id сообщений клиента не должны совпасть с id, выданными FakeTelegram
+        self.message_id = 10 ** 9
+
+    async def get_ticket(self, user_id: int):
+        ticket = self.tickets.get(user_id)
+        if not ticket:
+            return None, None, None, None, False, False
+        return ticket["thread_id"], "open", ticket["topic"], None, ticket["human"], ticket["ai"] > 0
+
+    async def check_if_human_responded(self, user_id: int) -> bool:
+        return self.tickets[user_id]["human"]
+
+    async def get_ai_response_count(self, user_id: int) -> int:
+        return self.tickets[user_id]["ai"]
+
+    async def mark_ai_responded(self, user_id: int):
+        self.tickets[user_id]["ai"] += 1
+
+    async def mark_human_responded(self, user_id: int):
+        self.tickets[user_id]["human"] = True
+
+    async def save_ticket_message(self, user_id, message_id, chat_id, thread_id, text=None, role=None):
+        if text:
+            self.messages.setdefault(user_id, []).append((message_id, role or "user", text))
+            handlers.conversations.handle_event("message", user_id, message_id=message_id, thread_id=thread_id, text=text, role=role)
+
+    async def get_ticket_history(self, user_id: int, thread_id: int, limit: int):
+        return self.messages.get(user_id, [])[-limit:]
+
+
+def install(store: TicketStore, telegram: FakeTelegram):
+    for name in ("get_ticket", "check_if_human_responded", "mark_ai_responded", "mark_human_responded", "save_ticket_message"):
+        setattr(handlers, name, getattr(store, name))
+    # _respond_with_ai импортирует счётчик из database при каждом вызове
+    database.get_ai_response_count = store.get_ai_response_count
+    handlers.conversations.load = store.get_ticket_history
+    # Middleware очереди исходящих остаются: подменяется только сам HTTP-запрос
+    handlers.bot.session.make_request = telegram.make_request
+    if args.backend == "fake":
+        ai_assistant.backend = FakeBackend(
+            LatencyModel(args.latency), args.token_ms, error_rate=args.error_rate, seed=args.seed
+        )
+
+
+def message_pool(seed: int) -> list[str]:
+    """Вопросы из FAQ (часть уйдёт прямым ответом), их перефразировки и произвольные сообщения"""
+    rnd = random.Random(seed)
+    questions = [
+        text for topic in FAQ_QUESTIONS.values() for key, text in topic.get("ru", {}).items() if key.startswith("question")
+    ]
+    pool = questions + [f"{rnd.choice(FILLER)}, {q.lower()}" for q in questions]
+    pool += [" ".join(rnd.sample(FILLER, 3)) + f" (заказ {rnd.randint(1000, 9999)})" for _ in range(100)]
+    return pool
+
+
+# Клиент, чей ход выполняется в текущей задаче
+_turn_user: ContextVar[int | None] = ContextVar("bench_turn_user", default=None)
+
+
+class TurnTimer:
+    """Время хода: от message_coalescer.add до конца ответа, начало хода после окна склейки и запрос к ИИ"""
+
+    def __init__(self):
+        self.done: dict[int, asyncio.Future] = {}
+        self.fired: dict[int, float] = {}
+        self.ai_ms: dict[int, float] = {}
+
+    def install(self):
+        respond = handlers.message_coalescer.respond
+        get_ai_reply = ai_assistant.get_ai_reply
+
+        async def timed_respond(user_id, text, **kwargs):
+            self.fired[user_id] = time.perf_counter()
+            _turn_user.set(user_id)
+            try:
+                return await respond(user_id, text, **kwargs)
+            finally:
+                future = self.done.get(user_id)
+                if future is not None and not future.done():
+                    future.set_result(time.perf_counter())
+
+        async def timed_ai_reply(*a, **kw):
+            started = time.perf_counter()
+            try:
+                return await get_ai_reply(*a, **kw)
+            finally:
+                self.ai_ms[_turn_user.get()] = (time.perf_counter() - started) * 1000
+
+        handlers.message_coalescer.respond = timed_respond
+        ai_assistant.get_ai_reply = timed_ai_reply
+
+
+async def run_ticket(
+    user_id: int, store: TicketStore, telegram: FakeTelegram, timer: TurnTimer, pool: list[str],
+    rnd: random.Random, results: dict,
+):
+    await asyncio.sleep(rnd.uniform(0, 1))
+    for _ in range(args.turns):
+        if store.tickets[user_id]["human"]:
+            results["handed_over"] += 1
+            return
+        text = rnd.choice(pool)
+        store.message_id += 1
+        await store.save_ticket_message(user_id, store.message_id, user_id, store.tickets[user_id]["thread_id"], text=text, role="user")
+        telegram.first_reply.pop(user_id, None)
+        timer.ai_ms.pop(user_id, None)
+        timer.done[user_id] = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        # Как forward_to_support для открытого тикета
+        handlers.message_coalescer.add(user_id, text, lang="ru")
+        finished = await timer.done[user_id]
+        first = telegram.first_reply.get(user_id)
+        if first is not None:
+            results["ttfb"].append((first - started) * 1000)
+        total = (finished - started) * 1000
+        results["total"].append(total)
+        ai_ms = timer.ai_ms.get(user_id)
+        if ai_ms is not None:
+            results["ai"].append(ai_ms)
+            # Всё, кроме окна склейки и запроса к ИИ: БД-заглушки, Telegram и ожидание в очереди исходящих
+            results["rest"].append((finished - timer.fired[user_id]) * 1000 - ai_ms)
+        await asyncio.sleep(rnd.expovariate(1 / args.think) if args.think > 0 else 0)
+
+
+def percentiles(values: list[float]) -> str:
+    if len(values) < 2:
+        return "нет данных"
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return f"p50={cuts[49]:7.0f}  p95={cuts[94]:7.0f}  p99={cuts[98]:7.0f}  max={max(values):7.0f} ms  (n={len(values)})"
+
+
+def queue_waits(stats: dict) -> str:
+    return ", ".join(f"{name} avg={wait['avg']:.0f} max={wait['max']:.0f}" for name, wait in stats["wait_ms"].items())
+
+
+async def main():
+    store = TicketStore(args.tickets)
+    telegram = FakeTelegram(args.tg_latency)
+    timer = TurnTimer()
+    install(store, telegram)
+    timer.install()
+    if args.window is not None:
+        handlers.message_coalescer.window = args.window
+    ai_assistant.compile_prompts()
+    faq_index.build(FAQ_QUESTIONS)
+    pool = message_pool(args.seed)
+    results = {"ttfb": [], "total": [], "ai": [], "rest": [], "handed_over": 0}
+
+    print(f"Бэкенд: {ai_assistant.backend.name}, тикетов: {args.tickets}, сообщений в тикете: {args.turns}, "
+          f"окно склейки: {handlers.message_coalescer.window} с")
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_ticket(user_id, store, telegram, timer, pool, random.Random(args.seed * 100_000 + user_id), results)
+        for user_id in store.tickets
+    ))
+    elapsed = time.perf_counter() - started
+    queue_stats = handlers.outbound_queue.stats()
+
+    print(f"До первого сообщения клиенту: {percentiles(results['ttfb'])}")
+    print(f"Ход целиком (с окном склейки): {percentiles(results['total'])}")
+    print(f"  запрос к ИИ:                 {percentiles(results['ai'])}")
+    print(f"  Telegram и очередь:          {percentiles(results['rest'])}")
+    print(f"Ожидание в очереди исходящих, ms: {queue_waits(queue_stats)}")
+    print(f"Ходов: {len(results['total'])} за {elapsed:.1f} с ({len(results['total']) / elapsed:.1f}/с), "
+          f"переданы оператору: {results['handed_over']}, запросов к Telegram: {telegram.calls}")
+    print(f"Governor: {ai_assistant.governor.stats()}")
+    print(f"Промпты: {ai_assistant.prompt_stats()}")
+    if ai_assistant.answer_cache:
+        print(f"Кэш ответов: {ai_assistant.answer_cache.stats()}")
+    print(f"Склейка: {handlers.message_coalescer.stats()}")
+    print(f"Стриминг: {handlers.reply_streamer.stats()}")
+    print(f"FAQ: {faq_index.stats()}")
+    print(f"История: {handlers.conversations.stats()}")
+    print(f"Очередь исходящих: {queue_stats}")
+    if hasattr(ai_assistant.backend, "stats"):
+        print(f"Бэкенд: {ai_assistant.backend.stats()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Сравнение движков MessageToHtmlConverter: прежний (LegacyMessageToHtmlConverter) и однопроходный
+Использование: python benchmarks/bench_html_converter.py [--repeat 5] [--scale 1]
+Перед замером проверяет, что оба движка выдают побайтно одинаковый HTML
+"""
+
+import argparse
+import random
+import sys
+import timeit
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import MessageToHtmlConverter, LegacyMessageToHtmlConverter  # noqa: E402
+
+
+@dataclass
+class Entity:
+    """Минимальная замена aiogram.types.MessageEntity: конвертеру нужны только эти поля"""
+    type: str
+    offset: int
+    length: int
+    url: Optional[str] = None
+
+
+def _utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _build(chunks: list[tuple[str, Optional[str]]]) -> tuple[str, list[Entity]]:
+    """Собирает сообщение из кусков (текст, тип сущности) с корректными UTF-16 смещениями"""
+    parts = []
+    entities = []
+    offset = 0
+    for text, entity_type in chunks:
+        length = _utf16_len(text)
+        if entity_type:
+            url = "https://example.com/?q=1&r=<2>" if entity_type == "text_link" else None
+            entities.append(Entity(entity_type, offset, length, url))
+        parts.append(text)
+        offset += length
+    return "".join(parts), entities
+
+
+def long_message(scale: int) -> tuple[str, list[Entity]]:
+    line = "Строка обращения клиента с деталями проблемы & <символами>, которые надо экранировать\n"
+    chunks = [(line, None) for _ in range(400 * scale)]
+    chunks.insert(0, ("Заголовок\n", "bold"))
+    return _build(chunks)
+
+
+def entity_heavy(scale: int) -> tuple[str, list[Entity]]:
+    rnd = random.Random(42)
+    kinds = ["bold", "italic", "code", "underline", "strikethrough", "spoiler", "text_link", "url", "hashtag"]
+    chunks = []
+    for i in range(1500 * scale):
+        kind = rnd.choice(kinds)
+        text = "https://example.com/page" if kind == "url" else f"слово{i}"
+        chunks.append((text, kind))
+        chunks.append((" " if i % 10 else "\n", None))
+    return _build(chunks)
+
+
+def emoji_heavy(scale: int) -> tuple[str, list[Entity]]:
+    rnd = random.Random(7)
+    emoji = ["😀", "👍🏽", "🚀", "🎁", "💰", "🆘", "👨‍👩‍👧"]
+    chunks = []
+    for i in range(1500 * scale):
+        chunks.append(("".join(rnd.choice(emoji) for _ in range(3)), None))
+        chunks.append((f" текст {i} ", "bold" if i % 3 == 0 else None))
+        if i % 5 == 0:
+            chunks.append(("\n", None))
+    return _build(chunks)
+
+
+CASES = {
+    "long": long_message,
+    "entity-heavy": entity_heavy,
+    "emoji-heavy": emoji_heavy,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=int, default=1, help="Множитель размера сообщений")
+    args = parser.parse_args()
+
+    print(f"{'case':<14}{'chars':>8}{'entities':>10}{'legacy ms':>12}{'new ms':>10}{'speedup':>10}")
+    for name, factory in CASES.items():
+        message, entities = factory(args.scale)
+        legacy_html = LegacyMessageToHtmlConverter(message, entities).html
+        new_html = MessageToHtmlConverter(message, entities).html
+        if legacy_html.encode() != new_html.encode():
+            print(f"❌ {name}: output differs from legacy engine")
+            sys.exit(1)
+
+        legacy = min(timeit.repeat(lambda: LegacyMessageToHtmlConverter(message, entities), number=1, repeat=args.repeat))
+        new = min(timeit.repeat(lambda: MessageToHtmlConverter(message, entities), number=1, repeat=args.repeat))
+        print(
+            f"{name:<14}{len(message):>8}{len(entities):>10}"
+            f"{legacy * 1000:>12.2f}{new * 1000:>10.2f}{legacy / new:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Сравнение прежних проверок эскалации (по подстроке за раз) и KeywordMatcher
+Использование: python benchmarks/bench_keyword_matcher.py [--repeat 5] [--number 200]
+Перед замером проверяет, что решения совпадают на наборе сгенерированных сообщений
+"""
+
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config import EMOTION_KEYWORDS, EMOTION_ESCALATION_SCORE, AI_RESPONSE_KEYWORDS  # noqa: E402
+from keyword_matcher import KeywordMatcher  # noqa: E402
+
+
+def _words(categories: dict, name: str) -> list[str]:
+    return categories[name]["keywords"]
+
+
+def legacy_detect_strong_emotion(message: str) -> bool:
+    """Прежний detect_strong_emotion без логирования: по списку на категорию, по слову за раз"""
+    message_lower = message.lower()
+    for word in _words(EMOTION_KEYWORDS, "profanity"):
+        if word in message_lower:
+            return True
+    for phrase in _words(EMOTION_KEYWORDS, "technical_issue"):
+        if phrase in message_lower:
+            return True
+    for phrase in _words(EMOTION_KEYWORDS, "waiting_question"):
+        if phrase in message_lower:
+            return True
+    negative_count = sum(1 for word in _words(EMOTION_KEYWORDS, "strong_negative") if word in message_lower)
+    if negative_count >= 2:
+        return True
+    if "уже" in message_lower and any(word in message_lower for word in _words(EMOTION_KEYWORDS, "wait_time")):
+        return True
+    return False
+
+
+def legacy_response_checks(ai_response: str) -> tuple[bool, bool]:
+    """Прежние ai_wants_to_escalate и should_escalate_to_human: каждая со своим lower() и списком"""
+    response_lower = ai_response.lower()
+    handoff = any(phrase in response_lower for phrase in _words(AI_RESPONSE_KEYWORDS, "handoff"))
+    ai_response_lower = ai_response.lower()
+    referral = any(keyword in ai_response_lower for keyword in _words(AI_RESPONSE_KEYWORDS, "referral"))
+    return handoff, referral
+
+
+emotion_matcher = KeywordMatcher(EMOTION_KEYWORDS)
+response_matcher = KeywordMatcher(AI_RESPONSE_KEYWORDS)
+
+
+def new_detect_strong_emotion(message: str) -> bool:
+    found = emotion_matcher.match(message)
+    return found.score >= EMOTION_ESCALATION_SCORE or ("already" in found and "wait_time" in found)
+
+
+def new_response_checks(ai_response: str) -> tuple[bool, bool]:
+    found = response_matcher.match(ai_response)
+    return "handoff" in found, "referral" in found
+
+
+FILLER = (
+    "Здравствуйте, у меня вопрос по выводу подарков, сделал всё по инструкции из профиля, "
+    "но пока ничего не пришло на аккаунт, подскажите пожалуйста что проверить. "
+)
+
+
+def _all_keywords(categories: dict) -> list[str]:
+    return [keyword for spec in categories.values() for keyword in spec["keywords"]]
+
+
+def random_messages(count: int, seed: int) -> list[str]:
+    """Сообщения из обычного текста с вкраплениями ключевых слов, в том числе перекрывающихся"""
+    rnd = random.Random(seed)
+    vocabulary = FILLER.split() + _all_keywords(EMOTION_KEYWORDS) + _all_keywords(AI_RESPONSE_KEYWORDS)
+    messages = []
+    for _ in range(count):
+        words = [rnd.choice(vocabulary) for _ in range(rnd.randint(1, 30))]
+        # Склейка без пробела даёт вхождения, перекрывающиеся на стыке
+        messages.append("".join(w if rnd.random() < 0.2 else w + " " for w in words).capitalize())
+    return messages
+
+
+def check_equivalence(count: int = 20000):
+    for message in random_messages(count, seed=1):
+        if legacy_detect_strong_emotion(message) != new_detect_strong_emotion(message):
+            print(f"❌ detect_strong_emotion differs on: {message!r}")
+            sys.exit(1)
+        if legacy_response_checks(message) != new_response_checks(message):
+            print(f"❌ response checks differ on: {message!r}")
+            sys.exit(1)
+    print(f"✅ {count} messages: legacy checks and KeywordMatcher agree")
+
+
+def varied_text(chars: int, seed: int) -> str:
+    """Текст почти без повторов: каждое слово — случайный набор букв"""
+    rnd = random.Random(seed)
+    letters = "абвгдежзийклмнопрстуфхцчшщыьэюя"
+    words = []
+    while sum(len(word) + 1 for word in words) < chars:
+        words.append("".join(rnd.choice(letters) for _ in range(rnd.randint(2, 10))))
+    return " ".join(words)[:chars]
+
+
+CASES = {
+    "short": "Не пришел депозит, помогите",
+    "medium": FILLER * 3,
+    "long-4k": (FILLER * 30)[:4096],
+    "long-4k-hit-end": (FILLER * 30)[:4080] + " жду уже сутки",
+    "long-4k-varied": varied_text(4096, seed=3),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    check_equivalence()
+    print(f"{'case':<18}{'chars':>7}{'legacy us':>12}{'matcher us':>12}{'speedup':>10}")
+    for name, message in CASES.items():
+        def legacy():
+            legacy_detect_strong_emotion(message)
+            legacy_response_checks(message)
+
+        def new():
+            new_detect_strong_emotion(message)
+            new_response_checks(message)
+
+        legacy_time = min(timeit.repeat(legacy, number=args.number, repeat=args.repeat)) / args.number
+        new_time = min(timeit.repeat(new, number=args.number, repeat=args.repeat)) / args.number
+        print(
+            f"{name:<18}{len(message):>7}{legacy_time * 1e6:>12.1f}"
+            f"{new_time * 1e6:>12.1f}{legacy_time / new_time:>9.1f}x"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import User
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BotFacts:
+    """Данные о боте и рабочих чатах, которые не меняются между сообщениями"""
+    me: Optional[User] = None
+    forum_chats: dict[int, bool] = field(default_factory=dict)
+
+
+_facts = BotFacts()
+_refresh_task: Optional[asyncio.Task] = None
+
+
+async def load_bot_facts(bot: Bot, chat_ids: list[int]):
+    """Запрашивает get_me и признак форума у рабочих чатов; при ошибке оставляет прежние значения"""
+    try:
+        _facts.me = await bot.get_me()
+    except TelegramAPIError as exc:
+        logger.warning(f"Failed to load bot identity: {exc}")
+
+    for chat_id in chat_ids:
+        if not chat_id:
+            continue
+        try:
+            chat = await bot.get_chat(chat_id)
+        except TelegramAPIError as exc:
+            logger.warning(f"Failed to load chat {chat_id}: {exc}")
+            continue
+        _facts.forum_chats[chat_id] = bool(chat.is_forum)
+        if not chat.is_forum:
+            logger.warning(f"⚠️ Chat {chat_id} has no topics enabled: forum threads cannot be created there")
+
+    if _facts.me:
+        logger.info(f"🤖 Bot identity cached: @{_facts.me.username} (id {_facts.me.id}), forum chats: {_facts.forum_chats}")
+
+
+def get_bot_id(bot: Bot) -> int:
+    """id бота без запроса к API (до загрузки — из токена)"""
+    if _facts.me is not None:
+        return _facts.me.id
+    return bot.id
+
+
+def get_bot_user() -> Optional[User]:
+    return _facts.me
+
+
+def is_forum_chat(chat_id: int) -> Optional[bool]:
+    """True/False, если признак уже известен; None — не удалось проверить"""
+    return _facts.forum_chats.get(chat_id)
+
+
+async def _refresh_worker(bot: Bot, chat_ids: list[int], interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await load_bot_facts(bot, chat_ids)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.error(f"Bot facts refresh error: {exc}", exc_info=True)
+
+
+def start_bot_facts_refresh(bot: Bot, chat_ids: list[int], interval_minutes: int):
+    global _refresh_task
+    if interval_minutes <= 0 or (_refresh_task is not None and not _refresh_task.done()):
+        return
+    _refresh_task = asyncio.create_task(_refresh_worker(bot, chat_ids, interval_minutes * 60))
+
+
+async def stop_bot_facts_refresh():
+    global _refresh_task
+    if _refresh_task is None:
+        return
+    _refresh_task.cancel()
+    try:
+        await _refresh_task
+    except asyncio.CancelledError:
+        pass
+    _refresh_task = None
@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+# Маркер отсутствия значения (None в кеше — валидное значение)
+MISSING = object()
+
+
+class TTLCache:
+    """Ограниченный LRU-кеш с временем жизни записей и счётчиками попаданий"""
+
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: Optional[float] = None,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._on_evict = on_evict
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at and expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            self._notify_evict(key, value)
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Возвращает значение без учёта в статистике и без продления LRU"""
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at and expires_at <= time.monotonic():
+            del self._data[key]
+            self.expirations += 1
+            self._notify_evict(key, value)
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        now = time.monotonic()
+        expires_at = now + self.ttl if self.ttl else 0.0
+        item = self._data.pop(key, None)
+        if item is not None:
+            # Старое значение уходит из кеша так же, как при вытеснении
+            old_expires_at, old_value = item
+            if old_expires_at and old_expires_at <= now:
+                self.expirations += 1
+            if old_value is not value:
+                self._notify_evict(key, old_value)
+        self._data[key] = (expires_at, value)
+        while len(self._data) > self.maxsize:
+            old_key, (_, old_value) = self._data.popitem(last=False)
+            self.evictions += 1
+            self._notify_evict(old_key, old_value)
+
+    def pop(self, key: Hashable, default: Any = MISSING) -> Any:
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        self._notify_evict(key, item[1])
+        return item[1]
+
+    def clear(self):
+        for key, (_, value) in list(self._data.items()):
+            self._notify_evict(key, value)
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.peek(key) is not MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _notify_evict(self, key: Hashable, value: Any):
+        if self._on_evict is not None:
+            self._on_evict(key, value)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -10,8 +10,11 @@ from aiogram.exceptions import TelegramAPIError
 from config import API_TOKEN, SUPPORT_CHAT_ID
 from database import get_db_pool
 from datetime import datetime
+from outbound import setup_outbound_queue
 
 bot = Bot(token=API_TOKEN)
+# Массовое закрытие упирается в лимиты Telegram: запросы идут через общую очередь
+setup_outbound_queue(bot)
 
 async def close_all_tickets():
     """Закрывает все открытые тикеты"""
@@ -47,6 +47,28 @@ POSTGRES_DB = os.getenv("POSTGRES_DB", "support_bot")
 POSTGRES_HOST = os.getenv("POSTGRES_HOST", "db")
 POSTGRES_PORT = int(os.getenv("POSTGRES_PORT", "5433"))
 
+# Write-behind буфер для обновлений активности тикетов
+DB_WRITE_BEHIND_ENABLED = os.getenv("DB_WRITE_BEHIND_ENABLED", "true").lower() == "true"
+DB_FLUSH_INTERVAL = float(os.getenv("DB_FLUSH_INTERVAL", "1.0"))  # Секунды между сбросами буфера
+DB_FLUSH_BATCH_SIZE = int(os.getenv("DB_FLUSH_BATCH_SIZE", "500"))  # Досрочный сброс при таком размере очереди
+
+# Кеш состояния тикетов в памяти процесса
+TICKET_CACHE_SIZE = int(os.getenv("TICKET_CACHE_SIZE", "10000"))
+TICKET_CACHE_TTL = float(os.getenv("TICKET_CACHE_TTL", "300"))  # Секунды
+# local — блокировки тикетов внутри процесса, postgres — advisory-блокировки, общие для всех реплик
+TICKET_LOCK_BACKEND = os.getenv("TICKET_LOCK_BACKEND", "local").lower()
+
+# Несколько реплик: FSM-хранилище и выбор лидера для воркера напоминаний
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres").lower()  # postgres или memory
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "30"))  # Секунды; столько реплика может не видеть чужое изменение
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))  # Секунды между пакетными записями
+REMINDER_LEADER_ELECTION = os.getenv("REMINDER_LEADER_ELECTION", "true").lower() == "true"
+
+# Кеш языков пользователей (LRU + TTL)
+LANGUAGE_CACHE_SIZE = int(os.getenv("LANGUAGE_CACHE_SIZE", "50000"))
+LANGUAGE_CACHE_TTL = float(os.getenv("LANGUAGE_CACHE_TTL", "3600"))  # Секунды
+
 # AI Assistant settings
 AI_ENABLED = os.getenv("AI_ENABLED", "true").lower() == "true"
 AI_API_KEY = os.getenv("OPENAI_API_KEY", "")
@@ -55,11 +77,118 @@ AI_MAX_TOKENS = int(os.getenv("AI_MAX_TOKENS", "1000"))
 AI_TEMPERATURE = float(os.getenv("AI_TEMPERATURE", "0.7"))
 AI_AUTO_RESPOND = os.getenv("AI_AUTO_RESPOND", "true").lower() == "true"
 AI_MAX_RESPONSES = int(os.getenv("AI_MAX_RESPONSES", "2"))  # Максимум ответов ИИ до передачи оператору
+AI_TITLE_TIMEOUT = float(os.getenv("AI_TITLE_TIMEOUT", "10"))  # Секунды на ИИ-название темы, потом остаётся обычное
+AI_STRUCTURED_OUTPUT = os.getenv("AI_STRUCTURED_OUTPUT", "true").lower() == "true"  # Ответ, эскалация, тональность и название одним JSON-запросом
+AI_STREAMING = os.getenv("AI_STREAMING", "true").lower() == "true"  # Показывать ответ ИИ клиенту по мере генерации
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.5"))  # Секунды между правками сообщения при потоковом ответе
+AI_STREAM_MIN_CHARS = int(os.getenv("AI_STREAM_MIN_CHARS", "40"))  # Символов ответа до отправки первого фрагмента
+AI_CONCURRENCY = int(os.getenv("AI_CONCURRENCY", "8"))  # Одновременных запросов к API ИИ
+AI_REQUEST_TIMEOUT = float(os.getenv("AI_REQUEST_TIMEOUT", "30"))  # Дедлайн на запрос к ИИ вместе с ожиданием и повторами, секунды
+AI_RETRIES = int(os.getenv("AI_RETRIES", "2"))  # Повторов при rate limit
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "1"))  # Базовая задержка повтора (экспонента со случайным разбросом), секунды
+AI_BREAKER_THRESHOLD = int(os.getenv("AI_BREAKER_THRESHOLD", "5"))  # Сбоев подряд до отключения запросов к ИИ
+AI_BREAKER_RESET = float(os.getenv("AI_BREAKER_RESET", "60"))  # Через сколько секунд снова пробовать ИИ после отключения
+AI_DRAIN_TIMEOUT = float(os.getenv("AI_DRAIN_TIMEOUT", "15"))  # Сколько ждать начатые ответы ИИ при остановке, секунды
+AI_COALESCE_WINDOW = float(os.getenv("AI_COALESCE_WINDOW", str(MEDIA_GROUP_TIMEOUT)))  # Сообщения клиента с паузой меньше этой (сек) — один ответ ИИ
+AI_HISTORY_ENABLED = os.getenv("AI_HISTORY_ENABLED", "true").lower() == "true"  # Передавать ИИ историю диалога по тикету
+AI_HISTORY_TURNS = int(os.getenv("AI_HISTORY_TURNS", "20"))  # Последних реплик в истории, старые сжимаются в резюме
+AI_HISTORY_TOKENS = int(os.getenv("AI_HISTORY_TOKENS", "1500"))  # Бюджет токенов на реплики истории
+AI_HISTORY_CACHE_SIZE = int(os.getenv("AI_HISTORY_CACHE_SIZE", "5000"))  # Тикетов с историей в памяти
+AI_BACKEND = os.getenv("AI_BACKEND", "openai")  # openai, fake (локальная замена для нагрузочных прогонов), replay или record
+AI_FAKE_LATENCY = os.getenv("AI_FAKE_LATENCY", "lognormal:800:0.5")  # Задержка до первого токена fake-бэкенда, мс: fixed:X, uniform:A:B, normal:M:S, lognormal:MEDIAN:SIGMA
+AI_FAKE_TOKEN_MS = float(os.getenv("AI_FAKE_TOKEN_MS", "15"))  # Пауза между чанками fake-бэкенда, мс
+AI_REPLAY_PATH = os.getenv("AI_REPLAY_PATH", "ai_replay.jsonl")  # Файл записанных ответов для replay/record
+
+# Кеш ответов ИИ: точное совпадение нормализованного текста + поиск похожих (MinHash)
+AI_ANSWER_CACHE_ENABLED = os.getenv("AI_ANSWER_CACHE_ENABLED", "true").lower() == "true"
+AI_ANSWER_CACHE_SIZE = int(os.getenv("AI_ANSWER_CACHE_SIZE", "5000"))
+AI_ANSWER_CACHE_TTL = float(os.getenv("AI_ANSWER_CACHE_TTL", "21600"))  # Секунды; после правки FAQ ответы устаревают
+AI_ANSWER_CACHE_SIMILARITY = float(os.getenv("AI_ANSWER_CACHE_SIMILARITY", "0.8"))  # Порог сходства по Жаккару, 1 — только точные
+
+# Ключевые слова для передачи оператору: категория -> вес и подстроки (нижний регистр).
+# Сообщение клиента передаётся оператору, если сумма weight * число разных найденных слов
+# достигает EMOTION_ESCALATION_SCORE; "already" + "wait_time" вместе — долгое ожидание
+EMOTION_KEYWORDS = {
+    # Мат и грубая лексика
+    "profanity": {"weight": 1.0, "keywords": [
+        "блять", "бля", "блядь", "ебать", "ебал", "хуй", "пизд", "сука",
+        "гавно", "говно", "дерьм", "fuck", "shit", "damn", "asshole",
+    ]},
+    # Сильные негативные эмоции (нужно минимум два слова)
+    "strong_negative": {"weight": 0.5, "keywords": [
+        "ненавижу", "отвратительн", "ужасн", "кошмар", "отстой",
+        "мошенник", "развод", "обман", "украл", "жалоб", "суд",
+        "возмущён", "возмущен", "жду уже", "часов", "дней", "недел",
+        "бред", "дебил",
+    ]},
+    # Технические проблемы требующие оператора (ошибки из приложения)
+    "technical_issue": {"weight": 1.0, "keywords": [
+        "обратитесь в поддержку", "обратитесь в службу", "обратитесь к поддержке",
+        "свяжитесь с поддержкой", "ошибка", "не могу вывести", "не могу поставить на вывод",
+        "не выводится", "не работает вывод",
+    ]},
+    # Вопросы про ожидание ответа оператора (пользователь хочет говорить с человеком)
+    "waiting_question": {"weight": 1.0, "keywords": [
+        "как скоро проверят", "когда проверят", "сколько ждать", "когда ответ",
+        "когда решат", "долго ждать", "когда рассмотрят",
+    ]},
+    "already": {"weight": 0.0, "keywords": ["уже"]},
+    "wait_time": {"weight": 0.0, "keywords": ["час", "день", "недел", "сутки"]},
+}
+EMOTION_ESCALATION_SCORE = float(os.getenv("EMOTION_ESCALATION_SCORE", "1.0"))
+
+# Фразы в ответе ИИ: "handoff" — ИИ сам передаёт вопрос, "referral" — советует обратиться к человеку
+AI_RESPONSE_KEYWORDS = {
+    "handoff": {"weight": 1.0, "keywords": [
+        "передаю", "передам", "уточню", "уточн", "коллег", "коллеге", "специалист", "оператор",
+        "детальн", "рассмотр", "занимаемся", "изучением", "вернёмся", "решением",
+    ]},
+    "referral": {"weight": 1.0, "keywords": [
+        "оператор", "специалист", "поддержк", "свяж", "не могу помочь", "не уверен", "рекомендую обратиться",
+    ]},
+}
+
+# Поиск по FAQ перед запросом к ИИ
+FAQ_RETRIEVAL_ENABLED = os.getenv("FAQ_RETRIEVAL_ENABLED", "true").lower() == "true"
+FAQ_DIRECT_ANSWER_THRESHOLD = float(os.getenv("FAQ_DIRECT_ANSWER_THRESHOLD", "0.8"))  # Уверенность для ответа из FAQ без ИИ, >1 — никогда
+FAQ_PROMPT_TOP_K = int(os.getenv("FAQ_PROMPT_TOP_K", "3"))  # Записей FAQ в промпте, 0 — весь FAQ
 
 # Auto-close settings
 AUTO_CLOSE_ENABLED = os.getenv("AUTO_CLOSE_ENABLED", "true").lower() == "true"
 AUTO_CLOSE_HOURS = int(os.getenv("AUTO_CLOSE_HOURS", "1"))  # Закрывать тикет если клиент не отвечает N часов
 
+# Reminder settings
+REMINDER_SWEEP_MINUTES = int(os.getenv("REMINDER_SWEEP_MINUTES", "5"))  # Проход по просроченным тикетам в БД
+REMINDER_CONCURRENCY = int(os.getenv("REMINDER_CONCURRENCY", "10"))  # Параллельных отправок напоминаний
+
+# Telegram rate limits
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # Сообщений в секунду на бота
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # Сообщений в секунду в личный чат
+TELEGRAM_GROUP_PER_MINUTE = int(os.getenv("TELEGRAM_GROUP_PER_MINUTE", "20"))  # Сообщений в минуту в группу
+TELEGRAM_SUPPORT_PER_MINUTE = float(os.getenv("TELEGRAM_SUPPORT_PER_MINUTE", "1800"))  # Запросов в минуту в чаты поддержки; упор в лимит Telegram разруливает RetryAfter
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))  # Повторов запроса после RetryAfter
+BOT_INFO_REFRESH_MINUTES = int(os.getenv("BOT_INFO_REFRESH_MINUTES", "60"))  # Обновление get_me и данных чатов, 0 — только при старте
+
+# Приём обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+DROP_PENDING_UPDATES = os.getenv("DROP_PENDING_UPDATES", "false").lower() == "true"  # Сбрасывать накопленные обновления при старте
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # Значение X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))  # Обновлений в очереди до ответа 503
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", "2"))  # Секунды ожидания места в очереди
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))  # Секунды на доработку очереди при остановке
+
+# Несколько реплик (postgres-блокировки или webhook): изменения тикетов рассылаются через LISTEN/NOTIFY,
+# и остальные реплики сбрасывают тикет из кеша. Чужие отметки оператора/ИИ видны через DB_FLUSH_INTERVAL
+TICKET_CACHE_SYNC = os.getenv(
+    "TICKET_CACHE_SYNC", "true" if TICKET_LOCK_BACKEND == "postgres" or BOT_MODE == "webhook" else "false"
+).lower() == "true"
+TICKET_CACHE_SYNC_TTL = float(os.getenv("TICKET_CACHE_SYNC_TTL", "30"))  # Секунды; столько реплика может не видеть чужое изменение, если уведомление потерялось
+
 TOPICS = {
     "balance": "💰 Balance",
     "withdrop": "🎁️ Withdrawal",
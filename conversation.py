@@ -0,0 +1,181 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+
+from cache import TTLCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+
+class Turn(NamedTuple):
+    message_id: int
+    role: str       # "user" — клиент, "assistant" — ответ ИИ, "operator" — оператор
+    text: str
+
+
+class HistoryContext(NamedTuple):
+    summary: Optional[str]  # Сжатое начало диалога, не поместившееся в буфер
+    turns: list[Turn]       # Последние реплики, без ещё не отвеченных сообщений клиента
+
+
+# (user_id, thread_id, limit) -> [(message_id, role, text)] от старых к новым
+HistoryLoader = Callable[[int, int, int], Awaitable[list[tuple]]]
+# (прежнее резюме, вытесненные реплики) -> новое резюме или None
+Summarizer = Callable[[Optional[str], list[Turn]], Awaitable[Optional[str]]]
+
+_SPEAKERS = {"user": "Клиент", "assistant": "Поддержка", "operator": "Оператор"}
+
+
+def approx_tokens(text: str) -> int:
+    return len(text.encode("utf-8")) // 4
+
+
+def extractive_summary(summary: Optional[str], turns: list[Turn], limit: int) -> str:
+    """Резюме без LLM: начало каждой реплики; при переполнении остаются самые свежие"""
+    lines = [summary] if summary else []
+    lines += [f"{_SPEAKERS.get(turn.role, 'Клиент')}: {turn.text[:150]}" for turn in turns]
+    return "\n".join(lines)[-limit:]
+
+
+class _Conversation:
+    def __init__(self, thread_id: int):
+        self.thread_id = thread_id
+        self.turns: deque[Turn] = deque()
+        self.tokens = 0
+        self.ids: set[int] = set()
+        self.summary: Optional[str] = None
+        self.overflow: list[Turn] = []  # Вытеснены из буфера, ещё не вошли в резюме
+        self.summarizing: Optional[asyncio.Task] = None
+
+
+class ConversationStore:
+    """
+    История диалога по открытым тикетам для запросов к ИИ. Буфер тикета живёт в памяти,
+    при первом обращении загружается из ticket_messages, дальше пополняется событиями "message"
+    из save_ticket_message — без чтения БД на каждый ход.
+    В буфере не больше max_turns реплик и token_budget токенов; вытесненные реплики
+    сжимаются в резюме (summarize в фоне, при его недоступности — начало реплик).
+    """
+
+    def __init__(
+        self,
+        load: HistoryLoader,
+        summarize: Optional[Summarizer] = None,
+        spawn: Callable[[Any], asyncio.Task] = asyncio.create_task,
+        max_turns: int = 20,
+        token_budget: int = 1500,
+        turn_chars: int = 1000,
+        summary_chars: int = 800,
+        cache_size: int = 5000,
+        cache_ttl: Optional[float] = 6 * 3600,
+    ):
+        self.load = load
+        self.summarize = summarize
+        self.spawn = spawn
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.turn_chars = turn_chars
+        self.summary_chars = summary_chars
+        self._conversations = TTLCache(cache_size, cache_ttl)
+        # user_id -> реплики, пришедшие во время загрузки из БД
+        self._loading: dict[int, list[Turn]] = {}
+        self.hydrations = 0
+        self.appended = 0
+        self.summaries = 0
+        self.summary_failures = 0
+
+    def _add(self, conversation: _Conversation, turn: Turn):
+        if turn.message_id in conversation.ids:
+            return
+        turn = turn._replace(text=turn.text[:self.turn_chars])
+        conversation.turns.append(turn)
+        conversation.ids.add(turn.message_id)
+        conversation.tokens += approx_tokens(turn.text)
+        while len(conversation.turns) > 1 and (
+            len(conversation.turns) > self.max_turns or conversation.tokens > self.token_budget
+        ):
+            old = conversation.turns.popleft()
+            conversation.ids.discard(old.message_id)
+            conversation.tokens -= approx_tokens(old.text)
+            conversation.overflow.append(old)
+        if conversation.overflow and self.summarize is None:
+            conversation.summary = extractive_summary(conversation.summary, conversation.overflow, self.summary_chars)
+            conversation.overflow.clear()
+
+    async def _get(self, user_id: int, thread_id: int) -> _Conversation:
+        conversation = self._conversations.get(user_id)
+        if conversation is not MISSING and conversation.thread_id == thread_id:
+            return conversation
+        early = self._loading.setdefault(user_id, [])
+        try:
+            rows = await self.load(user_id, thread_id, self.max_turns)
+        finally:
+            self._loading.pop(user_id, None)
+        self.hydrations += 1
+        conversation = _Conversation(thread_id)
+        for row in rows:
+            self._add(conversation, Turn(*row))
+        for turn in early:
+            self._add(conversation, turn)
+        self._conversations.set(user_id, conversation)
+        return conversation
+
+    async def context(self, user_id: int, thread_id: int) -> HistoryContext:
+        conversation = await self._get(user_id, thread_id)
+        self._schedule_summary(conversation)
+        turns = list(conversation.turns)
+        # Хвост из сообщений клиента — это и есть вопрос текущего хода, он уходит отдельно
+        while turns and turns[-1].role == "user":
+            turns.pop()
+        summary = conversation.summary
+        if conversation.overflow:
+            summary = extractive_summary(summary, conversation.overflow, self.summary_chars)
+        return HistoryContext(summary, turns)
+
+    def _schedule_summary(self, conversation: _Conversation):
+        if not conversation.overflow or self.summarize is None:
+            return
+        if conversation.summarizing is not None and not conversation.summarizing.done():
+            return
+        batch = list(conversation.overflow)
+        conversation.summarizing = self.spawn(self._summarize(conversation, batch))
+
+    async def _summarize(self, conversation: _Conversation, batch: list[Turn]):
+        summary = None
+        try:
+            summary = await self.summarize(conversation.summary, batch)
+        except Exception as e:
+            logger.error(f"Conversation summary failed: {e}")
+        if summary:
+            self.summaries += 1
+            conversation.summary = summary[:self.summary_chars]
+        else:
+            # Реплики не копятся без конца, пока ИИ недоступен
+            self.summary_failures += 1
+            conversation.summary = extractive_summary(conversation.summary, batch, self.summary_chars)
+        del conversation.overflow[:len(batch)]
+
+    def handle_event(self, event: str, user_id: int, **data):
+        """Подписчик database.add_ticket_listener"""
+        if event == "message":
+            turn = Turn(data["message_id"], data.get("role") or "user", data["text"])
+            if user_id in self._loading:
+                self._loading[user_id].append(turn)
+                return
+            conversation = self._conversations.peek(user_id)
+            if conversation is not MISSING and conversation.thread_id == data.get("thread_id"):
+                self._add(conversation, turn)
+                self.appended += 1
+        elif event in ("opened", "closed"):
+            self._conversations.pop(user_id)
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._conversations),
+            "hits": self._conversations.hits,
+            "hydrations": self.hydrations,
+            "appended": self.appended,
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+        }
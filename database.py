@@ -1,4 +1,10 @@
+import asyncio
 import logging
+import time
+import uuid
+from contextlib import suppress
+from dataclasses import dataclass
+from datetime import datetime, timezone
 import asyncpg
 from config import (
     POSTGRES_USER,
@@ -8,13 +14,53 @@ from config import (
     POSTGRES_PORT,
     SUPPORT_CHAT_ID,
     TECH_SUPPORT_CHAT_ID,
+    DB_WRITE_BEHIND_ENABLED,
+    DB_FLUSH_INTERVAL,
+    DB_FLUSH_BATCH_SIZE,
+    TICKET_CACHE_SIZE,
+    TICKET_CACHE_TTL,
+    TICKET_CACHE_SYNC,
+    TICKET_CACHE_SYNC_TTL,
+    LANGUAGE_CACHE_SIZE,
+    LANGUAGE_CACHE_TTL,
 )
+from cache import TTLCache, MISSING
+from migrations import apply_migrations
 
 logger = logging.getLogger(__name__)
 
 _pool = None
 
 
+@dataclass
+class _PendingActivity:
+    client_time: datetime | None = None
+    support_time: datetime | None = None
+    ai_responses: int = 0
+
+
+# Write-behind буфер: активность сливается по user_id, сообщения копятся списком
+_pending_activity: dict[int, _PendingActivity] = {}
+_pending_messages: list[tuple[int, int, int, int | None, datetime, str | None, str | None]] = []
+# Язык по умолчанию для новых пользователей: вставляется пачкой, явный выбор не перетирает
+_pending_languages: dict[int, str] = {}
+_flushing_activity: dict[int, _PendingActivity] = {}
+_flush_lock = asyncio.Lock()
+_flush_wakeup: asyncio.Event | None = None
+_flush_task: asyncio.Task | None = None
+_write_behind_stats = {
+    "activity_enqueued": 0,
+    "messages_enqueued": 0,
+    "languages_enqueued": 0,
+    "flushes": 0,
+    "flush_errors": 0,
+    "rows_flushed": 0,
+    "last_flush_ms": 0.0,
+    "max_flush_ms": 0.0,
+    "total_flush_ms": 0.0,
+}
+
+
 async def get_db_pool():
     global _pool
     if _pool is None:
@@ -32,150 +78,643 @@ async def init_db():
     logger.info("Initializing database...")
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS tickets (
-                user_id BIGINT PRIMARY KEY,
-                thread_id BIGINT,
-                tech_thread_id BIGINT,
-                status TEXT,
-                topic TEXT,
-                last_message_time TIMESTAMP,
-                last_client_message_time TIMESTAMP,
-                last_support_message_time TIMESTAMP,
-                support_reminder_sent BOOLEAN DEFAULT FALSE,
-                tech_reminder_sent BOOLEAN DEFAULT FALSE,
-                close_reminder_sent BOOLEAN DEFAULT FALSE,
-                human_responded BOOLEAN DEFAULT FALSE,
-                ai_responded BOOLEAN DEFAULT FALSE,
-                ai_response_count INTEGER DEFAULT 0
-            );
-            CREATE TABLE IF NOT EXISTS users (
-                user_id BIGINT PRIMARY KEY,
-                lang TEXT
-            );
-            CREATE TABLE IF NOT EXISTS ticket_messages (
-                user_id BIGINT,
-                message_id BIGINT,
-                chat_id BIGINT,
-                thread_id BIGINT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, message_id)
-            );
-            ALTER TABLE tickets ADD COLUMN IF NOT EXISTS tech_thread_id BIGINT;
-            ALTER TABLE tickets ADD COLUMN IF NOT EXISTS support_reminder_sent BOOLEAN DEFAULT FALSE;
-            ALTER TABLE tickets ADD COLUMN IF NOT EXISTS tech_reminder_sent BOOLEAN DEFAULT FALSE;
-            ALTER TABLE tickets ADD COLUMN IF NOT EXISTS last_client_message_time TIMESTAMP;
-            ALTER TABLE tickets ADD COLUMN IF NOT EXISTS last_support_message_time TIMESTAMP;
-            ALTER TABLE tickets ADD COLUMN IF NOT EXISTS close_reminder_sent BOOLEAN DEFAULT FALSE;
-            ALTER TABLE tickets ADD COLUMN IF NOT EXISTS human_responded BOOLEAN DEFAULT FALSE;
-            ALTER TABLE tickets ADD COLUMN IF NOT EXISTS ai_responded BOOLEAN DEFAULT FALSE;
-            ALTER TABLE tickets ADD COLUMN IF NOT EXISTS ai_response_count INTEGER DEFAULT 0;
-            ALTER TABLE ticket_messages ADD COLUMN IF NOT EXISTS thread_id BIGINT;
-        """)
+        await apply_migrations(conn)
     logger.info("Database initialized")
 
 
-async def get_ticket(user_id: int):
+def _utcnow() -> datetime:
+    # Колонки TIMESTAMP без зоны, в них пишется UTC. Все отметки активности и сравнения с ними
+    # (claim напоминаний, автозакрытие) идут по этим часам приложения, а не по NOW() в БД
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _write_behind_active() -> bool:
+    return _flush_task is not None and not _flush_task.done()
+
+
+def _pending_queue_depth() -> int:
+    return len(_pending_activity) + len(_pending_messages) + len(_pending_languages)
+
+
+def _wake_flusher_if_full():
+    if _flush_wakeup is not None and _pending_queue_depth() >= DB_FLUSH_BATCH_SIZE:
+        _flush_wakeup.set()
+
+
+def _merge_activity(user_id: int, pending: _PendingActivity):
+    current = _pending_activity.get(user_id)
+    if current is None:
+        _pending_activity[user_id] = pending
+        return
+    if pending.client_time and (not current.client_time or pending.client_time > current.client_time):
+        current.client_time = pending.client_time
+    if pending.support_time and (not current.support_time or pending.support_time > current.support_time):
+        current.support_time = pending.support_time
+    current.ai_responses += pending.ai_responses
+
+
+def _pending_overlay(user_id: int) -> tuple[bool, int]:
+    """Ещё не записанные в БД изменения: (оператор ответил, число ответов ИИ)"""
+    support_pending = False
+    ai_pending = 0
+    for buffer in (_pending_activity, _flushing_activity):
+        pending = buffer.get(user_id)
+        if pending:
+            support_pending = support_pending or pending.support_time is not None
+            ai_pending += pending.ai_responses
+    return support_pending, ai_pending
+
+
+def start_write_behind():
+    """Запускает фоновый сброс буфера активности в БД"""
+    global _flush_task, _flush_wakeup
+    if not DB_WRITE_BEHIND_ENABLED:
+        logger.info("Write-behind disabled, activity updates go straight to DB")
+        return
+    if _write_behind_active():
+        return
+    _flush_wakeup = asyncio.Event()
+    _flush_task = asyncio.create_task(_write_behind_worker())
+    logger.info(f"Write-behind started (interval={DB_FLUSH_INTERVAL}s, batch={DB_FLUSH_BATCH_SIZE})")
+
+
+async def stop_write_behind():
+    """Останавливает фоновый сброс и дописывает всё, что осталось в буфере"""
+    global _flush_task, _flush_wakeup
+    task = _flush_task
+    _flush_task = None
+    _flush_wakeup = None
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await flush_write_behind()
+    if _pending_queue_depth():
+        logger.error(f"Write-behind stopped with {_pending_queue_depth()} unflushed entries")
+    logger.info(f"Write-behind stopped, stats: {get_write_behind_stats()}")
+
+
+async def _write_behind_worker():
+    while True:
+        try:
+            await asyncio.wait_for(_flush_wakeup.wait(), timeout=DB_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _flush_wakeup.clear()
+        await flush_write_behind()
+
+
+async def flush_write_behind():
+    """Сбрасывает накопленные обновления активности и сообщения одной транзакцией"""
+    global _pending_activity, _pending_messages, _pending_languages, _flushing_activity, _ticket_generation
+    async with _flush_lock:
+        if not _pending_queue_depth():
+            return
+        activity, _pending_activity = _pending_activity, {}
+        _flushing_activity = activity
+        messages, _pending_messages = _pending_messages, []
+        languages, _pending_languages = _pending_languages, {}
+
+        started = time.perf_counter()
+        try:
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                async with conn.transaction():
+                    if activity:
+                        user_ids = list(activity.keys())
+                        await conn.execute(
+                            """
+                            UPDATE tickets AS t
+                            SET last_message_time = GREATEST(t.last_message_time, u.client_time, u.support_time),
+                                last_client_message_time = COALESCE(u.client_time, t.last_client_message_time),
+                                last_support_message_time = COALESCE(u.support_time, t.last_support_message_time),
+                                support_reminder_sent = CASE WHEN u.client_time IS NULL
+                                    THEN t.support_reminder_sent ELSE FALSE END,
+                                tech_reminder_sent = CASE WHEN u.client_time IS NULL
+                                    THEN t.tech_reminder_sent ELSE FALSE END,
+                                close_reminder_sent = CASE WHEN u.client_time IS NULL AND u.support_time IS NULL
+                                    THEN t.close_reminder_sent ELSE FALSE END,
+                                human_responded = t.human_responded OR u.support_time IS NOT NULL,
+                                ai_responded = t.ai_responded OR u.ai_responses > 0,
+                                ai_response_count = COALESCE(t.ai_response_count, 0) + u.ai_responses
+                            FROM UNNEST($1::bigint[], $2::timestamp[], $3::timestamp[], $4::int[])
+                                AS u(user_id, client_time, support_time, ai_responses)
+                            WHERE t.user_id = u.user_id
+                            """,
+                            user_ids,
+                            [activity[uid].client_time for uid in user_ids],
+                            [activity[uid].support_time for uid in user_ids],
+                            [activity[uid].ai_responses for uid in user_ids],
+                        )
+                        # Другим репликам важны только отметки оператора и ИИ; уведомление уйдёт при COMMIT
+                        await _publish_ticket_changes(conn, [
+                            uid for uid in user_ids
+                            if activity[uid].support_time is not None or activity[uid].ai_responses
+                        ])
+                    if messages:
+                        await conn.execute(
+                            """
+                            INSERT INTO ticket_messages
+                                (user_id, message_id, chat_id, thread_id, created_at, message_text, role)
+                            SELECT * FROM UNNEST(
+                                $1::bigint[], $2::bigint[], $3::bigint[], $4::bigint[], $5::timestamp[],
+                                $6::text[], $7::text[]
+                            )
+                            ON CONFLICT (user_id, message_id) DO NOTHING
+                            """,
+                            *[list(column) for column in zip(*messages)]
+                        )
+                    if languages:
+                        await conn.execute(
+                            """
+                            INSERT INTO users (user_id, lang)
+                            SELECT * FROM UNNEST($1::bigint[], $2::text[])
+                            ON CONFLICT (user_id) DO NOTHING
+                            """,
+                            list(languages.keys()),
+                            list(languages.values())
+                        )
+                # Транзакция зафиксирована: строки уже содержат эти обновления, и overlay не должен
+                # добавить их второй раз. Чтения, пересёкшиеся со сбросом, не кешируются
+                _flushing_activity = {}
+                _ticket_generation += 1
+        except (Exception, asyncio.CancelledError) as exc:
+            # Возвращаем данные в буфер, чтобы не потерять их до следующей попытки
+            for user_id, pending in activity.items():
+                _merge_activity(user_id, pending)
+            _pending_messages = messages + _pending_messages
+            for user_id, lang in languages.items():
+                _pending_languages.setdefault(user_id, lang)
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            _write_behind_stats["flush_errors"] += 1
+            logger.error(
+                f"Write-behind flush failed, {len(activity) + len(messages) + len(languages)} entries requeued: {exc}"
+            )
+            return
+        finally:
+            _flushing_activity = {}
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        _write_behind_stats["flushes"] += 1
+        _write_behind_stats["rows_flushed"] += len(activity) + len(messages) + len(languages)
+        _write_behind_stats["last_flush_ms"] = elapsed_ms
+        _write_behind_stats["total_flush_ms"] += elapsed_ms
+        _write_behind_stats["max_flush_ms"] = max(_write_behind_stats["max_flush_ms"], elapsed_ms)
+        logger.debug(
+            f"Write-behind flushed {len(activity)} activity rows, {len(messages)} messages "
+            f"and {len(languages)} languages in {elapsed_ms:.1f} ms"
+        )
+
+
+def get_write_behind_stats() -> dict:
+    """Счётчики write-behind буфера: глубина очереди и задержка сброса"""
+    stats = dict(_write_behind_stats)
+    stats["queue_depth"] = _pending_queue_depth()
+    stats["pending_activity"] = len(_pending_activity)
+    stats["pending_messages"] = len(_pending_messages)
+    stats["pending_languages"] = len(_pending_languages)
+    flushes = stats["flushes"]
+    stats["avg_flush_ms"] = stats["total_flush_ms"] / flushes if flushes else 0.0
+    return stats
+
+
+# Подписчики на изменения тикетов (например, планировщик напоминаний)
+_ticket_listeners: list = []
+
+
+def add_ticket_listener(listener):
+    """Подписывает listener(event, user_id, **data) на изменения тикетов"""
+    _ticket_listeners.append(listener)
+
+
+def remove_ticket_listener(listener):
+    if listener in _ticket_listeners:
+        _ticket_listeners.remove(listener)
+
+
+def _notify_ticket_listeners(event: str, user_id: int, **data):
+    for listener in _ticket_listeners:
+        try:
+            listener(event, user_id, **data)
+        except Exception as exc:
+            logger.error(f"Ticket listener failed on '{event}' for user {user_id}: {exc}", exc_info=True)
+
+
+def _forget_thread(user_id: int, entry: dict | None):
+    if entry and _thread_to_user.get(entry["thread_id"]) == user_id:
+        del _thread_to_user[entry["thread_id"]]
+
+
+# Кеш тикетов по user_id (None — тикета нет) и обратный индекс thread_id -> user_id.
+# С синхронизацией реплик TTL короче: он ограничивает устаревание, если уведомление потерялось
+_ticket_cache = TTLCache(
+    TICKET_CACHE_SIZE,
+    min(TICKET_CACHE_TTL, TICKET_CACHE_SYNC_TTL) if TICKET_CACHE_SYNC else TICKET_CACHE_TTL,
+    on_evict=_forget_thread,
+)
+_thread_to_user: dict[int, int] = {}
+_thread_lookup_stats = {"hits": 0, "misses": 0}
+# Растёт при каждом изменении тикета: чтение из БД, пересёкшееся с записью, не кешируется
+_ticket_generation = 0
+
+_TICKET_COLUMNS = """
+    user_id, thread_id, status, topic, tech_thread_id,
+    human_responded, ai_responded, ai_response_count
+"""
+
+
+def _cache_ticket(user_id: int, entry: dict | None):
+    # Прежний тикет (и его thread_id в индексе) снимает on_evict
+    _ticket_cache.set(user_id, entry)
+    if entry and entry["thread_id"]:
+        _thread_to_user[entry["thread_id"]] = user_id
+
+
+def _update_cached_ticket(user_id: int, **fields):
+    """Write-through: применяет изменение к закешированному тикету"""
+    global _ticket_generation
+    _ticket_generation += 1
+    entry = _ticket_cache.peek(user_id)
+    if entry is MISSING or entry is None:
+        return
+    if "thread_id" in fields:
+        _forget_thread(user_id, entry)
+    entry.update(fields)
+    if entry["thread_id"]:
+        _thread_to_user[entry["thread_id"]] = user_id
+
+
+def _entry_from_record(record) -> dict:
+    support_pending, ai_pending = _pending_overlay(record["user_id"])
+    return {
+        "thread_id": record["thread_id"],
+        "status": record["status"],
+        "topic": record["topic"],
+        "tech_thread_id": record["tech_thread_id"],
+        "human_responded": bool(record["human_responded"]) or support_pending,
+        "ai_responded": bool(record["ai_responded"]) or ai_pending > 0,
+        "ai_response_count": (record["ai_response_count"] or 0) + ai_pending,
+    }
+
+
+async def _get_ticket_entry(user_id: int) -> dict | None:
+    entry = _ticket_cache.get(user_id)
+    if entry is not MISSING:
+        return entry
+    generation = _ticket_generation
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        ticket = await conn.fetchrow(
-            """
-            SELECT thread_id, status, topic, tech_thread_id, human_responded, ai_responded
-            FROM tickets
-            WHERE user_id = $1
-            ORDER BY last_message_time DESC
-            LIMIT 1
-            """,
+        record = await conn.fetchrow(
+            f"SELECT {_TICKET_COLUMNS} FROM tickets WHERE user_id = $1",
             user_id
         )
-        if ticket:
-            return (
-                ticket["thread_id"], 
-                ticket["status"], 
-                ticket["topic"], 
-                ticket["tech_thread_id"],
-                ticket.get("human_responded", False),
-                ticket.get("ai_responded", False)
+    entry = _entry_from_record(record) if record else None
+    if generation == _ticket_generation:
+        _cache_ticket(user_id, entry)
+    return entry
+
+
+def forget_cached_ticket(user_id: int):
+    """Сбрасывает тикет из кеша: следующее чтение пойдёт в БД (нужно, если его могла изменить другая реплика)"""
+    global _ticket_generation
+    _ticket_generation += 1
+    _ticket_cache.pop(user_id, None)
+
+
+def get_ticket_cache_stats() -> dict:
+    """Статистика кеша тикетов: попадания, промахи, вытеснения"""
+    stats = _ticket_cache.stats()
+    stats["thread_index_size"] = len(_thread_to_user)
+    stats["thread_hits"] = _thread_lookup_stats["hits"]
+    stats["thread_misses"] = _thread_lookup_stats["misses"]
+    if TICKET_CACHE_SYNC:
+        stats.update({f"sync_{name}": value for name, value in _ticket_sync_stats.items()})
+    return stats
+
+
+# Синхронизация кеша тикетов между репликами: LISTEN/NOTIFY, payload — "<реплика>:<user_id>,<user_id>,..."
+_TICKET_CHANNEL = "ticket_changed"
+_NOTIFY_CHUNK = 300  # user_id в одном уведомлении: payload NOTIFY ограничен 8000 байт
+_REPLICA_ID = uuid.uuid4().hex[:12]
+_ticket_sync_task: asyncio.Task | None = None
+_ticket_sync_stats = {"published": 0, "received": 0, "invalidated": 0, "reconnects": 0}
+
+
+async def _publish_ticket_changes(conn, user_ids: list[int]):
+    """Сообщает другим репликам об изменении тикетов; внутри транзакции уведомление уходит при COMMIT"""
+    if not TICKET_CACHE_SYNC:
+        return
+    for start in range(0, len(user_ids), _NOTIFY_CHUNK):
+        chunk = user_ids[start:start + _NOTIFY_CHUNK]
+        await conn.execute(
+            "SELECT pg_notify($1, $2)", _TICKET_CHANNEL, f"{_REPLICA_ID}:{','.join(map(str, chunk))}"
+        )
+        _ticket_sync_stats["published"] += 1
+
+
+def _on_ticket_notification(conn, pid: int, channel: str, payload: str):
+    replica, _, user_ids = payload.partition(":")
+    if replica == _REPLICA_ID or not user_ids:
+        return  # Свои изменения уже в кеше (write-through)
+    global _ticket_generation
+    # Чтение из БД, начатое до чужой записи, не должно попасть в кеш
+    _ticket_generation += 1
+    _ticket_sync_stats["received"] += 1
+    for user_id in user_ids.split(","):
+        if _ticket_cache.pop(int(user_id), MISSING) is not MISSING:
+            _ticket_sync_stats["invalidated"] += 1
+
+
+def _drop_cached_tickets():
+    global _ticket_generation
+    _ticket_generation += 1
+    _ticket_cache.clear()
+
+
+def start_ticket_cache_sync():
+    """Подписывает реплику на изменения тикетов, сделанные другими репликами"""
+    global _ticket_sync_task
+    if not TICKET_CACHE_SYNC:
+        logger.info("Ticket cache sync disabled, cached tickets expire after TICKET_CACHE_TTL")
+        return
+    if _ticket_sync_task is not None and not _ticket_sync_task.done():
+        return
+    _ticket_sync_task = asyncio.create_task(_ticket_sync_worker())
+
+
+async def stop_ticket_cache_sync():
+    global _ticket_sync_task
+    task = _ticket_sync_task
+    _ticket_sync_task = None
+    if task is not None:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+
+async def _ticket_sync_worker(check_interval: float = 10.0, retry_interval: float = 5.0):
+    # Отдельное соединение вне пула: при возврате в пул asyncpg снимает LISTEN
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(
+                user=POSTGRES_USER,
+                password=POSTGRES_PASSWORD,
+                database=POSTGRES_DB,
+                host=POSTGRES_HOST,
+                port=POSTGRES_PORT
             )
-        return None, None, None, None, False, False
+            await conn.add_listener(_TICKET_CHANNEL, _on_ticket_notification)
+            # Пока подписки не было, уведомления могли потеряться — кеш собирается заново
+            _drop_cached_tickets()
+            logger.info(f"🔔 Ticket cache sync listening on '{_TICKET_CHANNEL}' (replica {_REPLICA_ID})")
+            while True:
+                await asyncio.sleep(check_interval)
+                await asyncio.wait_for(conn.fetchval("SELECT 1"), timeout=check_interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            _ticket_sync_stats["reconnects"] += 1
+            logger.error(f"Ticket cache sync connection lost: {exc}")
+        finally:
+            if conn is not None:
+                conn.terminate()
+        await asyncio.sleep(retry_interval)
+
+
+async def get_ticket(user_id: int):
+    entry = await _get_ticket_entry(user_id)
+    if entry:
+        return (
+            entry["thread_id"],
+            entry["status"],
+            entry["topic"],
+            entry["tech_thread_id"],
+            entry["human_responded"],
+            entry["ai_responded"]
+        )
+    return None, None, None, None, False, False
+
+
+async def ticket_exists(user_id: int) -> bool:
+    """Проверяет, был ли у пользователя хоть один тикет"""
+    return await _get_ticket_entry(user_id) is not None
 
 
 async def get_user_by_thread(thread_id: int):
+    user_id = _thread_to_user.get(thread_id)
+    if user_id is not None:
+        entry = _ticket_cache.get(user_id)
+        if entry is not MISSING and entry and entry["thread_id"] == thread_id:
+            _thread_lookup_stats["hits"] += 1
+            return user_id
+    _thread_lookup_stats["misses"] += 1
+
+    generation = _ticket_generation
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        ticket = await conn.fetchrow(
-            "SELECT user_id FROM tickets WHERE thread_id = $1", thread_id
+        record = await conn.fetchrow(
+            f"SELECT {_TICKET_COLUMNS} FROM tickets WHERE thread_id = $1", thread_id
         )
-        return ticket["user_id"] if ticket else None
+    if not record:
+        return None
+    if generation == _ticket_generation:
+        _cache_ticket(record["user_id"], _entry_from_record(record))
+    return record["user_id"]
+
+
+async def open_ticket(user_id: int, thread_id: int, topic: str):
+    """Создаёт тикет или переоткрывает существующий со сбросом флагов и счётчиков ИИ"""
+    # Отложенные отметки оператора/ИИ относятся к прошлому тикету. Под _flush_lock: пачка, которая
+    # сейчас пишется (или вернётся в буфер после ошибки), не попадёт в БД после сброса флагов
+    async with _flush_lock:
+        pending = _pending_activity.get(user_id)
+        if pending:
+            pending.support_time = None
+            pending.ai_responses = 0
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            record = await conn.fetchrow(
+                """
+                INSERT INTO tickets (user_id, thread_id, status, topic, last_message_time) 
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (user_id) DO UPDATE 
+                SET thread_id = $2,
+                    status = $3,
+                    topic = $4,
+                    last_message_time = $5,
+                    support_reminder_sent = FALSE,
+                    tech_reminder_sent = FALSE,
+                    tech_thread_id = NULL,
+                    human_responded = FALSE,
+                    ai_responded = FALSE,
+                    ai_response_count = 0
+                RETURNING last_client_message_time, last_support_message_time, close_reminder_sent
+                """,
+                user_id, thread_id, "open", topic, _utcnow()
+            )
+            await _publish_ticket_changes(conn, [user_id])
+    global _ticket_generation
+    _ticket_generation += 1
+    _cache_ticket(user_id, {
+        "thread_id": thread_id,
+        "status": "open",
+        "topic": topic,
+        "tech_thread_id": None,
+        "human_responded": False,
+        "ai_responded": False,
+        "ai_response_count": 0,
+    })
+    _notify_ticket_listeners(
+        "opened",
+        user_id,
+        thread_id=thread_id,
+        last_client=record["last_client_message_time"],
+        last_support=record["last_support_message_time"],
+        close_sent=record["close_reminder_sent"],
+    )
 
 
 async def update_ticket_client_activity(user_id: int):
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            UPDATE tickets
-            SET last_message_time = CURRENT_TIMESTAMP,
-                last_client_message_time = CURRENT_TIMESTAMP,
-                support_reminder_sent = FALSE,
-                tech_reminder_sent = FALSE,
-                close_reminder_sent = FALSE
-            WHERE user_id = $1
-            """,
-            user_id
-        )
+    now = _utcnow()
+    if _write_behind_active():
+        _merge_activity(user_id, _PendingActivity(client_time=now))
+        _write_behind_stats["activity_enqueued"] += 1
+        _wake_flusher_if_full()
+    else:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE tickets
+                SET last_message_time = $2,
+                    last_client_message_time = $2,
+                    support_reminder_sent = FALSE,
+                    tech_reminder_sent = FALSE,
+                    close_reminder_sent = FALSE
+                WHERE user_id = $1
+                """,
+                user_id,
+                now
+            )
+    _notify_ticket_listeners("client_activity", user_id, at=now)
 
 
 async def update_ticket_support_activity(user_id: int):
+    now = _utcnow()
+    if _write_behind_active():
+        _merge_activity(user_id, _PendingActivity(support_time=now))
+        _write_behind_stats["activity_enqueued"] += 1
+        _wake_flusher_if_full()
+    else:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE tickets
+                SET last_message_time = $2,
+                    last_support_message_time = $2,
+                    close_reminder_sent = FALSE,
+                    human_responded = TRUE
+                WHERE user_id = $1
+                """,
+                user_id,
+                now
+            )
+            await _publish_ticket_changes(conn, [user_id])
+    _update_cached_ticket(user_id, human_responded=True)
+    _notify_ticket_listeners("support_activity", user_id, at=now)
+
+
+# Язык пользователя: ограниченный LRU с TTL вместо словаря на всех когда-либо писавших
+_language_cache = TTLCache(LANGUAGE_CACHE_SIZE, LANGUAGE_CACHE_TTL)
+
+
+async def update_user_language(user_id: int, lang: str):
+    """Явный выбор языка пользователем — пишется сразу"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute(
-            """
-            UPDATE tickets
-            SET last_message_time = CURRENT_TIMESTAMP,
-                last_support_message_time = CURRENT_TIMESTAMP,
-                close_reminder_sent = FALSE,
-                human_responded = TRUE
-            WHERE user_id = $1
-            """,
-            user_id
+            "INSERT INTO users (user_id, lang) VALUES ($1, $2) ON CONFLICT (user_id) DO UPDATE SET lang = $2",
+            user_id, lang
         )
+    _pending_languages.pop(user_id, None)
+    _language_cache.set(user_id, lang)
 
 
-async def update_user_language(user_id: int, lang: str):
+async def set_default_user_language(user_id: int, lang: str):
+    """Язык для нового пользователя: в кеш сразу, в БД — пачкой через write-behind"""
+    _language_cache.set(user_id, lang)
+    if _write_behind_active():
+        _pending_languages.setdefault(user_id, lang)
+        _write_behind_stats["languages_enqueued"] += 1
+        _wake_flusher_if_full()
+        return
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute(
-            "INSERT INTO users (user_id, lang) VALUES ($1, $2) ON CONFLICT (user_id) DO UPDATE SET lang = $2",
+            "INSERT INTO users (user_id, lang) VALUES ($1, $2) ON CONFLICT (user_id) DO NOTHING",
             user_id, lang
         )
 
 
 async def get_user_language(user_id: int):
+    lang = _language_cache.get(user_id)
+    if lang is not MISSING:
+        return lang
+    lang = _pending_languages.get(user_id)
+    if lang is None:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            user = await conn.fetchrow("SELECT lang FROM users WHERE user_id = $1", user_id)
+        lang = user["lang"] if user else None
+    if lang:
+        _language_cache.set(user_id, lang)
+    return lang
+
+
+async def preload_user_languages() -> int:
+    """Прогревает кеш языками пользователей с открытыми тикетами — одним запросом"""
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        user = await conn.fetchrow("SELECT lang FROM users WHERE user_id = $1", user_id)
-        return user["lang"] if user else None
+        records = await conn.fetch(
+            """
+            SELECT u.user_id, u.lang
+            FROM users u
+            JOIN tickets t ON t.user_id = u.user_id
+            WHERE t.status = 'open' AND u.lang IS NOT NULL
+            LIMIT $1
+            """,
+            LANGUAGE_CACHE_SIZE
+        )
+    for record in records:
+        _language_cache.set(record["user_id"], record["lang"])
+    return len(records)
+
+
+def get_language_cache_stats() -> dict:
+    return _language_cache.stats()
 
 
 async def close_ticket(bot, user_id: int, thread_id: int, topic: str):
+    _, _, _, tech_thread_id, _, _ = await get_ticket(user_id)
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute(
             "UPDATE tickets SET status = 'closed' WHERE user_id = $1", user_id
         )
+        await _publish_ticket_changes(conn, [user_id])
+    _update_cached_ticket(user_id, status="closed")
+    _notify_ticket_listeners("closed", user_id)
 
     await bot.close_forum_topic(
         chat_id=SUPPORT_CHAT_ID,
         message_thread_id=thread_id
     )
 
-    async with pool.acquire() as conn:
-        tech_thread_id = await conn.fetchval(
-            "SELECT tech_thread_id FROM tickets WHERE user_id = $1",
-            user_id
-        )
-
     if tech_thread_id:
         try:
             await bot.close_forum_topic(
@@ -186,6 +725,19 @@ async def close_ticket(bot, user_id: int, thread_id: int, topic: str):
             logger.error(f"Failed to close tech topic for user {user_id}: {exc}")
 
 
+async def mark_ticket_closed(user_id: int):
+    """Закрывает тикет в БД и отвязывает технический чат"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE tickets SET status = 'closed', tech_thread_id = NULL WHERE user_id = $1",
+            user_id
+        )
+        await _publish_ticket_changes(conn, [user_id])
+    _update_cached_ticket(user_id, status="closed", tech_thread_id=None)
+    _notify_ticket_listeners("closed", user_id)
+
+
 async def update_ticket_tech_thread(user_id: int, tech_thread_id: int):
     pool = await get_db_pool()
     async with pool.acquire() as conn:
@@ -199,42 +751,118 @@ async def update_ticket_tech_thread(user_id: int, tech_thread_id: int):
             user_id,
             tech_thread_id
         )
+        await _publish_ticket_changes(conn, [user_id])
+    _update_cached_ticket(user_id, tech_thread_id=tech_thread_id)
+    _notify_ticket_listeners("tech_thread", user_id, tech_thread_id=tech_thread_id)
+
+
+async def clear_ticket_tech_thread(user_id: int):
+    """Отвязывает технический чат от тикета"""
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        await conn.execute(
+            "UPDATE tickets SET tech_thread_id = NULL WHERE user_id = $1",
+            user_id
+        )
+        await _publish_ticket_changes(conn, [user_id])
+    _update_cached_ticket(user_id, tech_thread_id=None)
+    _notify_ticket_listeners("tech_thread", user_id, tech_thread_id=None)
 
 
-async def save_ticket_message(user_id: int, message_id: int, chat_id: int, thread_id: int | None):
+async def save_ticket_message(
+    user_id: int,
+    message_id: int,
+    chat_id: int,
+    thread_id: int | None,
+    text: str | None = None,
+    role: str | None = None,
+):
+    """
+    text и role ("user" — клиент, "assistant" — ответ ИИ, "operator" — оператор) сохраняются
+    для истории диалога ИИ; сообщения с текстом рассылаются подписчикам событием "message"
+    """
+    if text:
+        _notify_ticket_listeners(
+            "message", user_id, thread_id=thread_id, message_id=message_id, role=role, text=text
+        )
+    if _write_behind_active():
+        _pending_messages.append((user_id, message_id, chat_id, thread_id, _utcnow(), text, role))
+        _write_behind_stats["messages_enqueued"] += 1
+        _wake_flusher_if_full()
+        return
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute(
             """
-            INSERT INTO ticket_messages (user_id, message_id, chat_id, thread_id)
-            VALUES ($1, $2, $3, $4)
+            INSERT INTO ticket_messages (user_id, message_id, chat_id, thread_id, created_at, message_text, role)
+            VALUES ($1, $2, $3, $4, $5, $6, $7)
             ON CONFLICT (user_id, message_id) DO NOTHING
             """,
             user_id,
             message_id,
             chat_id,
-            thread_id
+            thread_id,
+            _utcnow(),
+            text,
+            role
         )
 
 
 async def get_ticket_messages(user_id: int, thread_id: int):
+    await flush_write_behind()
+    pool = await get_db_pool()
+    async with pool.acquire() as conn:
+        # Отдельные запросы вместо "(thread_id = $3 OR $3 IS NULL)", чтобы работал индекс
+        if thread_id is None:
+            records = await conn.fetch(
+                """
+                SELECT message_id
+                FROM ticket_messages
+                WHERE user_id = $1 AND chat_id = $2
+                ORDER BY created_at ASC
+                """,
+                user_id,
+                SUPPORT_CHAT_ID
+            )
+        else:
+            records = await conn.fetch(
+                """
+                SELECT message_id
+                FROM ticket_messages
+                WHERE user_id = $1 AND chat_id = $2 AND thread_id = $3
+                ORDER BY created_at ASC
+                """,
+                user_id,
+                SUPPORT_CHAT_ID,
+                thread_id
+            )
+        return [record["message_id"] for record in records]
+
+
+async def get_ticket_history(user_id: int, thread_id: int, limit: int) -> list[tuple[int, str, str]]:
+    """Последние limit сообщений тикета с текстом: (message_id, role, text), от старых к новым"""
+    await flush_write_behind()
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         records = await conn.fetch(
             """
-            SELECT message_id
+            SELECT message_id, role, message_text
             FROM ticket_messages
-            WHERE user_id = $1 AND chat_id = $2 AND (thread_id = $3 OR $3 IS NULL)
-            ORDER BY created_at ASC
+            WHERE user_id = $1 AND chat_id = $2 AND thread_id = $3 AND message_text IS NOT NULL
+            ORDER BY created_at DESC
+            LIMIT $4
             """,
             user_id,
             SUPPORT_CHAT_ID,
-            thread_id
+            thread_id,
+            limit
         )
-        return [record["message_id"] for record in records]
+    return [(record["message_id"], record["role"], record["message_text"]) for record in reversed(records)]
 
 
-async def get_open_tickets_for_reminders():
+async def get_reminder_timers():
+    """Таймеры всех открытых тикетов — один запрос для сборки планировщика при старте"""
+    await flush_write_behind()
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         records = await conn.fetch(
@@ -254,68 +882,126 @@ async def get_open_tickets_for_reminders():
         return records
 
 
-async def mark_support_reminder_sent(user_id: int):
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute(
-            "UPDATE tickets SET support_reminder_sent = TRUE WHERE user_id = $1",
-            user_id
-        )
+# Отметка "отправлено" для каждого типа напоминания
+_REMINDER_FLAGS = {
+    "support": "support_reminder_sent",
+    "tech": "tech_reminder_sent",
+    "close": "close_reminder_sent",
+}
 
 
-async def mark_tech_reminder_sent(user_id: int):
+async def _claim_reminders(kind: str, query: str, *args):
+    # Сначала дописываем буфер активности, иначе свежие сообщения не сдвинут сроки
+    await flush_write_behind()
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        await conn.execute(
-            "UPDATE tickets SET tech_reminder_sent = TRUE WHERE user_id = $1",
-            user_id
-        )
+        records = await conn.fetch(query, *args)
+    for record in records:
+        _notify_ticket_listeners("reminder_sent", record["user_id"], kind=kind)
+    return records
+
+
+async def claim_due_support_reminders(overdue_minutes: int):
+    """Помечает отправленными и возвращает тикеты, где клиент ждёт ответа дольше порога"""
+    return await _claim_reminders(
+        "support",
+        """
+        UPDATE tickets
+        SET support_reminder_sent = TRUE
+        WHERE status = 'open'
+          AND thread_id IS NOT NULL
+          AND support_reminder_sent IS NOT TRUE
+          AND last_client_message_time <= $2::timestamp - make_interval(mins => $1)
+        RETURNING user_id, thread_id
+        """,
+        overdue_minutes,
+        _utcnow()
+    )
+
+
+async def claim_due_tech_reminders(overdue_minutes: int):
+    """То же для технических чатов"""
+    return await _claim_reminders(
+        "tech",
+        """
+        UPDATE tickets
+        SET tech_reminder_sent = TRUE
+        WHERE status = 'open'
+          AND tech_thread_id IS NOT NULL
+          AND tech_reminder_sent IS NOT TRUE
+          AND last_client_message_time <= $2::timestamp - make_interval(mins => $1)
+        RETURNING user_id, tech_thread_id
+        """,
+        overdue_minutes,
+        _utcnow()
+    )
+
+
+async def claim_due_close_reminders(overdue_hours: int):
+    """Тикеты, где после ответа поддержки прошло больше порога"""
+    return await _claim_reminders(
+        "close",
+        """
+        UPDATE tickets
+        SET close_reminder_sent = TRUE
+        WHERE status = 'open'
+          AND thread_id IS NOT NULL
+          AND close_reminder_sent IS NOT TRUE
+          AND last_support_message_time <= $2::timestamp - make_interval(hours => $1)
+        RETURNING user_id, thread_id
+        """,
+        overdue_hours,
+        _utcnow()
+    )
 
 
-async def mark_close_reminder_sent(user_id: int):
+async def release_reminder_claims(kind: str, user_ids: list[int]):
+    """Снимает отметку об отправке, если напоминание доставить не удалось"""
+    flag = _REMINDER_FLAGS[kind]
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute(
-            "UPDATE tickets SET close_reminder_sent = TRUE WHERE user_id = $1",
-            user_id
+            f"UPDATE tickets SET {flag} = FALSE WHERE user_id = ANY($1::bigint[])",
+            user_ids
         )
 
 
 async def mark_ai_responded(user_id: int):
     """Отмечает, что ИИ ответил на тикет и увеличивает счетчик"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        await conn.execute(
-            """
-            UPDATE tickets 
-            SET ai_responded = TRUE, 
-                ai_response_count = ai_response_count + 1 
-            WHERE user_id = $1
-            """,
-            user_id
-        )
+    if _write_behind_active():
+        _merge_activity(user_id, _PendingActivity(ai_responses=1))
+        _write_behind_stats["activity_enqueued"] += 1
+        _wake_flusher_if_full()
+    else:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                """
+                UPDATE tickets 
+                SET ai_responded = TRUE, 
+                    ai_response_count = ai_response_count + 1 
+                WHERE user_id = $1
+                """,
+                user_id
+            )
+            await _publish_ticket_changes(conn, [user_id])
+    entry = _ticket_cache.peek(user_id)
+    if entry is not MISSING and entry is not None:
+        _update_cached_ticket(user_id, ai_responded=True, ai_response_count=entry["ai_response_count"] + 1)
+    else:
+        _update_cached_ticket(user_id)
 
 
 async def check_if_human_responded(user_id: int) -> bool:
     """Проверяет, ответил ли оператор (человек) на тикет"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        result = await conn.fetchval(
-            "SELECT human_responded FROM tickets WHERE user_id = $1",
-            user_id
-        )
-        return result if result is not None else False
+    entry = await _get_ticket_entry(user_id)
+    return entry["human_responded"] if entry else False
 
 
 async def get_ai_response_count(user_id: int) -> int:
     """Получает количество ответов ИИ для пользователя"""
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        result = await conn.fetchval(
-            "SELECT ai_response_count FROM tickets WHERE user_id = $1",
-            user_id
-        )
-        return result if result is not None else 0
+    entry = await _get_ticket_entry(user_id)
+    return entry["ai_response_count"] if entry else 0
 
 
 async def mark_human_responded(user_id: int):
@@ -326,14 +1012,31 @@ async def mark_human_responded(user_id: int):
             "UPDATE tickets SET human_responded = TRUE WHERE user_id = $1",
             user_id
         )
+        await _publish_ticket_changes(conn, [user_id])
+    _update_cached_ticket(user_id, human_responded=True)
 
 
-async def auto_close_ticket(user_id: int):
-    """Автоматически закрывает тикет (без закрытия форума)"""
+async def claim_due_auto_closes(inactive_hours: int):
+    """Закрывает тикеты, где клиент не ответил поддержке дольше порога (без закрытия форума)"""
+    await flush_write_behind()
     pool = await get_db_pool()
     async with pool.acquire() as conn:
-        await conn.execute(
-            "UPDATE tickets SET status = 'closed' WHERE user_id = $1",
-            user_id
+        records = await conn.fetch(
+            """
+            UPDATE tickets
+            SET status = 'closed'
+            WHERE status = 'open'
+              AND thread_id IS NOT NULL
+              AND last_support_message_time <= $2::timestamp - make_interval(hours => $1)
+              AND (last_client_message_time IS NULL OR last_support_message_time > last_client_message_time)
+            RETURNING user_id, thread_id
+            """,
+            inactive_hours,
+            _utcnow()
         )
-        logger.info(f"🔒 Ticket auto-closed for user {user_id} due to inactivity")
+        await _publish_ticket_changes(conn, [record["user_id"] for record in records])
+    for record in records:
+        _update_cached_ticket(record["user_id"], status="closed")
+        _notify_ticket_listeners("closed", record["user_id"])
+        logger.info(f"🔒 Ticket auto-closed for user {record['user_id']} due to inactivity")
+    return records
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Имитация Telegram для проверки режима вебхука: шлёт POST с обновлениями на локальный сервер бота
+Использование: python fake_webhook_post.py [--count 100] [--concurrency 10] [--user-id 123] [--text "Привет"]
+Адрес и секрет берутся из WEBHOOK_PORT / WEBHOOK_PATH / WEBHOOK_SECRET, либо --url и --secret
+"""
+
+import argparse
+import asyncio
+import time
+from collections import Counter
+
+import aiohttp
+
+from config import WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET
+from webhook import SECRET_HEADER
+
+
+def build_update(update_id: int, user_id: int, text: str) -> dict:
+    """Минимальное обновление с личным сообщением от пользователя"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "Test"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test", "language_code": "ru"},
+            "text": text,
+        },
+    }
+
+
+async def post_updates(url: str, secret: str, count: int, concurrency: int, user_id: int, text: str):
+    statuses: Counter = Counter()
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    base_id = int(time.time())
+
+    async with aiohttp.ClientSession() as session:
+        async def post(i: int):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with session.post(
+                        url,
+                        json=build_update(base_id + i, user_id, f"{text} #{i}"),
+                        headers={SECRET_HEADER: secret},
+                    ) as response:
+                        statuses[response.status] += 1
+                except aiohttp.ClientError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(count)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"📨 Отправлено: {count} за {elapsed:.2f} с ({count / elapsed:.1f} запросов/с)")
+    print(f"📊 Ответы: {dict(statuses)}")
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"⏱  Задержка: p50={p50:.1f} мс, p95={p95:.1f} мс, max={latencies[-1]:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POST фейковых обновлений Telegram на вебхук бота")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    parser.add_argument("--count", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--user-id", type=int, default=100000001)
+    parser.add_argument("--text", default="Тестовое сообщение")
+    args = parser.parse_args()
+    asyncio.run(post_updates(args.url, args.secret, args.count, args.concurrency, args.user_id, args.text))
+
+
+if __name__ == "__main__":
+    main()
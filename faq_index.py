@@ -0,0 +1,166 @@
+import logging
+import math
+import re
+from collections import Counter
+from typing import NamedTuple, Optional
+
+from answer_cache import normalize
+
+logger = logging.getLogger(__name__)
+
+_TAG_RE = re.compile(r"<[^>]+>")
+
+_STOPWORDS = frozenset({
+    "и", "в", "во", "на", "с", "со", "к", "по", "за", "из", "у", "о", "об", "а", "но", "же", "ли", "бы",
+    "я", "мне", "меня", "мой", "моя", "мои", "мое", "вы", "вас", "ваш", "что", "как", "это", "если",
+    "так", "там", "тут", "уже", "еще", "все", "делать", "можно", "почему", "какой", "где", "когда",
+    "the", "a", "an", "to", "of", "in", "on", "for", "is", "are", "do", "does", "i", "my", "me",
+    "you", "your", "it", "and", "or", "what", "how", "why", "should", "can", "if", "with",
+})
+
+# Окончания для грубого стемминга: достаточно, чтобы "пополнить" и "пополнение" совпали
+_ENDINGS = sorted({
+    "ение", "ения", "ений", "ание", "ания", "ться", "тся", "ется", "ить", "ать", "ять", "еть", "ешь",
+    "ого", "его", "ому", "ему", "ами", "ями", "ов", "ев", "ей", "ой", "ый", "ий", "ая", "яя", "ое", "ее",
+    "ые", "ие", "ом", "ем", "ам", "ям", "ах", "ях", "ию", "ью", "ия", "ья", "ло", "ла", "ли",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "л",
+    "ing", "ed", "es", "s",
+}, key=len, reverse=True)
+_STEM_LEN = 5
+
+# Отрицание меняет смысл вопроса: "пополнение пришло" — не то же, что "не пришло"
+_NEGATIONS = frozenset({
+    "не", "нет", "ни", "not", "no", "never", "didn", "don", "doesn", "isn", "hasn", "haven", "wasn",
+    "didnt", "dont", "doesnt", "hasnt",
+})
+
+
+def _stem(word: str) -> str:
+    for ending in _ENDINGS:
+        if len(word) - len(ending) >= 3 and word.endswith(ending):
+            word = word[:-len(ending)]
+            break
+    return word[:_STEM_LEN]
+
+
+def tokenize(text: str) -> list[str]:
+    return [_stem(word) for word in normalize(_TAG_RE.sub(" ", text)).split() if word not in _STOPWORDS]
+
+
+class FaqEntry(NamedTuple):
+    topic: str
+    number: int
+    question: str
+    answer: str
+
+
+class FaqMatch(NamedTuple):
+    entry: FaqEntry
+    score: float        # BM25 по вопросу и ответу — для ранжирования
+    confidence: float   # Взвешенное по IDF совпадение с формулировкой вопроса, 0..1
+
+
+class _LangIndex:
+    def __init__(self, entries: list[FaqEntry], k1: float, b: float):
+        self.entries = entries
+        self.k1 = k1
+        self.b = b
+        # Вопрос весит больше ответа: его термы входят в документ трижды
+        self.question_terms = [set(tokenize(entry.question)) for entry in entries]
+        self.doc_tf = [
+            Counter(tokenize(entry.question) * 3 + tokenize(entry.answer)) for entry in entries
+        ]
+        self.doc_len = [sum(tf.values()) for tf in self.doc_tf]
+        self.avg_len = sum(self.doc_len) / len(entries) if entries else 0.0
+        df = Counter(term for tf in self.doc_tf for term in tf)
+        n = len(entries)
+        self.idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+        # Для терма, которого нет в FAQ, — как для самого редкого
+        self.default_idf = math.log(1 + (n + 0.5) / 0.5) if n else 1.0
+
+    def bm25(self, query: list[str], i: int) -> float:
+        tf = self.doc_tf[i]
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[i] / self.avg_len)
+        score = 0.0
+        for term in query:
+            freq = tf.get(term)
+            if freq:
+                score += self.idf[term] * freq * (self.k1 + 1) / (freq + norm)
+        return score
+
+    def confidence(self, query: set[str], i: int) -> float:
+        """Коэффициент Дайса по множествам термов запроса и вопроса с весами IDF"""
+        question = self.question_terms[i]
+        if not query or not question:
+            return 0.0
+        if query.isdisjoint(_NEGATIONS) != question.isdisjoint(_NEGATIONS):
+            return 0.0
+        weight = lambda terms: sum(self.idf.get(term, self.default_idf) for term in terms)
+        return 2 * weight(query & question) / (weight(query) + weight(question))
+
+
+class FaqIndex:
+    """
+    Локальный поиск по FAQ_QUESTIONS: BM25 для выбора записей в промпт
+    и оценка уверенности для прямого ответа курируемым текстом без LLM.
+    Записи без ответа (например, подтемы багов) не индексируются.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, topic_boost: float = 1.2):
+        self.k1 = k1
+        self.b = b
+        self.topic_boost = topic_boost
+        self._langs: dict[str, _LangIndex] = {}
+        self.searches = 0
+        self.direct_answers = 0
+
+    def build(self, faq_questions: dict) -> int:
+        by_lang: dict[str, list[FaqEntry]] = {}
+        for topic, questions in faq_questions.items():
+            for lang, items in questions.items():
+                for i in range(1, 10):
+                    question, answer = items.get(f"question{i}"), items.get(f"answer{i}")
+                    if question and answer:
+                        by_lang.setdefault(lang, []).append(FaqEntry(topic, i, question, answer))
+        self._langs = {lang: _LangIndex(entries, self.k1, self.b) for lang, entries in by_lang.items()}
+        total = sum(len(index.entries) for index in self._langs.values())
+        logger.info(f"FAQ index built: {total} entries in {len(self._langs)} languages")
+        return total
+
+    def search(self, text: str, lang: str, topic: Optional[str] = None, k: int = 3) -> list[FaqMatch]:
+        index = self._langs.get(lang)
+        query = tokenize(text)
+        if index is None or not query:
+            return []
+        self.searches += 1
+        query_set = set(query)
+        matches = []
+        for i, entry in enumerate(index.entries):
+            score = index.bm25(query, i)
+            if score <= 0:
+                continue
+            if topic and entry.topic == topic:
+                score *= self.topic_boost
+            matches.append(FaqMatch(entry, score, index.confidence(query_set, i)))
+        matches.sort(key=lambda match: match.score, reverse=True)
+        return matches[:k]
+
+    def direct_answer(self, matches: list[FaqMatch], threshold: float) -> Optional[FaqEntry]:
+        """Лучшая запись, если формулировка почти совпадает с вопросом из FAQ"""
+        if not matches:
+            return None
+        best = max(matches, key=lambda match: match.confidence)
+        if best.confidence < threshold:
+            return None
+        self.direct_answers += 1
+        return best.entry
+
+    def stats(self) -> dict:
+        return {
+            "entries": sum(len(index.entries) for index in self._langs.values()),
+            "searches": self.searches,
+            "direct_answers": self.direct_answers,
+        }
+
+
+faq_index = FaqIndex()
@@ -0,0 +1,159 @@
+import asyncio
+import copy
+import json
+import logging
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from cache import TTLCache, MISSING
+from database import get_db_pool
+
+logger = logging.getLogger(__name__)
+
+_KeyTuple = tuple[int, int, int, int, str]
+
+
+def _key_tuple(key: StorageKey) -> _KeyTuple:
+    # thread_id входит в первичный ключ, поэтому NULL заменяется на 0
+    return key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в таблице fsm_storage (общее для всех реплик, переживает рестарт).
+    Горячие записи держатся в локальном TTL-кеше, запись в БД идёт пачкой раз в flush_interval.
+    Реплика может видеть чужое изменение с задержкой до cache_ttl — TTL стоит держать коротким.
+    """
+
+    def __init__(self, cache_size: int = 10000, cache_ttl: float = 60, flush_interval: float = 0.5):
+        self._cache = TTLCache(cache_size, cache_ttl)
+        self._flush_interval = flush_interval
+        # Последнее значение по ключу, ещё не записанное в БД
+        self._pending: dict[_KeyTuple, tuple[Optional[str], Dict[str, Any]]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    async def _load(self, key: _KeyTuple) -> tuple[Optional[str], Dict[str, Any]]:
+        pending = self._pending.get(key)
+        if pending is not None:
+            return pending
+        entry = self._cache.get(key)
+        if entry is not MISSING:
+            return entry
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            record = await conn.fetchrow(
+                """
+                SELECT state, data FROM fsm_storage
+                WHERE bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4 AND destiny = $5
+                """,
+                *key
+            )
+        entry = (record["state"], json.loads(record["data"])) if record else (None, {})
+        # Запись, сделанная пока шёл запрос, важнее прочитанной
+        if key not in self._pending:
+            self._cache.set(key, entry)
+        return self._pending.get(key, entry)
+
+    def _store(self, key: _KeyTuple, entry: tuple[Optional[str], Dict[str, Any]]):
+        self._cache.set(key, entry)
+        self._pending[key] = entry
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self._flush_interval)
+        await self.flush()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = _key_tuple(key)
+        _, data = await self._load(k)
+        self._store(k, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(_key_tuple(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = _key_tuple(key)
+        state, _ = await self._load(k)
+        self._store(k, (state, copy.deepcopy(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(_key_tuple(key))
+        return copy.deepcopy(data)
+
+    async def flush(self):
+        """Записывает накопленные изменения: upsert непустых записей и удаление очищенных"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            upserts = [(key, state, data) for key, (state, data) in pending.items() if state is not None or data]
+            deletes = [key for key, (state, data) in pending.items() if state is None and not data]
+            try:
+                pool = await get_db_pool()
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        if upserts:
+                            await conn.execute(
+                                """
+                                INSERT INTO fsm_storage (bot_id, chat_id, user_id, thread_id, destiny, state, data, updated_at)
+                                SELECT u.*, NOW() AT TIME ZONE 'UTC'
+                                FROM UNNEST($1::bigint[], $2::bigint[], $3::bigint[], $4::bigint[], $5::text[],
+                                            $6::text[], $7::jsonb[]) AS u
+                                ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE
+                                SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = EXCLUDED.updated_at
+                                """,
+                                *[list(column) for column in zip(*(key for key, _, _ in upserts))],
+                                [state for _, state, _ in upserts],
+                                [json.dumps(data, ensure_ascii=False) for _, _, data in upserts],
+                            )
+                        if deletes:
+                            await conn.execute(
+                                """
+                                DELETE FROM fsm_storage AS f
+                                USING UNNEST($1::bigint[], $2::bigint[], $3::bigint[], $4::bigint[], $5::text[])
+                                    AS d(bot_id, chat_id, user_id, thread_id, destiny)
+                                WHERE f.bot_id = d.bot_id AND f.chat_id = d.chat_id AND f.user_id = d.user_id
+                                  AND f.thread_id = d.thread_id AND f.destiny = d.destiny
+                                """,
+                                *[list(column) for column in zip(*deletes)]
+                            )
+            except (Exception, asyncio.CancelledError) as exc:
+                # Более свежие изменения, пришедшие во время сброса, не перетираем
+                for key, entry in pending.items():
+                    self._pending.setdefault(key, entry)
+                if isinstance(exc, asyncio.CancelledError):
+                    raise
+                logger.error(f"FSM storage flush failed, {len(pending)} entries requeued: {exc}")
+                if self._flush_task is None or self._flush_task.done() or self._flush_task is asyncio.current_task():
+                    self._flush_task = asyncio.create_task(self._delayed_flush())
+                return
+            self.flushes += 1
+            self.rows_flushed += len(pending)
+
+    async def close(self) -> None:
+        task, self._flush_task = self._flush_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        if self._pending:
+            logger.error(f"FSM storage closed with {len(self._pending)} unsaved entries")
+        logger.info(f"FSM storage closed, stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            **self._cache.stats(),
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+        }
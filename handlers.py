@@ -5,6 +5,7 @@ from html import escape
 from aiogram.filters import Command, CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
+from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.types import (
     Message,
     InlineKeyboardMarkup,
@@ -28,35 +29,102 @@ from config import (
     MEDIA_GROUP_TIMEOUT,
     FAQ_QUESTIONS,
     TOPICS,
+    TICKET_LOCK_BACKEND,
+    FSM_STORAGE,
+    FSM_CACHE_SIZE,
+    FSM_CACHE_TTL,
+    FSM_FLUSH_INTERVAL,
+    FAQ_RETRIEVAL_ENABLED,
+    FAQ_DIRECT_ANSWER_THRESHOLD,
+    FAQ_PROMPT_TOP_K,
+    AI_TITLE_TIMEOUT,
+    AI_STRUCTURED_OUTPUT,
+    AI_STREAMING,
+    AI_STREAM_EDIT_INTERVAL,
+    AI_STREAM_MIN_CHARS,
+    AI_COALESCE_WINDOW,
+    AI_HISTORY_ENABLED,
+    AI_HISTORY_TURNS,
+    AI_HISTORY_TOKENS,
+    AI_HISTORY_CACHE_SIZE,
 )
 from database import (
     get_ticket,
     get_user_by_thread,
     update_ticket_client_activity,
     update_ticket_support_activity,
-    get_db_pool,
     update_user_language,
     get_user_language,
+    set_default_user_language,
     update_ticket_tech_thread,
     save_ticket_message,
     get_ticket_messages,
+    get_ticket_history,
     mark_ai_responded,
     check_if_human_responded,
     get_ai_response_count,
     mark_human_responded,
+    open_ticket,
+    ticket_exists,
+    clear_ticket_tech_thread,
+    mark_ticket_closed,
+    forget_cached_ticket,
 )
 from utils import MessageToHtmlConverter, build_topic_url
 from ai_assistant import ai_assistant
-import asyncio
+from faq_index import faq_index
+from outbound import setup_outbound_queue
+from bot_info import get_bot_id, is_forum_chat
+from locks import UserLockManager
+from thread_titles import ThreadTitleUpdater
+from reply_stream import ReplyStreamer
+from message_coalescer import MessageCoalescer, Superseded
+from conversation import ConversationStore
+from screens import (
+    get_screen,
+    render_text,
+    create_language_keyboard,
+    create_topic_subpage,
+    START_SCREEN,
+    FAQ_ANSWER,
+    COOPERATION,
+    ERROR,
+    TICKET_ALREADY_OPEN,
+    DESCRIBE_ISSUE,
+)
+from fsm_storage import PostgresStorage
 
 logger = logging.getLogger(__name__)
 
 router = Router()
 bot = Bot(token=API_TOKEN)
-dp = Dispatcher()
+outbound_queue = setup_outbound_queue(bot)
+# Состояния диалогов в Postgres: общие для реплик и переживают рестарт
+if FSM_STORAGE == "postgres":
+    fsm_storage = PostgresStorage(FSM_CACHE_SIZE, FSM_CACHE_TTL, FSM_FLUSH_INTERVAL)
+else:
+    fsm_storage = MemoryStorage()
+dp = Dispatcher(storage=fsm_storage)
 dp.include_router(router)
-user_languages = {}
-ticket_creation_locks = {}
+ticket_locks = UserLockManager(TICKET_LOCK_BACKEND)
+
+
+async def _generate_thread_title(first_message: str, topic: str, lang: str) -> Optional[str]:
+    return await ai_assistant.generate_thread_title(first_message, topic, lang, fallback=False)
+
+
+# ИИ-названия тем поддержки — вне пути создания тикета
+thread_titles = ThreadTitleUpdater(bot, SUPPORT_CHAT_ID, _generate_thread_title, timeout=AI_TITLE_TIMEOUT)
+reply_streamer = ReplyStreamer(bot, interval=AI_STREAM_EDIT_INTERVAL, min_chars=AI_STREAM_MIN_CHARS)
+# История диалога по тикету для ИИ; подписывается на события тикетов в main
+conversations = ConversationStore(
+    get_ticket_history,
+    summarize=ai_assistant.summarize_conversation,
+    spawn=ai_assistant.governor.spawn,
+    max_turns=AI_HISTORY_TURNS,
+    token_budget=AI_HISTORY_TOKENS,
+    cache_size=AI_HISTORY_CACHE_SIZE,
+)
 
 async def safe_callback_answer(callback: CallbackQuery, text: str = "", show_alert: bool = False) -> bool:
     """
@@ -133,13 +201,9 @@ async def update_user_commands(user_id: int, lang: str):
 
 async def get_language(user_id: int, default_lang: str = DEFAULT_LANGUAGE, language_code: str = None) -> str:
     logger.debug(f"Getting language for user {user_id}, language_code={language_code}")
-    if user_id in user_languages:
-        return user_languages[user_id]
-
     lang = await get_user_language(user_id)
     if lang:
-        user_languages[user_id] = lang
-        logger.debug(f"Retrieved language from DB: {lang}")
+        logger.debug(f"Retrieved cached language: {lang}")
         return lang
 
     if language_code and language_code in ("en", "ru"):
@@ -149,103 +213,9 @@ async def get_language(user_id: int, default_lang: str = DEFAULT_LANGUAGE, langu
         lang = default_lang
         logger.debug(f"Falling back to default language: {lang}")
 
-    await update_user_language(user_id, lang)
-    user_languages[user_id] = lang
+    await set_default_user_language(user_id, lang)
     return lang
 
-def create_language_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="🇺🇸 English", callback_data="lang_en"),
-            InlineKeyboardButton(text="🇷🇺 Русский", callback_data="lang_ru")
-        ],
-    ])
-
-def create_topics_keyboard(lang: str) -> InlineKeyboardMarkup:
-    topics = TRANSLATIONS[lang]["topics"]
-    markup = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text=topics["balance"], callback_data="topic_balance"),
-            InlineKeyboardButton(text=topics["bugs"], callback_data="topic_bugs"),
-        ],
-        [
-            InlineKeyboardButton(text=topics["withdrop"], callback_data="topic_withdrop"),
-            InlineKeyboardButton(text=topics["other"], callback_data="topic_other"),
-        ],
-        [
-            InlineKeyboardButton(text=topics["cooperation"], callback_data="topic_cooperation")
-        ]
-    ])
-    logger.debug(f"Created topics keyboard: {markup}")
-    return markup
-
-def create_topic_subpage(topic: str, lang: str) -> tuple[str, InlineKeyboardMarkup]:
-    logger.debug(f"Creating subpage for topic: {topic}, lang: {lang}")
-    if topic not in FAQ_QUESTIONS:
-        logger.error(f"Invalid topic in FAQ_QUESTIONS: {topic}")
-        text = TRANSLATIONS[lang]["error"]
-        markup = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(
-                text=TRANSLATIONS[lang]["back"],
-                callback_data="back_to_topics"
-            )]
-        ])
-        return text, markup
-
-    try:
-        faq = FAQ_QUESTIONS[topic][lang]
-        subpage_text = TRANSLATIONS[lang]["select_topic"]
-        faq_buttons = []
-        if topic == "bugs":
-            faq_buttons = [
-                [InlineKeyboardButton(
-                    text=faq[f"question{i}"],
-                    callback_data=f"contact_{topic}_subtopic{i}"
-                )] for i in range(1, 10) if f"question{i}" in faq
-            ]
-        else:
-            faq_buttons = [
-                [InlineKeyboardButton(
-                    text=faq[f"question{i}"],
-                    callback_data=f"faq_{topic}_question{i}"
-                )] for i in range(1, 10) if f"question{i}" in faq
-            ]
-        action_buttons = [
-            [InlineKeyboardButton(
-                text=TRANSLATIONS[lang].get("back", "Back"),
-                callback_data="back_to_topics"
-            )]
-        ]
-        markup = InlineKeyboardMarkup(inline_keyboard=faq_buttons + action_buttons)
-        return subpage_text, markup
-    except Exception as e:
-        logger.error(f"Error creating subpage for topic {topic}, lang {lang}: {e}")
-        text = TRANSLATIONS[lang]["error"]
-        markup = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(
-                text=TRANSLATIONS[lang]["back"],
-                callback_data="back_to_topics"
-            )]
-        ])
-        return text, markup
-
-def create_faq_answer_keyboard(lang: str, topic: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(
-            text=TRANSLATIONS[lang].get("contact_operator", "Contact operator"),
-            callback_data=f"contact_{topic}"
-        )],
-        [InlineKeyboardButton(
-            text=TRANSLATIONS[lang].get("back", "Back"),
-            callback_data="back_to_subpage"
-        )]
-    ])
-
-def create_back_to_topics_keyboard(lang: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=TRANSLATIONS[lang]["back"], callback_data="back_to_topics")]
-    ])
-
 def create_close_ticket_keyboard(user_id: int, lang: str, tech_thread_id: Optional[int] = None) -> InlineKeyboardMarkup:
     buttons = [
         [
@@ -310,7 +280,14 @@ def create_tech_ticket_keyboard(user_id: int, support_thread_id: int) -> InlineK
 
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-async def create_forum_thread(user_id: int, topic: str, subtopic: str, lang: str, first_message: str = "") -> int:
+async def create_forum_thread(
+    user_id: int,
+    topic: str,
+    subtopic: str,
+    lang: str,
+    first_message: str = "",
+    title_from_reply: bool = False,
+) -> int:
     try:
         user_info = await bot.get_chat(user_id)
         username = f"@{user_info.username}" if user_info.username else f"user{user_id}"
@@ -320,13 +297,8 @@ async def create_forum_thread(user_id: int, topic: str, subtopic: str, lang: str
         topic_name_ru = get_topic_display(topic)
         subtopic_text = subtopic or "Не указан"
 
-        # Генерируем умное название с помощью ИИ
-        if first_message:
-            ai_title = await ai_assistant.generate_thread_title(first_message, topic, lang)
-            title = f"{ai_title} | id{user_id}"
-        else:
-            # Fallback если нет первого сообщения
-            title = f"🟢 ОТКРЫТО: {topic_name_ru} - id{user_id}"
+        # Тема создаётся сразу с обычным названием, ИИ-название придёт в фоне
+        title = f"🟢 ОТКРЫТО: {topic_name_ru} - id{user_id}"
         user_details = (
             f"<b>👤 Пользователь:</b> <code>{first_name} {last_name}</code>\n"
             f"<b>🆔 ID:</b> <code>{user_id}</code>\n"
@@ -357,6 +329,10 @@ async def create_forum_thread(user_id: int, topic: str, subtopic: str, lang: str
             forum_topic.message_thread_id
         )
 
+        # title_from_reply: название придёт вместе с ответом ИИ клиенту, без отдельного запроса
+        thread_titles.schedule(
+            forum_topic.message_thread_id, user_id, first_message, topic, lang, wait_for_reply=title_from_reply
+        )
         return forum_topic.message_thread_id
     except TelegramAPIError as e:
         logger.error(f"Error creating forum topic: {e}")
@@ -371,13 +347,109 @@ async def extract_reply_markup(message: Message) -> Optional[InlineKeyboardMarku
     return None
 
 
-async def send_ai_response_to_client(user_id: int, user_message: str, lang: str, topic: Optional[str] = None):
+async def send_ai_response_to_client(
+    user_id: int,
+    user_message: str,
+    lang: str,
+    topic: Optional[str] = None,
+    title_thread_id: Optional[int] = None,
+):
     """
     Отправляет автоматический ответ ИИ клиенту (невидимо для клиента).
     Клиент не знает что это ИИ - выглядит как обычный ответ поддержки.
+    title_thread_id — новая тема, ждущая название из этого ответа: его передают в любом случае,
+    None (ответа не было) запускает отдельную генерацию.
     """
+    title = None
+    superseded = False
+    try:
+        with_title = title_thread_id is not None and thread_titles.awaiting(title_thread_id)
+        title = await _respond_with_ai(user_id, user_message, lang, topic, with_title)
+    except Superseded:
+        # Клиент дописал сообщение: ответ (и название) будут из следующего хода по всему тексту
+        superseded = True
+        logger.info(f"✂️ AI response for user {user_id} superseded by a newer message")
+    finally:
+        if title_thread_id is not None and not superseded:
+            thread_titles.provide(title_thread_id, title)
+
+
+# Шаблонные ответы клиенту при передаче оператору
+_HANDOVER_REPLY = {
+    "ru": "Занимаемся изучением вашей проблемы. Скоро вернёмся с решением.",
+    "en": "We're investigating your issue. Will get back to you with a solution soon.",
+    "uz": "Muammoingizni o'rganmoqdamiz. Tez orada yechim bilan qaytamiz."
+}
+_HANDOVER_REPLY_EMOTION = {
+    "ru": "Понял вас. Занимаемся изучением вашей проблемы и скоро вернёмся с решением.",
+    "en": "I understand. We're investigating your issue and will get back to you with a solution soon.",
+    "uz": "Tushundim. Muammoingizni o'rganmoqdamiz va tez orada yechim bilan qaytamiz."
+}
+
+
+async def _hand_over_to_operator(
+    user_id: int,
+    user_message: str,
+    lang: str,
+    reason: str,
+    client_reply: Optional[dict] = _HANDOVER_REPLY,
+    topic_fallback: str = "Вопрос",
+    message_label: str = "Сообщение клиента",
+):
+    """
+    Передача тикета оператору: шаблонный ответ клиенту (client_reply=None — без него, клиенту уже
+    ответили), пометка темы "🚨 ОПЕРАТОР", алерт в чат поддержки; дальше отвечает человек
+    """
+    if client_reply is not None:
+        await bot.send_message(
+            chat_id=user_id,
+            text=client_reply.get(lang, client_reply["ru"])
+        )
+    try:
+        ticket_info = await get_ticket(user_id)
+        if ticket_info:
+            thread_id = ticket_info[0]
+            _, _, topic_name, _, _, _ = ticket_info
+            if thread_id:
+                try:
+                    topic_display = get_topic_display(topic_name) if topic_name else topic_fallback
+                    new_title = f"🚨 ОПЕРАТОР: {topic_display} - id{user_id}"
+                    # ИИ-название, если ещё не пришло, не должно перетереть пометку
+                    thread_titles.cancel(thread_id)
+                    await bot.edit_forum_topic(
+                        chat_id=SUPPORT_CHAT_ID,
+                        message_thread_id=thread_id,
+                        name=new_title
+                    )
+                    logger.info(f"✏️ Thread title updated to: {new_title}")
+                except Exception as e:
+                    logger.error(f"Failed to update thread title: {e}")
+                
+                alert_message = (
+                    "🚨 <b>ТРЕБУЕТСЯ ОПЕРАТОР!</b> 🚨\n\n"
+                    f"⚠️ {reason}\n"
+                    "📞 Необходима помощь живого оператора!\n\n"
+                    f"💬 {message_label}:\n<blockquote>{escape(user_message[:200])}</blockquote>"
+                )
+                await bot.send_message(
+                    chat_id=SUPPORT_CHAT_ID,
+                    text=alert_message,
+                    message_thread_id=thread_id,
+                    parse_mode="HTML"
+                )
+                logger.info(f"🚨 Alert sent to support chat for user {user_id}: {reason}")
+    except Exception as e:
+        logger.error(f"Failed to send alert to support chat: {e}")
+    
+    await mark_human_responded(user_id)
+
+
+async def _respond_with_ai(
+    user_id: int, user_message: str, lang: str, topic: Optional[str], with_title: bool
+) -> Optional[str]:
+    """Тело send_ai_response_to_client; возвращает название тикета из ответа ИИ, если оно было"""
     from config import AI_ENABLED, AI_AUTO_RESPOND, AI_MAX_RESPONSES
-    from ai_assistant import detect_strong_emotion, ai_wants_to_escalate
+    from ai_assistant import detect_strong_emotion
     from database import get_ai_response_count
     
     logger.info(f"🤖 ========== AI AUTO-RESPONSE START ==========")
@@ -412,125 +484,60 @@ async def send_ai_response_to_client(user_id: int, user_message: str, lang: str,
     # Если AI уже ответил 3+ раза без ответа оператора - эскалируем
     if ai_count >= 3:
         logger.info(f"🔄 AI answered {ai_count} times already, escalating to human operator")
-        
-        # Отвечаем пользователю профессионально
-        translations = {
-            "ru": "Занимаемся изучением вашей проблемы. Скоро вернёмся с решением.",
-            "en": "We're investigating your issue. Will get back to you with a solution soon.",
-            "uz": "Muammoingizni o'rganmoqdamiz. Tez orada yechim bilan qaytamiz."
-        }
-        await bot.send_message(
-            chat_id=user_id,
-            text=translations.get(lang, translations["ru"])
+        message_coalescer.answered(user_id)
+        await _hand_over_to_operator(
+            user_id, user_message, lang,
+            "AI уже ответил 3+ раза, но проблема не решена.",
+            message_label="Последнее сообщение клиента",
         )
-        
-        # Уведомляем чат поддержки и меняем название темы
-        try:
-            ticket_info = await get_ticket(user_id)
-            if ticket_info:
-                thread_id = ticket_info[0]
-                _, _, topic_name, _, _, _ = ticket_info
-                if thread_id:
-                    # Меняем название темы на "🚨 ОПЕРАТОР"
-                    try:
-                        topic_display = get_topic_display(topic_name) if topic_name else "Вопрос"
-                        new_title = f"🚨 ОПЕРАТОР: {topic_display} - id{user_id}"
-                        await bot.edit_forum_topic(
-                            chat_id=SUPPORT_CHAT_ID,
-                            message_thread_id=thread_id,
-                            name=new_title
-                        )
-                        logger.info(f"✏️ Thread title updated to: {new_title}")
-                    except Exception as e:
-                        logger.error(f"Failed to update thread title: {e}")
-                    
-                    # Отправляем алерт
-                    alert_message = (
-                        "🚨 <b>ТРЕБУЕТСЯ ОПЕРАТОР!</b> 🚨\n\n"
-                        "⚠️ AI уже ответил 3+ раза, но проблема не решена.\n"
-                        "📞 Необходима помощь живого оператора!\n\n"
-                        f"💬 Последнее сообщение клиента:\n<blockquote>{user_message[:200]}</blockquote>"
-                    )
-                    await bot.send_message(
-                        chat_id=SUPPORT_CHAT_ID,
-                        text=alert_message,
-                        message_thread_id=thread_id,
-                        parse_mode="HTML"
-                    )
-                    logger.info(f"🚨 Alert sent to support chat for user {user_id} (AI response limit reached)")
-        except Exception as e:
-            logger.error(f"Failed to send alert to support chat: {e}")
-        
-        # Помечаем что нужен человек
-        await mark_human_responded(user_id)
         return
     
     # Проверяем наличие сильных эмоций/мата/технических проблем
     if detect_strong_emotion(user_message):
         logger.info(f"😡 Strong emotion/technical issue detected! Escalating to human operator immediately")
-        
-        # Отвечаем профессионально
-        translations = {
-            "ru": "Понял вас. Занимаемся изучением вашей проблемы и скоро вернёмся с решением.",
-            "en": "I understand. We're investigating your issue and will get back to you with a solution soon.",
-            "uz": "Tushundim. Muammoingizni o'rganmoqdamiz va tez orada yechim bilan qaytamiz."
-        }
-        await bot.send_message(
-            chat_id=user_id,
-            text=translations.get(lang, translations["ru"])
+        message_coalescer.answered(user_id)
+        await _hand_over_to_operator(
+            user_id, user_message, lang,
+            "Обнаружена техническая проблема или сильные эмоции.",
+            client_reply=_HANDOVER_REPLY_EMOTION,
+            topic_fallback="Проблема",
         )
-        
-        # Уведомляем чат поддержки и меняем название темы
-        try:
-            ticket_info = await get_ticket(user_id)
-            if ticket_info:
-                thread_id = ticket_info[0]
-                _, _, topic_name, _, _, _ = ticket_info
-                if thread_id:
-                    # Меняем название темы на "🚨 ОПЕРАТОР"
-                    try:
-                        topic_display = get_topic_display(topic_name) if topic_name else "Проблема"
-                        new_title = f"🚨 ОПЕРАТОР: {topic_display} - id{user_id}"
-                        await bot.edit_forum_topic(
-                            chat_id=SUPPORT_CHAT_ID,
-                            message_thread_id=thread_id,
-                            name=new_title
-                        )
-                        logger.info(f"✏️ Thread title updated to: {new_title}")
-                    except Exception as e:
-                        logger.error(f"Failed to update thread title: {e}")
-                    
-                    # Отправляем алерт
-                    alert_message = (
-                        "🚨 <b>ТРЕБУЕТСЯ ОПЕРАТОР!</b> 🚨\n\n"
-                        "⚠️ Обнаружена техническая проблема или сильные эмоции.\n"
-                        "📞 Необходима помощь живого оператора!\n\n"
-                        f"💬 Сообщение клиента:\n<blockquote>{user_message[:200]}</blockquote>"
-                    )
-                    await bot.send_message(
-                        chat_id=SUPPORT_CHAT_ID,
-                        text=alert_message,
-                        message_thread_id=thread_id,
-                        parse_mode="HTML"
-                    )
-                    logger.info(f"🚨 Alert sent to support chat for user {user_id}")
-        except Exception as e:
-            logger.error(f"Failed to send alert to support chat: {e}")
-        
-        # Помечаем что нужен человек (он ответит дальше)
-        await mark_human_responded(user_id)
         return
     
     try:
-        # Получаем ответ от ИИ
-        context = {"topic": topic} if topic else None
-        logger.info(f"📞 Calling ai_assistant.get_ai_response...")
+        # Сначала ищем по FAQ: уверенное совпадение — курируемый ответ без ИИ,
+        # иначе в промпт идут только найденные записи
+        faq_entry = None
+        reply = None
+        stream = None
+        context = {"topic": topic} if topic else {}
+        if FAQ_RETRIEVAL_ENABLED:
+            matches = faq_index.search(user_message, lang, topic, k=max(FAQ_PROMPT_TOP_K, 1))
+            faq_entry = faq_index.direct_answer(matches, FAQ_DIRECT_ANSWER_THRESHOLD)
+            if matches and FAQ_PROMPT_TOP_K > 0:
+                context["faq"] = [match.entry for match in matches]
         
-        ai_response = await ai_assistant.get_ai_response(
-            user_message=user_message,
-            lang=lang,
-            context=context
-        )
+        if faq_entry:
+            logger.info(f"📚 Answering from FAQ: {faq_entry.topic} question{faq_entry.number}")
+            # Ход считается отвеченным до отправки: дописанное клиентом сообщение не повторит этот ответ
+            message_coalescer.answered(user_id)
+            ai_response = faq_entry.answer
+        else:
+            logger.info(f"📞 Calling ai_assistant.get_ai_reply...")
+            if AI_HISTORY_ENABLED:
+                ticket_info = await get_ticket(user_id)
+                if ticket_info and ticket_info[0]:
+                    context["history"] = await conversations.context(user_id, ticket_info[0])
+            # Потоковый режим: клиент видит начало ответа, пока остальное генерируется
+            stream = reply_streamer.start(user_id) if AI_STREAMING else None
+            reply = await message_coalescer.cancellable(user_id, ai_assistant.get_ai_reply(
+                user_message=user_message,
+                lang=lang,
+                context=context or None,
+                with_title=with_title,
+                on_text=stream.update if stream else None
+            ))
+            ai_response = reply.text if reply else None
         
         logger.info(f"📨 AI response received: {ai_response is not None}")
         
@@ -542,11 +549,15 @@ async def send_ai_response_to_client(user_id: int, user_message: str, lang: str,
             converter = MessageToHtmlConverter(ai_response, None)
             logger.info(f"📤 Sending AI response to user {user_id}...")
             
-            await bot.send_message(
-                chat_id=user_id,
-                text=converter.html,
-                parse_mode="HTML"
-            )
+            if stream:
+                await stream.finish(converter.html)
+                logger.info(f"⚡ Time to first byte for user {user_id}: {stream.ttfb_ms:.0f} ms")
+            else:
+                await bot.send_message(
+                    chat_id=user_id,
+                    text=converter.html,
+                    parse_mode="HTML"
+                )
             
             logger.info(f"✅ Message sent to user {user_id}")
             
@@ -556,60 +567,30 @@ async def send_ai_response_to_client(user_id: int, user_message: str, lang: str,
                 if ticket_info:
                     thread_id = ticket_info[0]  # thread_id первый элемент
                     if thread_id:
-                        ai_marker = "🤖 <b>[ОТВЕТ ИИ]</b>\n\n" + converter.html
-                        await bot.send_message(
+                        marker = "📚 <b>[ОТВЕТ ИЗ FAQ]</b>" if faq_entry else "🤖 <b>[ОТВЕТ ИИ]</b>"
+                        ai_marker = f"{marker}\n\n{converter.html}"
+                        forwarded = await bot.send_message(
                             chat_id=SUPPORT_CHAT_ID,
                             text=ai_marker,
                             message_thread_id=thread_id,
                             parse_mode="HTML"
                         )
+                        await save_ticket_message(
+                            user_id, forwarded.message_id, SUPPORT_CHAT_ID, thread_id, text=ai_response, role="assistant"
+                        )
                         logger.info(f"📨 AI response forwarded to support chat (thread {thread_id})")
             except Exception as e:
                 logger.error(f"❌ Failed to forward AI response to support chat: {e}")
             
-            # Проверяем - хочет ли AI передать вопрос оператору
-            if ai_wants_to_escalate(ai_response):
-                logger.info(f"🔄 AI wants to escalate - sending alert to operator")
-                
-                # Отправляем алерт оператору и меняем название темы
-                try:
-                    ticket_info = await get_ticket(user_id)
-                    if ticket_info:
-                        thread_id = ticket_info[0]
-                        _, _, topic_name, _, _, _ = ticket_info
-                        if thread_id:
-                            # Меняем название темы на "🚨 ОПЕРАТОР"
-                            try:
-                                topic_display = get_topic_display(topic_name) if topic_name else "Вопрос"
-                                new_title = f"🚨 ОПЕРАТОР: {topic_display} - id{user_id}"
-                                await bot.edit_forum_topic(
-                                    chat_id=SUPPORT_CHAT_ID,
-                                    message_thread_id=thread_id,
-                                    name=new_title
-                                )
-                                logger.info(f"✏️ Thread title updated to: {new_title}")
-                            except Exception as e:
-                                logger.error(f"Failed to update thread title: {e}")
-                            
-                            # Отправляем алерт
-                            alert_message = (
-                                "🚨 <b>ТРЕБУЕТСЯ ОПЕРАТОР!</b> 🚨\n\n"
-                                "⚠️ AI передал вопрос оператору (не знает ответа).\n"
-                                "📞 Необходима помощь живого оператора!\n\n"
-                                f"💬 Сообщение клиента:\n<blockquote>{user_message[:200]}</blockquote>"
-                            )
-                            await bot.send_message(
-                                chat_id=SUPPORT_CHAT_ID,
-                                text=alert_message,
-                                message_thread_id=thread_id,
-                                parse_mode="HTML"
-                            )
-                            logger.info(f"🚨 Escalation alert sent to support chat for user {user_id}")
-                except Exception as e:
-                    logger.error(f"Failed to send escalation alert: {e}")
-                
-                # Помечаем что нужен человек
-                await mark_human_responded(user_id)
+            # Проверяем - хочет ли AI передать вопрос оператору (курируемый ответ из FAQ не проверяем)
+            if reply and reply.escalate:
+                logger.info(f"🔄 AI wants to escalate (sentiment={reply.sentiment}) - sending alert to operator")
+                # Клиенту уже ушёл ответ ИИ — без шаблонного сообщения
+                await _hand_over_to_operator(
+                    user_id, user_message, lang,
+                    "AI передал вопрос оператору (не знает ответа).",
+                    client_reply=None,
+                )
                 logger.info(f"✅ Escalated to human operator")
             else:
                 # Отмечаем что ИИ ответил (обычный ответ)
@@ -620,11 +601,33 @@ async def send_ai_response_to_client(user_id: int, user_message: str, lang: str,
             logger.info(f"🎉 AI AUTO-RESPONSE SUCCESS for user {user_id}")
         else:
             logger.error(f"❌ AI could not generate response for user {user_id}")
+            if stream:
+                await stream.abort()
+            # Провайдер недоступен: клиент не остаётся без ответа, вопрос сразу у оператора
+            if ai_assistant.governor.is_open():
+                await _hand_over_to_operator(user_id, user_message, lang, "ИИ временно недоступен.")
             
+    except Superseded:
+        if stream:
+            await stream.abort()
+        raise
     except Exception as e:
         logger.error(f"💥 Error sending AI auto-response to user {user_id}: {e}", exc_info=True)
+        reply = None
+        # Недописанный потоковый ответ не остаётся у клиента (доставленный полностью abort не трогает)
+        if stream:
+            try:
+                await stream.abort()
+            except Exception as abort_error:
+                logger.error(f"Failed to abort partial AI reply for user {user_id}: {abort_error}")
     
     logger.info(f"🤖 ========== AI AUTO-RESPONSE END ==========")
+    return reply.title if reply else None
+
+# Несколько сообщений подряд — один ответ ИИ на весь текст
+message_coalescer = MessageCoalescer(
+    AI_COALESCE_WINDOW, send_ai_response_to_client, spawn=ai_assistant.governor.spawn
+)
 
 @router.message(Command("lang"), F.chat.type == "private")
 async def cmd_lang(message: Message, state: FSMContext):
@@ -644,13 +647,12 @@ async def process_language_selection(callback: CallbackQuery, state: FSMContext)
 
     try:
         await update_user_language(user_id, lang)
-        user_languages[user_id] = lang
         await update_user_commands(user_id, lang)
         logger.debug(f"Language set to {lang} for user {user_id}")
-        converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
+        screen = get_screen(lang, START_SCREEN)
         await callback.message.edit_text(
-            converter.html,
-            reply_markup=create_topics_keyboard(lang),
+            screen.html,
+            reply_markup=screen.markup,
             parse_mode="HTML"
         )
         await state.set_state(TicketStates.waiting_for_topic)
@@ -661,10 +663,10 @@ async def process_language_selection(callback: CallbackQuery, state: FSMContext)
         await state.set_state(TicketStates.waiting_for_topic)
     except Exception as e:
         logger.error(f"Error updating language: {e}")
-        converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
+        screen = get_screen(lang, START_SCREEN)
         await callback.message.edit_text(
-            converter.html,
-            reply_markup=create_topics_keyboard(lang),
+            screen.html,
+            reply_markup=screen.markup,
             parse_mode="HTML"
         )
         await callback.answer("Please try again.")
@@ -679,10 +681,10 @@ async def cmd_start(message: Message, state: FSMContext):
     language_code = message.from_user.language_code
     lang = await get_language(user_id, language_code=language_code)
 
-    converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
+    screen = get_screen(lang, START_SCREEN)
     await message.answer(
-        converter.html,
-        reply_markup=create_topics_keyboard(lang),
+        screen.html,
+        reply_markup=screen.markup,
         parse_mode="HTML"
     )
     await state.set_state(TicketStates.waiting_for_topic)
@@ -696,10 +698,10 @@ async def back_to_topics(callback: CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
     lang = await get_language(user_id)
     try:
-        converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
+        screen = get_screen(lang, START_SCREEN)
         await callback.message.edit_text(
-            converter.html,
-            reply_markup=create_topics_keyboard(lang),
+            screen.html,
+            reply_markup=screen.markup,
             parse_mode="HTML"
         )
         await state.set_state(TicketStates.waiting_for_topic)
@@ -721,10 +723,10 @@ async def back_to_subpage(callback: CallbackQuery, state: FSMContext):
     if not topic:
         logger.error(f"No topic found in state for user {user_id}")
         try:
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
+            screen = get_screen(lang, START_SCREEN)
             await callback.message.edit_text(
-                converter.html,
-                reply_markup=create_topics_keyboard(lang),
+                screen.html,
+                reply_markup=screen.markup,
                 parse_mode="HTML"
             )
             await state.set_state(TicketStates.waiting_for_topic)
@@ -735,10 +737,9 @@ async def back_to_subpage(callback: CallbackQuery, state: FSMContext):
         return
 
     try:
-        subpage_text, subpage_markup = create_topic_subpage(topic, lang)
-        converter = MessageToHtmlConverter(subpage_text, None)
+        subpage_html, subpage_markup = create_topic_subpage(topic, lang)
         await callback.message.edit_text(
-            converter.html,
+            subpage_html,
             reply_markup=subpage_markup,
             parse_mode="HTML"
         )
@@ -749,10 +750,10 @@ async def back_to_subpage(callback: CallbackQuery, state: FSMContext):
     except Exception as e:
         logger.error(f"Error returning to subpage for topic {topic}: {e}")
         try:
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
+            screen = get_screen(lang, START_SCREEN)
             await callback.message.edit_text(
-                converter.html,
-                reply_markup=create_topics_keyboard(lang),
+                screen.html,
+                reply_markup=screen.markup,
                 parse_mode="HTML"
             )
             await state.set_state(TicketStates.waiting_for_topic)
@@ -772,11 +773,11 @@ async def select_topic(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Invalid topic selected: {topic}")
         try:
             current_text = callback.message.text or ""
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
-            if current_text != converter.html:
+            screen = get_screen(lang, START_SCREEN)
+            if current_text != screen.html:
                 await callback.message.edit_text(
-                    converter.html,
-                    reply_markup=create_topics_keyboard(lang),
+                    screen.html,
+                    reply_markup=screen.markup,
                     parse_mode="HTML"
                 )
             await state.set_state(TicketStates.waiting_for_topic)
@@ -789,30 +790,18 @@ async def select_topic(callback: CallbackQuery, state: FSMContext):
 
     try:
         if topic == "cooperation":
-            buttons = [
-                [InlineKeyboardButton(
-                    text=TRANSLATIONS[lang].get("contact_operator", "Contact operator"),
-                    callback_data=f"contact_{topic}"
-                )],
-                [InlineKeyboardButton(
-                    text=TRANSLATIONS[lang].get("back", "Back"),
-                    callback_data="back_to_topics"
-                )]
-            ]
-            cooperation_text = TRANSLATIONS[lang].get("cooperation_message", "Please provide details about your cooperation proposal.")
-            converter = MessageToHtmlConverter(cooperation_text, None, buttons=buttons)
+            screen = get_screen(lang, COOPERATION)
             await callback.message.edit_text(
-                converter.html,
-                reply_markup=converter.get_reply_markup(),
+                screen.html,
+                reply_markup=screen.markup,
                 parse_mode="HTML"
             )
             await state.clear()
         else:
             await state.update_data(topic=topic)
-            subpage_text, subpage_markup = create_topic_subpage(topic, lang)
-            converter = MessageToHtmlConverter(subpage_text, None)
+            subpage_html, subpage_markup = create_topic_subpage(topic, lang)
             await callback.message.edit_text(
-                converter.html,
+                subpage_html,
                 reply_markup=subpage_markup,
                 parse_mode="HTML"
             )
@@ -823,10 +812,10 @@ async def select_topic(callback: CallbackQuery, state: FSMContext):
     except Exception as e:
         logger.error(f"Error in select_topic for topic {topic}: {e}")
         try:
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
+            screen = get_screen(lang, START_SCREEN)
             await callback.message.edit_text(
-                converter.html,
-                reply_markup=create_topics_keyboard(lang),
+                screen.html,
+                reply_markup=screen.markup,
                 parse_mode="HTML"
             )
             await state.set_state(TicketStates.waiting_for_topic)
@@ -841,13 +830,10 @@ async def show_faq_answer(callback: CallbackQuery, state: FSMContext):
     lang = await get_language(user_id)
     try:
         _, topic, question_key = callback.data.split("_")
-        question_num = question_key.replace("question", "")
-        faq = FAQ_QUESTIONS[topic][lang]
-        answer_text = f"📩 <b>{faq[f'question{question_num}']}</b>\n\n{faq[f'answer{question_num}']}"
-        converter = MessageToHtmlConverter(answer_text, None)
+        screen = get_screen(lang, FAQ_ANSWER, f"{topic}_{question_key}")
         await callback.message.edit_text(
-            converter.html,
-            reply_markup=create_faq_answer_keyboard(lang, topic),
+            screen.html,
+            reply_markup=screen.markup,
             parse_mode="HTML"
         )
         await state.update_data(topic=topic)
@@ -858,10 +844,10 @@ async def show_faq_answer(callback: CallbackQuery, state: FSMContext):
     except Exception as e:
         logger.error(f"Error showing FAQ answer for {callback.data}: {e}")
         try:
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["error"], None)
+            screen = get_screen(lang, ERROR)
             await callback.message.edit_text(
-                converter.html,
-                reply_markup=create_back_to_topics_keyboard(lang),
+                screen.html,
+                reply_markup=screen.markup,
                 parse_mode="HTML"
             )
             await state.set_state(TicketStates.waiting_for_topic)
@@ -885,10 +871,10 @@ async def contact_operator(callback: CallbackQuery, state: FSMContext):
     try:
         thread_id, status, _, tech_thread_id, _, _ = await get_ticket(user_id)
         if status == "open":
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["ticket_already_open"], None)
+            screen = get_screen(lang, TICKET_ALREADY_OPEN)
             await callback.message.edit_text(
-                converter.html,
-                reply_markup=create_back_to_topics_keyboard(lang),
+                screen.html,
+                reply_markup=screen.markup,
                 parse_mode="HTML"
             )
             await state.set_state(TicketStates.waiting_for_topic)
@@ -896,10 +882,10 @@ async def contact_operator(callback: CallbackQuery, state: FSMContext):
             return
 
         await state.update_data(topic=topic, subtopic=subtopic, tech_thread_id=tech_thread_id)
-        converter = MessageToHtmlConverter(TRANSLATIONS[lang]["describe_issue"], None)
+        screen = get_screen(lang, DESCRIBE_ISSUE)
         await callback.message.edit_text(
-            converter.html,
-            reply_markup=create_back_to_topics_keyboard(lang),
+            screen.html,
+            reply_markup=screen.markup,
             parse_mode="HTML"
         )
         await state.set_state(TicketStates.waiting_for_description)
@@ -908,10 +894,10 @@ async def contact_operator(callback: CallbackQuery, state: FSMContext):
         await state.set_state(TicketStates.waiting_for_description)
     except Exception as e:
         logger.error(f"Error in contact_operator: {e}")
-        converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
+        screen = get_screen(lang, START_SCREEN)
         await callback.message.edit_text(
-            converter.html,
-            reply_markup=create_topics_keyboard(lang),
+            screen.html,
+            reply_markup=screen.markup,
             parse_mode="HTML"
         )
         await state.set_state(TicketStates.waiting_for_topic)
@@ -925,10 +911,10 @@ async def create_ticket(message: Message, state: FSMContext):
     topic = data.get("topic")
     subtopic = data.get("subtopic", None)
 
-    if user_id not in ticket_creation_locks:
-        ticket_creation_locks[user_id] = asyncio.Lock()
-
-    async with ticket_creation_locks[user_id]:
+    async with ticket_locks.lock(user_id):
+        if ticket_locks.distributed:
+            # Тикет могла открыть другая реплика, пока мы ждали блокировку
+            forget_cached_ticket(user_id)
         try:
             existing_thread_id, status, _, tech_thread_id, _, _ = await get_ticket(user_id)
             reply_markup = await extract_reply_markup(message)  # Извлечение клавиатуры
@@ -944,7 +930,7 @@ async def create_ticket(message: Message, state: FSMContext):
                         reply_markup=reply_markup,  # Передача клавиатуры
                         parse_mode="HTML"
                     )
-                    await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, existing_thread_id)
+                    await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, existing_thread_id, text=message.text, role="user")
                 elif message.sticker:
                     sent_message = await bot.send_sticker(
                         SUPPORT_CHAT_ID,
@@ -971,41 +957,25 @@ async def create_ticket(message: Message, state: FSMContext):
                         reply_markup=reply_markup,  # Передача клавиатуры
                         parse_mode="HTML"
                     )
-                    await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, existing_thread_id)
+                    await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, existing_thread_id, text=message.caption, role="user")
                 await update_ticket_client_activity(user_id)
                 return
 
             # ⚡ СРАЗУ отправляем базовое сообщение пользователю для быстрой обратной связи
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["ticket_submitted"], None)
             await message.answer(
-                converter.html,
+                render_text(lang, "ticket_submitted"),
                 parse_mode="HTML"
             )
 
             # Получаем текст первого сообщения для ИИ-названия темы
             first_msg_text = message.text or (message.caption if message.photo else "")
-            thread_id = await create_forum_thread(user_id, topic, subtopic, "ru", first_msg_text)
-
-            async with (await get_db_pool()).acquire() as conn:
-                await conn.execute(
-                    """
-                    INSERT INTO tickets (user_id, thread_id, status, topic, last_message_time) 
-                    VALUES ($1, $2, $3, $4, $5)
-                    ON CONFLICT (user_id) DO UPDATE 
-                    SET thread_id = $2,
-                        status = $3,
-                        topic = $4,
-                        last_message_time = $5,
-                        support_reminder_sent = FALSE,
-                        tech_reminder_sent = FALSE,
-                        tech_thread_id = NULL,
-                        human_responded = FALSE,
-                        ai_responded = FALSE,
-                        ai_response_count = 0
-                    """,
-                    user_id, thread_id, "open", topic, datetime.now()
-                )
-                logger.info(f"🔄 New ticket created, AI counters reset for user {user_id}")
+            thread_id = await create_forum_thread(
+                user_id, topic, subtopic, "ru", first_msg_text,
+                title_from_reply=bool(message.text) and AI_STRUCTURED_OUTPUT
+            )
+
+            await open_ticket(user_id, thread_id, topic)
+            logger.info(f"🔄 New ticket created, AI counters reset for user {user_id}")
 
             if message.text:
                 converter = MessageToHtmlConverter(message.text, message.entities)
@@ -1016,7 +986,7 @@ async def create_ticket(message: Message, state: FSMContext):
                     reply_markup=reply_markup,  # Передача клавиатуры
                     parse_mode="HTML"
                 )
-                await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, thread_id)
+                await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, thread_id, text=message.text, role="user")
             elif message.sticker:
                 sent_message = await bot.send_sticker(
                     SUPPORT_CHAT_ID,
@@ -1043,7 +1013,7 @@ async def create_ticket(message: Message, state: FSMContext):
                     reply_markup=reply_markup,  # Передача клавиатуры
                     parse_mode="HTML"
                 )
-                await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, thread_id)
+                await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, thread_id, text=message.caption, role="user")
 
             await update_ticket_client_activity(user_id)
 
@@ -1053,14 +1023,13 @@ async def create_ticket(message: Message, state: FSMContext):
             # Автоматически отвечаем через ИИ на первое сообщение
             if message.text:
                 logger.info(f"🎯 Creating AI response task for user {user_id}, message: {message.text[:50]}")
-                asyncio.create_task(send_ai_response_to_client(user_id, message.text, lang, topic))
+                message_coalescer.add(user_id, message.text, lang=lang, topic=topic, title_thread_id=thread_id)
                 logger.info(f"✅ AI response task created")
 
         except Exception as e:
             logger.error(f"Error creating ticket: {e}", exc_info=True)
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["error"], None)
             await message.answer(
-                converter.html,
+                render_text(lang, "error"),
                 parse_mode="HTML"
             )
 
@@ -1073,16 +1042,15 @@ async def forward_to_support(message: Message, state: FSMContext):
     tech_thread_id = data.get("tech_thread_id")
 
     if not thread_id:
-        converter = MessageToHtmlConverter(TRANSLATIONS[lang]["error"], None)
         await message.answer(
-            converter.html,
+            render_text(lang, "error"),
             parse_mode="HTML"
         )
         await state.clear()
-        converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
+        screen = get_screen(lang, START_SCREEN)
         await message.answer(
-            converter.html,
-            reply_markup=create_topics_keyboard(lang),
+            screen.html,
+            reply_markup=screen.markup,
             parse_mode="HTML"
         )
         return
@@ -1099,15 +1067,14 @@ async def forward_to_support(message: Message, state: FSMContext):
             await state.update_data(tech_thread_id=tech_thread_id)
 
         if status != "open":
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["ticket_closed_message"], None)
             await message.answer(
-                converter.html,
+                render_text(lang, "ticket_closed_message"),
                 parse_mode="HTML"
             )
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
+            screen = get_screen(lang, START_SCREEN)
             await message.answer(
-                converter.html,
-                reply_markup=create_topics_keyboard(lang),
+                screen.html,
+                reply_markup=screen.markup,
                 parse_mode="HTML"
             )
             await state.clear()
@@ -1124,7 +1091,7 @@ async def forward_to_support(message: Message, state: FSMContext):
                 reply_markup=reply_markup,  # Передача клавиатуры
                 parse_mode="HTML"
             )
-            await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, thread_id)
+            await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, thread_id, text=message.text, role="user")
         elif message.sticker:
             sent_message = await bot.send_sticker(
                 SUPPORT_CHAT_ID,
@@ -1151,7 +1118,7 @@ async def forward_to_support(message: Message, state: FSMContext):
                 reply_markup=reply_markup,  # Передача клавиатуры
                 parse_mode="HTML"
             )
-            await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, thread_id)
+            await save_ticket_message(user_id, sent_message.message_id, SUPPORT_CHAT_ID, thread_id, text=message.caption, role="user")
 
         await update_ticket_client_activity(user_id)
         
@@ -1163,7 +1130,7 @@ async def forward_to_support(message: Message, state: FSMContext):
         
         if user_message_text and not human_responded:
             logger.info(f"🎯 Creating AI response task for follow-up message from user {user_id}")
-            asyncio.create_task(send_ai_response_to_client(user_id, user_message_text, lang))
+            message_coalescer.add(user_id, user_message_text, lang=lang)
             logger.info(f"✅ AI response task created")
         elif human_responded:
             logger.info(f"👨‍💼 Human has responded, not calling AI for user {user_id}")
@@ -1172,9 +1139,8 @@ async def forward_to_support(message: Message, state: FSMContext):
 
     except Exception as e:
         logger.error(f"Error forwarding message: {e}")
-        converter = MessageToHtmlConverter(TRANSLATIONS[lang]["error"], None)
         await message.answer(
-            converter.html,
+            render_text(lang, "error"),
             parse_mode="HTML"
         )
 
@@ -1190,22 +1156,16 @@ async def handle_random_message(message: Message, state: FSMContext):
         await state.update_data(thread_id=thread_id, tech_thread_id=tech_thread_id, topic=topic)
         await forward_to_support(message, state)
     else:
-        async with (await get_db_pool()).acquire() as conn:
-            ticket_exists = await conn.fetchval(
-                "SELECT EXISTS (SELECT 1 FROM tickets WHERE user_id = $1)",
-                user_id
-            )
-        if ticket_exists:
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["ticket_closed_message"], None)
+        if await ticket_exists(user_id):
             await message.answer(
-                converter.html,
+                render_text(lang, "ticket_closed_message"),
                 parse_mode="HTML"
             )
 
-        converter = MessageToHtmlConverter(TRANSLATIONS[lang]["start_screen"], None)
+        screen = get_screen(lang, START_SCREEN)
         await message.answer(
-            converter.html,
-            reply_markup=create_topics_keyboard(lang),
+            screen.html,
+            reply_markup=screen.markup,
             parse_mode="HTML"
         )
         await state.clear()
@@ -1231,11 +1191,7 @@ async def prompt_tech_ticket(callback: CallbackQuery):
             )
         except (TelegramBadRequest, TelegramForbiddenError) as exc:
             logger.warning(f"Stored tech thread {tech_thread_id} invalid for user {user_id}: {exc}")
-            async with (await get_db_pool()).acquire() as conn:
-                await conn.execute(
-                    "UPDATE tickets SET tech_thread_id = NULL WHERE user_id = $1",
-                    user_id
-                )
+            await clear_ticket_tech_thread(user_id)
             thread_active = False
 
         if thread_active:
@@ -1335,6 +1291,10 @@ async def confirm_tech_ticket(callback: CallbackQuery):
     topic_name_ru = TRANSLATIONS["ru"]["topics"].get(topic, topic or "Не указано")
     title = f"🛠 ТЕХ: {topic_name_ru} - id{user_id}"
 
+    if is_forum_chat(TECH_SUPPORT_CHAT_ID) is False:
+        await safe_callback_answer(callback, "В чате технической поддержки не включены темы", show_alert=True)
+        return
+
     try:
         forum_topic = await bot.create_forum_topic(
             chat_id=TECH_SUPPORT_CHAT_ID,
@@ -1444,11 +1404,7 @@ async def close_tech_ticket(callback: CallbackQuery):
         await safe_callback_answer(callback, "Не удалось закрыть тикет", show_alert=True)
         return
 
-    async with (await get_db_pool()).acquire() as conn:
-        await conn.execute(
-            "UPDATE tickets SET tech_thread_id = NULL WHERE user_id = $1",
-            user_id
-        )
+    await clear_ticket_tech_thread(user_id)
 
     await callback.message.edit_reply_markup(reply_markup=None)
     await safe_callback_answer(callback, "Технический тикет закрыт")
@@ -1497,6 +1453,7 @@ async def close_ticket_button(callback: CallbackQuery, state: FSMContext):
             benign_markers = ("TOPIC_NOT_MODIFIED", "FORUM_TOPIC_CLOSED")
             return isinstance(exc, TelegramBadRequest) and any(marker in message for marker in benign_markers)
 
+        thread_titles.cancel(thread_id)
         try:
             await bot.edit_forum_topic(
                 chat_id=SUPPORT_CHAT_ID,
@@ -1560,11 +1517,7 @@ async def close_ticket_button(callback: CallbackQuery, state: FSMContext):
                 if not _is_benign_topic_error(exc):
                     raise
 
-        async with (await get_db_pool()).acquire() as conn:
-            await conn.execute(
-                "UPDATE tickets SET status = 'closed', tech_thread_id = NULL WHERE user_id = $1",
-                user_id
-            )
+        await mark_ticket_closed(user_id)
 
         try:
             await callback.message.edit_reply_markup(reply_markup=None)
@@ -1577,10 +1530,9 @@ async def close_ticket_button(callback: CallbackQuery, state: FSMContext):
         try:
             await state.clear()
             lang = await get_language(user_id)
-            converter = MessageToHtmlConverter(TRANSLATIONS[lang]["ticket_closed"], None)
             await bot.send_message(
                 chat_id=user_id,
-                text=converter.html,
+                text=render_text(lang, "ticket_closed"),
                 parse_mode="HTML"
             )
         except Exception as e:
@@ -1600,8 +1552,7 @@ async def forward_to_user(message: Message, state: FSMContext):
         return
     
     # ВАЖНО: Проверяем что сообщение НЕ от бота!
-    bot_info = await bot.get_me()
-    is_from_bot = message.from_user.id == bot_info.id
+    is_from_bot = message.from_user.id == get_bot_id(bot)
     
     # Проверяем что это НЕ сообщение ИИ (с меткой 🤖)
     is_ai_message = message.text and "🤖" in message.text and "[ОТВЕТ ИИ]" in message.text
@@ -1613,7 +1564,11 @@ async def forward_to_user(message: Message, state: FSMContext):
     logger.info(f"📨 Message in support chat from user {message.from_user.id}, is_from_bot={is_from_bot}")
 
     try:
-        await save_ticket_message(user_id, message.message_id, SUPPORT_CHAT_ID, thread_id)
+        # Ответы оператора тоже попадают в историю диалога ИИ
+        operator_text = None if is_from_bot else (message.text or message.caption)
+        await save_ticket_message(
+            user_id, message.message_id, SUPPORT_CHAT_ID, thread_id, text=operator_text, role="operator"
+        )
         reply_markup = await extract_reply_markup(message)  # Извлечение клавиатуры
 
         if message.text:
@@ -0,0 +1,42 @@
+from typing import NamedTuple
+
+
+class KeywordMatch(NamedTuple):
+    hits: dict[str, set[str]]   # категория -> найденные ключевые слова
+    score: float                # сумма weight * число разных слов по категориям
+
+    def __contains__(self, category: str) -> bool:
+        return category in self.hits
+
+
+class KeywordMatcher:
+    """
+    Поиск подстрок из нескольких категорий, результат — все найденные категории сразу.
+    categories: {"категория": {"weight": 1.0, "keywords": [...]}}, слова — в нижнем регистре.
+
+    Текст приводится к нижнему регистру один раз, каждое слово (общее для нескольких категорий —
+    тоже один раз) проверяется через "in": в CPython это быстрый поиск подстроки на C, и ни регулярка,
+    ни разбор по токенам его не обгоняют. Семантика — "keyword in text.lower()" по каждому слову.
+    """
+
+    def __init__(self, categories: dict[str, dict]):
+        self.weights = {name: float(spec.get("weight", 1.0)) for name, spec in categories.items()}
+        owners: dict[str, list[str]] = {}
+        for name, spec in categories.items():
+            for keyword in spec["keywords"]:
+                keyword = keyword.lower()
+                if keyword.strip() and name not in owners.setdefault(keyword, []):
+                    owners[keyword].append(name)
+        self._keywords = tuple((keyword, tuple(names)) for keyword, names in owners.items())
+
+    def match(self, text: str) -> KeywordMatch:
+        hits: dict[str, set[str]] = {}
+        if not text:
+            return KeywordMatch(hits, 0.0)
+        lowered = text.lower()
+        for keyword, names in self._keywords:
+            if keyword in lowered:
+                for name in names:
+                    hits.setdefault(name, set()).add(keyword)
+        score = sum(self.weights[name] * len(words) for name, words in hits.items())
+        return KeywordMatch(hits, score)
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from contextlib import suppress
+from typing import Awaitable, Callable
+
+from database import get_db_pool
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки лидера воркера напоминаний
+REMINDER_LEADER_KEY = 0x72656D64  # "remd"
+
+
+async def run_as_leader(
+    name: str,
+    lock_key: int,
+    job: Callable[[], Awaitable[None]],
+    retry_interval: float = 15.0,
+    check_interval: float = 10.0,
+):
+    """
+    Запускает job только на одной реплике: той, что держит session-level advisory-блокировку.
+    Блокировка живёт, пока живо соединение; если оно оборвалось, job останавливается,
+    а другая реплика забирает лидерство со следующей попытки.
+    """
+    while True:
+        try:
+            await _lead_once(name, lock_key, job, check_interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            logger.error(f"Leadership for {name} lost: {exc}")
+        await asyncio.sleep(retry_interval)
+
+
+async def _lead_once(
+    name: str,
+    lock_key: int,
+    job: Callable[[], Awaitable[None]],
+    check_interval: float,
+):
+    pool = await get_db_pool()
+    conn = await pool.acquire()
+    try:
+        if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", lock_key):
+            return
+
+        logger.info(f"👑 This replica is now the leader for {name}")
+        job_task = asyncio.create_task(job())
+        try:
+            while not job_task.done():
+                done, _ = await asyncio.wait({job_task}, timeout=check_interval)
+                if not done:
+                    # Проверяем, что соединение с блокировкой ещё живо
+                    await asyncio.wait_for(conn.fetchval("SELECT 1"), timeout=check_interval)
+            if not job_task.cancelled() and job_task.exception() is not None:
+                logger.error(f"{name} stopped with error: {job_task.exception()}")
+        finally:
+            if not job_task.done():
+                job_task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await job_task
+    except Exception:
+        # Разрываем сессию: блокировка, если ещё держится, снимется вместе с ней
+        conn.terminate()
+        raise
+    finally:
+        # При возврате в пул asyncpg выполняет pg_advisory_unlock_all()
+        with suppress(Exception):
+            await pool.release(conn)
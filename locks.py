@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Hashable
+
+from database import get_db_pool
+
+logger = logging.getLogger(__name__)
+
+# Пространство ключей advisory-блокировок тикетов (первый аргумент pg_advisory_lock(int, int))
+_TICKET_LOCK_NAMESPACE = 0x746B74  # "tkt"
+
+
+class _LocalLocks:
+    """Блокировки по ключу с подсчётом ссылок: запись удаляется, когда лок никто не держит и не ждёт"""
+
+    def __init__(self):
+        self._locks: dict[Hashable, tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        lock, refs = self._locks.get(key, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self._locks[key] = (lock, refs + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, refs = self._locks[key]
+            if refs <= 1:
+                del self._locks[key]
+            else:
+                self._locks[key] = (lock, refs - 1)
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class UserLockManager:
+    """
+    Сериализует работу с одним пользователем.
+    local    — только внутри процесса;
+    postgres — дополнительно advisory-блокировка в БД, общая для всех реплик бота.
+    """
+
+    def __init__(self, backend: str = "local"):
+        if backend not in ("local", "postgres"):
+            raise ValueError(f"Unknown lock backend: {backend}")
+        self.backend = backend
+        self._local = _LocalLocks()
+
+    @property
+    def distributed(self) -> bool:
+        return self.backend == "postgres"
+
+    @asynccontextmanager
+    async def lock(self, user_id: int):
+        # Локальный лок первым: конкурирующие задачи одного процесса не занимают лишние соединения пула
+        async with self._local.hold(user_id):
+            if not self.distributed:
+                yield
+                return
+            pool = await get_db_pool()
+            async with pool.acquire() as conn:
+                key = user_id % 2147483647
+                await conn.execute("SELECT pg_advisory_lock($1, $2)", _TICKET_LOCK_NAMESPACE, key)
+                try:
+                    yield
+                finally:
+                    try:
+                        await conn.execute("SELECT pg_advisory_unlock($1, $2)", _TICKET_LOCK_NAMESPACE, key)
+                    except Exception as exc:
+                        # Соединение с незакрытой блокировкой пул закроет, блокировка снимется вместе с сессией
+                        logger.error(f"Failed to release ticket lock for user {user_id}: {exc}")
+                        conn.terminate()
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "held": len(self._local)}
@@ -1,19 +1,68 @@
 import asyncio
 import logging
+import signal
 from contextlib import suppress
-from datetime import datetime, timezone, timedelta
+from datetime import timedelta
 
-from config import API_TOKEN, SUPPORT_CHAT_ID, TECH_SUPPORT_CHAT_ID, AUTO_CLOSE_ENABLED, AUTO_CLOSE_HOURS
+from config import (
+    API_TOKEN,
+    SUPPORT_CHAT_ID,
+    TECH_SUPPORT_CHAT_ID,
+    AUTO_CLOSE_ENABLED,
+    AUTO_CLOSE_HOURS,
+    REMINDER_SWEEP_MINUTES,
+    REMINDER_CONCURRENCY,
+    BOT_INFO_REFRESH_MINUTES,
+    BOT_MODE,
+    DROP_PENDING_UPDATES,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_WORKERS,
+    WEBHOOK_ENQUEUE_TIMEOUT,
+    WEBHOOK_DRAIN_TIMEOUT,
+    REMINDER_LEADER_ELECTION,
+    FAQ_QUESTIONS,
+    AI_DRAIN_TIMEOUT,
+)
 from database import (
     init_db,
-    get_open_tickets_for_reminders,
-    mark_support_reminder_sent,
-    mark_tech_reminder_sent,
-    mark_close_reminder_sent,
+    get_reminder_timers,
+    claim_due_support_reminders,
+    claim_due_tech_reminders,
+    claim_due_close_reminders,
+    claim_due_auto_closes,
+    release_reminder_claims,
     save_ticket_message,
-    auto_close_ticket,
+    start_write_behind,
+    stop_write_behind,
+    start_ticket_cache_sync,
+    stop_ticket_cache_sync,
+    get_ticket_cache_stats,
+    preload_user_languages,
+    get_language_cache_stats,
+    add_ticket_listener,
+    remove_ticket_listener,
+)
+from handlers import dp, bot, outbound_queue, fsm_storage, thread_titles, reply_streamer, message_coalescer, conversations, setup_bot_commands
+from outbound import send_priority, PRIORITY_BACKGROUND
+from bot_info import load_bot_facts, start_bot_facts_refresh, stop_bot_facts_refresh
+from webhook import WebhookServer
+from leader import run_as_leader, REMINDER_LEADER_KEY
+from screens import build_screen_cache
+from ai_assistant import ai_assistant
+from faq_index import faq_index
+from reminder_scheduler import (
+    ReminderScheduler,
+    ReminderSource,
+    SUPPORT_REMINDER,
+    TECH_REMINDER,
+    CLOSE_REMINDER,
+    AUTO_CLOSE,
 )
-from handlers import dp, bot, setup_bot_commands
 
 logging.basicConfig(
     level=logging.INFO,
@@ -52,172 +101,266 @@ async def main():
     if not API_TOKEN:
         logger.error("API_TOKEN is missing in .env")
         raise ValueError("API_TOKEN is missing")
+    if BOT_MODE == "webhook" and not (WEBHOOK_URL and WEBHOOK_SECRET):
+        logger.error("WEBHOOK_URL and WEBHOOK_SECRET are required in webhook mode")
+        raise ValueError("Webhook is not configured")
 
-    # Clear webhook and updates
-    await bot.delete_webhook(drop_pending_updates=True)
-    logger.info("Webhook and updates cleared")
+    if BOT_MODE != "webhook":
+        # Накопившиеся обновления сохраняются, если явно не попросили их сбросить
+        await bot.delete_webhook(drop_pending_updates=DROP_PENDING_UPDATES)
+        logger.info(f"Webhook removed (pending updates dropped: {DROP_PENDING_UPDATES})")
 
     # Initialize database
     await init_db()
     logger.info("Database initialized")
 
+    # Буферизованная запись активности тикетов
+    start_write_behind()
+    # Изменения тикетов на других репликах сбрасывают их из локального кеша
+    start_ticket_cache_sync()
+
+    # Языки пользователей с открытыми тикетами — одним запросом, чтобы не ходить в БД на первых сообщениях
+    preloaded = await preload_user_languages()
+    logger.info(f"Preloaded {preloaded} user languages")
+
+    # Статические экраны меню и FAQ рендерятся один раз, дальше отдаются готовыми
+    build_screen_cache()
+    # Системные промпты ИИ по (язык, тема) — тоже один раз
+    ai_assistant.compile_prompts()
+    # Индекс FAQ для ответов без ИИ и подбора записей в промпт
+    faq_index.build(FAQ_QUESTIONS)
+    # История диалогов ИИ пополняется из сохраняемых сообщений тикетов
+    add_ticket_listener(conversations.handle_event)
+
     # Set bot commands
     await setup_bot_commands()
     logger.info("Bot commands set")
 
-    reminder_task = asyncio.create_task(reminder_worker())
+    # Кто мы и умеют ли рабочие чаты в темы — один раз при старте, дальше редкое обновление
+    work_chats = [SUPPORT_CHAT_ID, TECH_SUPPORT_CHAT_ID]
+    await load_bot_facts(bot, work_chats)
+    start_bot_facts_refresh(bot, work_chats, BOT_INFO_REFRESH_MINUTES)
+
+    # Напоминания и автозакрытие уступают очередь отправки ответам клиентам
+    with send_priority(PRIORITY_BACKGROUND):
+        if REMINDER_LEADER_ELECTION:
+            # При нескольких репликах напоминания рассылает только одна
+            reminder_task = asyncio.create_task(run_as_leader("reminder worker", REMINDER_LEADER_KEY, reminder_worker))
+        else:
+            reminder_task = asyncio.create_task(reminder_worker())
 
-    # Start polling
-    logger.info("Starting polling...")
     try:
-        await dp.start_polling(bot, skip_updates=True)
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            logger.info("Starting polling...")
+            await dp.start_polling(bot)
     finally:
         reminder_task.cancel()
         with suppress(asyncio.CancelledError):
             await reminder_task
         logger.info("Reminder task stopped")
+        await stop_bot_facts_refresh()
+        # Начатые ответы ИИ дописываются до закрытия хранилищ и записи в БД
+        message_coalescer.flush()
+        await ai_assistant.governor.drain(AI_DRAIN_TIMEOUT)
+        await thread_titles.close()
+        await fsm_storage.close()
+        await stop_write_behind()
+        await stop_ticket_cache_sync()
+        logger.info(f"Ticket cache stats: {get_ticket_cache_stats()}")
+        logger.info(f"Language cache stats: {get_language_cache_stats()}")
+        logger.info(f"Outbound queue stats: {outbound_queue.stats()}")
+        logger.info(f"AI prompt stats: {ai_assistant.prompt_stats()}")
+        logger.info(f"AI governor stats: {ai_assistant.governor.stats()}")
+        logger.info(f"AI message coalescing stats: {message_coalescer.stats()}")
+        logger.info(f"AI conversation history stats: {conversations.stats()}")
+        logger.info(f"AI reply streaming stats: {reply_streamer.stats()}")
+        logger.info(f"FAQ index stats: {faq_index.stats()}")
+        if ai_assistant.answer_cache is not None:
+            logger.info(f"AI answer cache stats: {ai_assistant.answer_cache.stats()}")
+
+
+async def run_webhook():
+    server = WebhookServer(
+        dp,
+        bot,
+        secret=WEBHOOK_SECRET,
+        path=WEBHOOK_PATH,
+        queue_size=WEBHOOK_QUEUE_SIZE,
+        workers=WEBHOOK_WORKERS,
+        enqueue_timeout=WEBHOOK_ENQUEUE_TIMEOUT,
+    )
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    await server.start(WEBHOOK_HOST, WEBHOOK_PORT)
+    try:
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=DROP_PENDING_UPDATES,
+        )
+        logger.info(f"Webhook set to {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+        await stop_event.wait()
+        logger.info("Stop signal received")
+    finally:
+        # Вебхук не удаляем: другие реплики продолжают принимать обновления
+        await server.stop(WEBHOOK_DRAIN_TIMEOUT)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            with suppress(NotImplementedError):
+                loop.remove_signal_handler(sig)
+
+
+async def _send_support_reminder(record):
+    user_id, thread_id = record["user_id"], record["thread_id"]
+    message = await bot.send_message(
+        chat_id=SUPPORT_CHAT_ID,
+        text=REMINDER_SUPPORT_TEXT,
+        message_thread_id=thread_id,
+        parse_mode="HTML"
+    )
+    await save_ticket_message(user_id, message.message_id, SUPPORT_CHAT_ID, thread_id)
 
 
-def _as_utc(dt: datetime | None) -> datetime | None:
-    if dt is None:
-        return None
-    if dt.tzinfo is None:
-        return dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc)
+async def _send_tech_reminder(record):
+    await bot.send_message(
+        chat_id=TECH_SUPPORT_CHAT_ID,
+        text=REMINDER_TECH_TEXT,
+        message_thread_id=record["tech_thread_id"],
+        parse_mode="HTML"
+    )
+
+
+async def _send_close_reminder(record):
+    user_id, thread_id = record["user_id"], record["thread_id"]
+    message = await bot.send_message(
+        chat_id=SUPPORT_CHAT_ID,
+        text=CLOSE_REMINDER_TEXT,
+        message_thread_id=thread_id,
+        parse_mode="HTML"
+    )
+    await save_ticket_message(user_id, message.message_id, SUPPORT_CHAT_ID, thread_id)
+
+
+async def _auto_close(record):
+    # Тикет уже закрыт в БД запросом claim_due_auto_closes (клиент НЕ получает уведомления - тихое закрытие)
+    user_id, thread_id = record["user_id"], record["thread_id"]
+
+    # Пытаемся отправить уведомление в чат поддержки
+    try:
+        message = await bot.send_message(
+            chat_id=SUPPORT_CHAT_ID,
+            text=AUTO_CLOSE_SUPPORT_TEXT.format(hours=AUTO_CLOSE_HOURS),
+            message_thread_id=thread_id,
+            parse_mode="HTML"
+        )
+        await save_ticket_message(user_id, message.message_id, SUPPORT_CHAT_ID, thread_id)
+    except Exception as exc:
+        # Тема форума не найдена - значит уже закрыта вручную, это нормально
+        if "message thread not found" in str(exc).lower():
+            logger.debug(f"Thread {thread_id} not found for user {user_id} (already closed manually)")
+        else:
+            logger.warning(f"Failed to send auto-close message for user {user_id}: {exc}")
+
+    # Пытаемся закрыть тему форума
+    try:
+        await bot.close_forum_topic(
+            chat_id=SUPPORT_CHAT_ID,
+            message_thread_id=thread_id
+        )
+        logger.info(f"✅ Ticket auto-closed successfully for user {user_id}")
+    except Exception as exc:
+        # Тема форума не найдена - значит уже закрыта, это нормально
+        if "message thread not found" in str(exc).lower():
+            logger.debug(f"Thread {thread_id} already closed for user {user_id}")
+        else:
+            logger.warning(f"Failed to close forum topic for user {user_id}: {exc}")
+
+
+def _reminder_sources(client_overdue_minutes: int, close_overdue_hours: int) -> dict[str, ReminderSource]:
+    # Пороги считаются в SQL: из БД приходят только просроченные тикеты
+    sources = {
+        SUPPORT_REMINDER: ReminderSource(
+            claim=lambda: claim_due_support_reminders(client_overdue_minutes),
+            deliver=_send_support_reminder,
+            release=lambda user_ids: release_reminder_claims(SUPPORT_REMINDER, user_ids),
+        ),
+        CLOSE_REMINDER: ReminderSource(
+            claim=lambda: claim_due_close_reminders(close_overdue_hours),
+            deliver=_send_close_reminder,
+            release=lambda user_ids: release_reminder_claims(CLOSE_REMINDER, user_ids),
+        ),
+    }
+    if TECH_SUPPORT_CHAT_ID:
+        sources[TECH_REMINDER] = ReminderSource(
+            claim=lambda: claim_due_tech_reminders(client_overdue_minutes),
+            deliver=_send_tech_reminder,
+            release=lambda user_ids: release_reminder_claims(TECH_REMINDER, user_ids),
+        )
+    if AUTO_CLOSE_ENABLED:
+        sources[AUTO_CLOSE] = ReminderSource(
+            claim=lambda: claim_due_auto_closes(AUTO_CLOSE_HOURS),
+            deliver=_auto_close,
+        )
+    return sources
 
 
 async def reminder_worker(
-    interval_minutes: int = 5,
     client_overdue_minutes: int = 60,
-    close_overdue_hours: int = 8
+    close_overdue_hours: int = 8,
+    sweep_minutes: int = REMINDER_SWEEP_MINUTES
 ):
     logger.info("Reminder worker started")
     logger.info(f"⚙️  Auto-close enabled: {AUTO_CLOSE_ENABLED}, timeout: {AUTO_CLOSE_HOURS} hour(s)")
-    sleep_seconds = max(interval_minutes, 1) * 60
-    while True:
-        try:
-            tickets = await get_open_tickets_for_reminders()
-            now = datetime.now(timezone.utc)
-            client_delta = timedelta(minutes=client_overdue_minutes)
-            close_delta = timedelta(hours=close_overdue_hours)
-            auto_close_delta = timedelta(hours=AUTO_CLOSE_HOURS)
-
-            for ticket in tickets:
-                user_id = ticket["user_id"]
-                thread_id = ticket["thread_id"]
-                tech_thread_id = ticket["tech_thread_id"]
-                support_sent = ticket["support_reminder_sent"]
-                tech_sent = ticket["tech_reminder_sent"]
-                close_sent = ticket["close_reminder_sent"]
-                last_client = _as_utc(ticket["last_client_message_time"])
-                last_support = _as_utc(ticket["last_support_message_time"])
-
-                if (
-                    thread_id
-                    and last_client
-                    and not support_sent
-                    and now - last_client >= client_delta
-                ):
-                    try:
-                        message = await bot.send_message(
-                            chat_id=SUPPORT_CHAT_ID,
-                            text=REMINDER_SUPPORT_TEXT,
-                            message_thread_id=thread_id,
-                            parse_mode="HTML"
-                        )
-                        await save_ticket_message(user_id, message.message_id, SUPPORT_CHAT_ID, thread_id)
-                        await mark_support_reminder_sent(user_id)
-                    except Exception as exc:
-                        logger.error(f"Failed to send support reminder for user {user_id}: {exc}")
-
-                if (
-                    tech_thread_id
-                    and TECH_SUPPORT_CHAT_ID
-                    and last_client
-                    and not tech_sent
-                    and now - last_client >= client_delta
-                ):
-                    try:
-                        await bot.send_message(
-                            chat_id=TECH_SUPPORT_CHAT_ID,
-                            text=REMINDER_TECH_TEXT,
-                            message_thread_id=tech_thread_id,
-                            parse_mode="HTML"
-                        )
-                        await mark_tech_reminder_sent(user_id)
-                    except Exception as exc:
-                        logger.error(f"Failed to send tech reminder for user {user_id}: {exc}")
-
-                if (
-                    thread_id
-                    and last_support
-                    and not close_sent
-                    and now - last_support >= close_delta
-                ):
-                    try:
-                        message = await bot.send_message(
-                            chat_id=SUPPORT_CHAT_ID,
-                            text=CLOSE_REMINDER_TEXT,
-                            message_thread_id=thread_id,
-                            parse_mode="HTML"
-                        )
-                        await save_ticket_message(user_id, message.message_id, SUPPORT_CHAT_ID, thread_id)
-                        await mark_close_reminder_sent(user_id)
-                    except Exception as exc:
-                        logger.error(f"Failed to send close reminder for user {user_id}: {exc}")
-                
-                # Автоматическое закрытие тикета если клиент не отвечает
-                if (
-                    AUTO_CLOSE_ENABLED
-                    and thread_id
-                    and last_support  # Поддержка ответила
-                    and (not last_client or last_support > last_client)  # Последнее сообщение от поддержки
-                    and now - last_support >= auto_close_delta  # Прошло N часов
-                ):
-                    try:
-                        # Закрываем тикет в БД (клиент НЕ получает уведомления - тихое закрытие)
-                        await auto_close_ticket(user_id)
-                        
-                        # Пытаемся отправить уведомление в чат поддержки
-                        try:
-                            message = await bot.send_message(
-                                chat_id=SUPPORT_CHAT_ID,
-                                text=AUTO_CLOSE_SUPPORT_TEXT.format(hours=AUTO_CLOSE_HOURS),
-                                message_thread_id=thread_id,
-                                parse_mode="HTML"
-                            )
-                            await save_ticket_message(user_id, message.message_id, SUPPORT_CHAT_ID, thread_id)
-                        except Exception as exc:
-                            # Тема форума не найдена - значит уже закрыта вручную, это нормально
-                            if "message thread not found" in str(exc).lower():
-                                logger.debug(f"Thread {thread_id} not found for user {user_id} (already closed manually)")
-                            else:
-                                logger.warning(f"Failed to send auto-close message for user {user_id}: {exc}")
-                        
-                        # Пытаемся закрыть тему форума
-                        try:
-                            await bot.close_forum_topic(
-                                chat_id=SUPPORT_CHAT_ID,
-                                message_thread_id=thread_id
-                            )
-                            logger.info(f"✅ Ticket auto-closed successfully for user {user_id}")
-                        except Exception as exc:
-                            # Тема форума не найдена - значит уже закрыта, это нормально
-                            if "message thread not found" in str(exc).lower():
-                                logger.debug(f"Thread {thread_id} already closed for user {user_id}")
-                            else:
-                                logger.warning(f"Failed to close forum topic for user {user_id}: {exc}")
-                            
-                    except Exception as exc:
-                        logger.error(f"Failed to auto-close ticket for user {user_id}: {exc}")
-
-        except asyncio.CancelledError:
-            logger.info("Reminder worker cancelled")
-            raise
-        except Exception as exc:
-            logger.error(f"Reminder worker error: {exc}", exc_info=True)
-
-        await asyncio.sleep(sleep_seconds)
+    scheduler = ReminderScheduler(
+        sources=_reminder_sources(client_overdue_minutes, close_overdue_hours),
+        client_overdue=timedelta(minutes=client_overdue_minutes),
+        close_overdue=timedelta(hours=close_overdue_hours),
+        auto_close_after=timedelta(hours=AUTO_CLOSE_HOURS),
+        auto_close_enabled=AUTO_CLOSE_ENABLED,
+        tech_chat_enabled=bool(TECH_SUPPORT_CHAT_ID),
+        concurrency=REMINDER_CONCURRENCY,
+    )
+    add_ticket_listener(scheduler.handle_event)
+    scheduler_task = None
+    sweep_seconds = max(sweep_minutes, 1) * 60
+    try:
+        # Куча строится одним запросом при старте
+        while True:
+            try:
+                scheduler.begin_load()
+                scheduler.load(await get_reminder_timers())
+                break
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(f"Reminder worker error: {exc}", exc_info=True)
+                await asyncio.sleep(60)
+        scheduler_task = asyncio.create_task(scheduler.run())
+
+        # Периодический проход ловит тикеты, изменённые другими процессами; объём — только просроченные
+        while True:
+            await asyncio.sleep(sweep_seconds)
+            try:
+                await scheduler.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.error(f"Reminder sweep error: {exc}", exc_info=True)
+    except asyncio.CancelledError:
+        logger.info(f"Reminder worker cancelled, stats: {scheduler.stats()}")
+        raise
+    finally:
+        remove_ticket_listener(scheduler.handle_event)
+        if scheduler_task is not None:
+            scheduler_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await scheduler_task
 
 if __name__ == "__main__":
     try:
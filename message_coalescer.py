@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Номер хода, который выполняется в текущей задаче
+_current_turn: ContextVar[Optional[int]] = ContextVar("coalescer_turn", default=None)
+
+
+class Superseded(Exception):
+    """Ход отменён: клиент дописал сообщение, ответ будет на весь текст сразу"""
+
+
+@dataclass
+class _UserBuffer:
+    parts: list[str] = field(default_factory=list)      # Ещё не отправлено в ход
+    kwargs: dict = field(default_factory=dict)
+    timer: Optional[asyncio.Task] = None
+    live: Optional[int] = None                          # Ход, ответ которого ещё не получен
+    sent: list[str] = field(default_factory=list)       # Текст этого хода
+    sent_kwargs: dict = field(default_factory=dict)
+    call: Optional[asyncio.Task] = None                 # Его запрос к ИИ
+
+
+class MessageCoalescer:
+    """
+    Сообщения клиента, пришедшие с паузами меньше window секунд, отвечаются одним ходом ИИ
+    по склеенному тексту. Новое сообщение перезапускает окно. Если ответ на предыдущую пачку
+    ещё не получен, она присоединяется к новой, а её запрос (обёрнутый в cancellable) отменяется.
+    Уже полученный ответ не отменяется: доставка клиенту и пометки в БД доходят до конца.
+    Ответ без ИИ (FAQ, передача оператору) отмечается через answered до отправки.
+    """
+
+    def __init__(
+        self,
+        window: float,
+        respond: Callable[..., Awaitable[Any]],
+        spawn: Callable[[Any], asyncio.Task] = asyncio.create_task,
+        max_parts: int = 10,
+    ):
+        self.window = window
+        self.respond = respond
+        self.spawn = spawn
+        self.max_parts = max_parts
+        self._users: dict[Any, _UserBuffer] = {}
+        self.messages = 0
+        self.turns = 0
+        self.superseded = 0
+
+    def add(self, key, text: str, **kwargs):
+        """Добавляет сообщение; kwargs для respond — первые непустые значения в пачке"""
+        self.messages += 1
+        buffer = self._users.setdefault(key, _UserBuffer())
+        if buffer.live is not None:
+            # Ответ на прошлую пачку ещё не получен — отвечаем на всё вместе
+            buffer.parts = buffer.sent + buffer.parts
+            buffer.kwargs = {**buffer.kwargs, **buffer.sent_kwargs}
+            buffer.sent = []
+            buffer.live = None
+            if buffer.call is not None and not buffer.call.done():
+                buffer.call.cancel()
+            self.superseded += 1
+            logger.info(f"✂️ AI turn for {key} superseded by a new message, merging {len(buffer.parts) + 1} parts")
+        buffer.parts.append(text)
+        for name, value in kwargs.items():
+            if value is not None:
+                buffer.kwargs.setdefault(name, value)
+        if buffer.timer is not None:
+            buffer.timer.cancel()
+        if len(buffer.parts) >= self.max_parts or self.window <= 0:
+            self._fire(key, buffer)
+        else:
+            buffer.timer = asyncio.create_task(self._wait(key, buffer))
+
+    async def _wait(self, key, buffer: _UserBuffer):
+        await asyncio.sleep(self.window)
+        self._fire(key, buffer)
+
+    def _fire(self, key, buffer: _UserBuffer):
+        buffer.timer = None
+        # Номера ходов сквозные: буфер пользователя может быть удалён и создан заново
+        self.turns += 1
+        buffer.live = self.turns
+        buffer.sent, buffer.parts = buffer.parts, []
+        buffer.sent_kwargs, buffer.kwargs = buffer.kwargs, {}
+        self.spawn(self._turn(key, buffer, self.turns, "\n".join(buffer.sent), buffer.sent_kwargs))
+
+    async def _turn(self, key, buffer: _UserBuffer, turn: int, text: str, kwargs: dict):
+        _current_turn.set(turn)
+        try:
+            await self.respond(key, text, **kwargs)
+        finally:
+            if buffer.live == turn:
+                buffer.live = None
+                buffer.sent = []
+            if buffer.live is None and not buffer.parts and buffer.timer is None and self._users.get(key) is buffer:
+                del self._users[key]
+
+    async def cancellable(self, key, coro: Awaitable[Any]):
+        """
+        Запрос к ИИ внутри хода: отменяется, если клиент дописал сообщение, — тогда Superseded.
+        После возврата ход считается отвеченным и больше не отменяется.
+        """
+        buffer = self._users.get(key)
+        turn = _current_turn.get()
+        if buffer is None or turn is None:
+            return await coro
+        if buffer.live != turn:
+            coro.close()
+            raise Superseded()
+        task = asyncio.ensure_future(coro)
+        buffer.call = task
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            # Отменили сам запрос (а не всю задачу, например при остановке) — ход вытеснен
+            if task.cancelled() and not asyncio.current_task().cancelling():
+                raise Superseded() from None
+            raise
+        finally:
+            if buffer.call is task:
+                buffer.call = None
+        # Сообщение могло прийти, пока задача возвращала результат: тогда ответит следующий ход
+        self.answered(key)
+        return result
+
+    def answered(self, key):
+        """
+        Ход отвечен без запроса к ИИ (ответ из FAQ, передача оператору): вызывается до отправки,
+        после него ход не склеивается со следующим. Superseded — клиент уже дописал сообщение.
+        """
+        buffer = self._users.get(key)
+        turn = _current_turn.get()
+        if buffer is None or turn is None:
+            return
+        if buffer.live != turn:
+            raise Superseded()
+        buffer.live = None
+        buffer.sent = []
+
+    def flush(self):
+        """При остановке: пачки, ждущие окончания окна, отправляются сразу"""
+        for key, buffer in list(self._users.items()):
+            if buffer.timer is not None:
+                buffer.timer.cancel()
+                self._fire(key, buffer)
+
+    def stats(self) -> dict:
+        return {
+            "messages": self.messages,
+            "turns": self.turns,
+            "superseded": self.superseded,
+            "buffered_users": len(self._users),
+        }
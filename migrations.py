@@ -0,0 +1,142 @@
+import logging
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки: несколько реплик не накатывают миграции одновременно
+_MIGRATION_LOCK_KEY = 0x6D696772  # "migr"
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    sql: str
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "baseline schema", """
+        CREATE TABLE IF NOT EXISTS tickets (
+            user_id BIGINT PRIMARY KEY,
+            thread_id BIGINT,
+            tech_thread_id BIGINT,
+            status TEXT,
+            topic TEXT,
+            last_message_time TIMESTAMP,
+            last_client_message_time TIMESTAMP,
+            last_support_message_time TIMESTAMP,
+            support_reminder_sent BOOLEAN DEFAULT FALSE,
+            tech_reminder_sent BOOLEAN DEFAULT FALSE,
+            close_reminder_sent BOOLEAN DEFAULT FALSE,
+            human_responded BOOLEAN DEFAULT FALSE,
+            ai_responded BOOLEAN DEFAULT FALSE,
+            ai_response_count INTEGER DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            user_id BIGINT PRIMARY KEY,
+            lang TEXT
+        );
+        CREATE TABLE IF NOT EXISTS ticket_messages (
+            user_id BIGINT,
+            message_id BIGINT,
+            chat_id BIGINT,
+            thread_id BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, message_id)
+        );
+        -- Базы, созданные до появления этих колонок
+        ALTER TABLE tickets ADD COLUMN IF NOT EXISTS tech_thread_id BIGINT;
+        ALTER TABLE tickets ADD COLUMN IF NOT EXISTS support_reminder_sent BOOLEAN DEFAULT FALSE;
+        ALTER TABLE tickets ADD COLUMN IF NOT EXISTS tech_reminder_sent BOOLEAN DEFAULT FALSE;
+        ALTER TABLE tickets ADD COLUMN IF NOT EXISTS last_client_message_time TIMESTAMP;
+        ALTER TABLE tickets ADD COLUMN IF NOT EXISTS last_support_message_time TIMESTAMP;
+        ALTER TABLE tickets ADD COLUMN IF NOT EXISTS close_reminder_sent BOOLEAN DEFAULT FALSE;
+        ALTER TABLE tickets ADD COLUMN IF NOT EXISTS human_responded BOOLEAN DEFAULT FALSE;
+        ALTER TABLE tickets ADD COLUMN IF NOT EXISTS ai_responded BOOLEAN DEFAULT FALSE;
+        ALTER TABLE tickets ADD COLUMN IF NOT EXISTS ai_response_count INTEGER DEFAULT 0;
+        ALTER TABLE ticket_messages ADD COLUMN IF NOT EXISTS thread_id BIGINT;
+    """),
+    Migration(2, "ticket and message indexes", """
+        -- Одна тема форума принадлежит одному тикету: дубликаты остаются только у самого свежего
+        UPDATE tickets SET thread_id = NULL
+        WHERE ctid IN (
+            SELECT ctid FROM (
+                SELECT ctid, ROW_NUMBER() OVER (
+                    PARTITION BY thread_id ORDER BY last_message_time DESC NULLS LAST
+                ) AS rn
+                FROM tickets
+                WHERE thread_id IS NOT NULL
+            ) AS duplicates
+            WHERE rn > 1
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS tickets_thread_id_key ON tickets (thread_id);
+        CREATE INDEX IF NOT EXISTS tickets_open_idx ON tickets (user_id) WHERE status = 'open';
+        CREATE INDEX IF NOT EXISTS ticket_messages_lookup_idx
+            ON ticket_messages (user_id, chat_id, thread_id, created_at);
+    """),
+    Migration(3, "partial indexes for due reminders", """
+        -- Предикаты совпадают с запросами claim_due_* в database.py
+        CREATE INDEX IF NOT EXISTS tickets_support_reminder_due_idx
+            ON tickets (last_client_message_time)
+            WHERE status = 'open' AND thread_id IS NOT NULL AND support_reminder_sent IS NOT TRUE;
+        CREATE INDEX IF NOT EXISTS tickets_tech_reminder_due_idx
+            ON tickets (last_client_message_time)
+            WHERE status = 'open' AND tech_thread_id IS NOT NULL AND tech_reminder_sent IS NOT TRUE;
+        CREATE INDEX IF NOT EXISTS tickets_close_reminder_due_idx
+            ON tickets (last_support_message_time)
+            WHERE status = 'open' AND thread_id IS NOT NULL AND close_reminder_sent IS NOT TRUE;
+        CREATE INDEX IF NOT EXISTS tickets_auto_close_due_idx
+            ON tickets (last_support_message_time)
+            WHERE status = 'open' AND thread_id IS NOT NULL;
+    """),
+    Migration(4, "aiogram FSM storage", """
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            bot_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            user_id BIGINT NOT NULL,
+            thread_id BIGINT NOT NULL DEFAULT 0,
+            destiny TEXT NOT NULL DEFAULT 'default',
+            state TEXT,
+            data JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+        );
+    """),
+    Migration(5, "message text for AI conversation history", """
+        -- Текст и автор сообщений тикета: из них ИИ восстанавливает историю диалога
+        ALTER TABLE ticket_messages ADD COLUMN IF NOT EXISTS message_text TEXT;
+        ALTER TABLE ticket_messages ADD COLUMN IF NOT EXISTS role TEXT;
+    """),
+]
+
+
+async def apply_migrations(conn):
+    """Накатывает недостающие миграции и записывает версию схемы"""
+    await conn.execute("SELECT pg_advisory_lock($1)", _MIGRATION_LOCK_KEY)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        current = await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        pending = [m for m in MIGRATIONS if m.version > current]
+        if not pending:
+            logger.info(f"Database schema is up to date (version {current})")
+            return current
+
+        for migration in pending:
+            logger.info(f"Applying migration {migration.version}: {migration.description}")
+            async with conn.transaction():
+                await conn.execute(migration.sql)
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES ($1, $2)",
+                    migration.version,
+                    migration.description
+                )
+            current = migration.version
+        logger.info(f"Database schema migrated to version {current}")
+        return current
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", _MIGRATION_LOCK_KEY)
@@ -0,0 +1,239 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    TelegramMethod,
+    SendChatAction,
+    EditForumTopic,
+    CloseForumTopic,
+    ReopenForumTopic,
+    CreateForumTopic,
+    DeleteMessage,
+    GetChat,
+    GetChatMember,
+)
+from aiogram.methods.base import Response, TelegramType
+
+from config import (
+    SUPPORT_CHAT_ID,
+    TECH_SUPPORT_CHAT_ID,
+    TELEGRAM_SUPPORT_PER_MINUTE,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_GROUP_PER_MINUTE,
+    TELEGRAM_MAX_RETRIES,
+)
+from ratelimit import SendRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньше — раньше
+PRIORITY_CLIENT = 0       # Ответы клиенту в личный чат
+PRIORITY_SUPPORT = 1      # Пересылка в чат поддержки
+PRIORITY_BACKGROUND = 2   # Напоминания, переименование и закрытие тем
+
+_PRIORITY_NAMES = {
+    PRIORITY_CLIENT: "client",
+    PRIORITY_SUPPORT: "support",
+    PRIORITY_BACKGROUND: "background",
+}
+
+# Приоритет, заданный вызывающим кодом (например, воркером напоминаний)
+_send_priority: ContextVar[int | None] = ContextVar("send_priority", default=None)
+
+# Методы, которые не расходуют лимит отправки и не должны ждать в очереди
+_UNQUEUED_METHODS = (SendChatAction,)
+_BACKGROUND_METHODS = (EditForumTopic, CloseForumTopic)
+# Не отправляют сообщений: идут в очереди чата ради порядка, но мимо лимитов отправки
+_UNLIMITED_METHODS = (
+    GetChat, GetChatMember, CreateForumTopic, EditForumTopic, CloseForumTopic, ReopenForumTopic, DeleteMessage
+)
+
+
+@contextmanager
+def send_priority(priority: int):
+    """Все запросы к API внутри блока (и в созданных из него задачах) идут с этим приоритетом"""
+    token = _send_priority.set(priority)
+    try:
+        yield
+    finally:
+        _send_priority.reset(token)
+
+
+@dataclass(order=True)
+class _Request:
+    priority: int
+    seq: int
+    enqueued_at: float = field(compare=False)
+    make_request: NextRequestMiddlewareType = field(compare=False)
+    bot: Bot = field(compare=False)
+    method: TelegramMethod = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    attempts: int = field(default=0, compare=False)
+
+
+@dataclass
+class _WaitStats:
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def add(self, waited: float):
+        self.count += 1
+        self.total += waited
+        self.max = max(self.max, waited)
+
+
+class OutboundQueue(BaseRequestMiddleware):
+    """
+    Единая очередь исходящих запросов к Telegram, подключается к сессии бота.
+    У каждого чата (в форуме — у каждой темы) своя очередь с приоритетами и один обработчик —
+    порядок сообщений сохраняется; разные чаты и темы отправляются параллельно в рамках лимитов.
+    На TelegramRetryAfter чат ставится на паузу, а запрос возвращается в начало очереди.
+    """
+
+    def __init__(self, limiter: SendRateLimiter, max_retries: int = 3):
+        self._limiter = limiter
+        self._max_retries = max_retries
+        # (chat_id, message_thread_id) -> очередь и её обработчик
+        self._queues: dict[tuple, list[_Request]] = {}
+        self._workers: dict[tuple, asyncio.Task] = {}
+        self._seq = itertools.count()
+        self._wait_stats = {priority: _WaitStats() for priority in _PRIORITY_NAMES}
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or isinstance(method, _UNQUEUED_METHODS):
+            return await make_request(bot, method)
+
+        request = _Request(
+            priority=self._priority_for(chat_id, method),
+            seq=next(self._seq),
+            enqueued_at=time.monotonic(),
+            make_request=make_request,
+            bot=bot,
+            method=method,
+            future=asyncio.get_running_loop().create_future(),
+        )
+        # Темы форума независимы: порядок нужен только внутри темы
+        key = (chat_id, getattr(method, "message_thread_id", None))
+        heapq.heappush(self._queues.setdefault(key, []), request)
+        worker = self._workers.get(key)
+        if worker is None or worker.done():
+            self._workers[key] = asyncio.create_task(self._chat_worker(key))
+        return await request.future
+
+    @staticmethod
+    def _priority_for(chat_id: int | str, method: TelegramMethod) -> int:
+        priority = _send_priority.get()
+        if priority is not None:
+            return min(max(priority, PRIORITY_CLIENT), PRIORITY_BACKGROUND)
+        if isinstance(method, _BACKGROUND_METHODS):
+            return PRIORITY_BACKGROUND
+        if isinstance(chat_id, int) and chat_id > 0:
+            return PRIORITY_CLIENT
+        return PRIORITY_SUPPORT
+
+    async def _chat_worker(self, key: tuple):
+        chat_id = key[0]
+        queue = self._queues[key]
+        try:
+            while queue:
+                request = heapq.heappop(queue)
+                if request.future.done():
+                    continue  # Вызывающий уже отменил ожидание
+                if isinstance(request.method, _UNLIMITED_METHODS):
+                    # Мимо лимита, но не мимо паузы RetryAfter — иначе повторы уйдут подряд
+                    await self._limiter.wait_unblocked(chat_id)
+                else:
+                    await self._limiter.acquire(chat_id, request.priority)
+                if request.attempts == 0:
+                    self._wait_stats[request.priority].add(time.monotonic() - request.enqueued_at)
+                request.attempts += 1
+                try:
+                    response = await request.make_request(request.bot, request.method)
+                except TelegramRetryAfter as exc:
+                    self._limiter.retry_after(chat_id, exc.retry_after)
+                    if request.attempts <= self._max_retries:
+                        self.retried += 1
+                        logger.warning(
+                            f"⏳ Flood control in chat {chat_id}: retry in {exc.retry_after}s "
+                            f"(attempt {request.attempts}, queued {len(queue)})"
+                        )
+                        heapq.heappush(queue, request)
+                        continue
+                    self._fail(request, exc)
+                except Exception as exc:
+                    self._fail(request, exc)
+                else:
+                    self.sent += 1
+                    if not request.future.done():
+                        request.future.set_result(response)
+        finally:
+            # Пустая очередь удаляется: словари не растут с числом когда-либо писавших чатов
+            if not queue:
+                self._queues.pop(key, None)
+                self._workers.pop(key, None)
+
+    def _fail(self, request: _Request, exc: Exception):
+        self.failed += 1
+        if not request.future.done():
+            request.future.set_exception(exc)
+
+    def stats(self) -> dict:
+        depth = {name: 0 for name in _PRIORITY_NAMES.values()}
+        for queue in self._queues.values():
+            for request in queue:
+                depth[_PRIORITY_NAMES[request.priority]] += 1
+        return {
+            "queued": sum(depth.values()),
+            "queued_by_priority": depth,
+            "active_queues": len(self._queues),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "retry_after": self._limiter.retry_after_count,
+            "wait_ms": {
+                _PRIORITY_NAMES[priority]: {
+                    "avg": round(stats.total / stats.count * 1000, 1) if stats.count else 0.0,
+                    "max": round(stats.max * 1000, 1),
+                }
+                for priority, stats in self._wait_stats.items()
+            },
+        }
+
+
+def setup_outbound_queue(bot: Bot) -> OutboundQueue:
+    """Подключает очередь к сессии бота; все вызовы bot.* дальше идут через неё"""
+    queue = OutboundQueue(
+        SendRateLimiter(
+            global_rate=TELEGRAM_GLOBAL_RATE,
+            chat_rate=TELEGRAM_CHAT_RATE,
+            group_per_minute=TELEGRAM_GROUP_PER_MINUTE,
+            # Чат поддержки не ограничивается групповой двадцаткой в минуту: в нём пишет в основном бот,
+            # и такой лимит копит очередь на минуты; от флуда защищают общий лимит и RetryAfter
+            chat_per_minute={
+                chat_id: TELEGRAM_SUPPORT_PER_MINUTE for chat_id in (SUPPORT_CHAT_ID, TECH_SUPPORT_CHAT_ID) if chat_id
+            },
+        ),
+        max_retries=TELEGRAM_MAX_RETRIES,
+    )
+    bot.session.middleware(queue)
+    return queue
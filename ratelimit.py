@@ -0,0 +1,150 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from cache import TTLCache, MISSING
+
+# Бакеты неактивных чатов выбрасываются: после часа простоя бакет всё равно был бы полным
+_CHAT_BUCKETS_SIZE = 10000
+_CHAT_BUCKETS_TTL = 3600
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Забирает токен и возвращает 0, либо возвращает, сколько секунд подождать"""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> float:
+        """Ждёт токен; возвращает время ожидания в секундах"""
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if delay <= 0:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def blocked_for(self) -> float:
+        """Сколько секунд ещё длится пауза после RetryAfter (0 — паузы нет)"""
+        return max(0.0, self._blocked_until - time.monotonic())
+
+    def block_for(self, seconds: float):
+        """Пауза после RetryAfter: токены не выдаются, запас сгорает"""
+        now = time.monotonic()
+        self._blocked_until = max(self._blocked_until, now + seconds)
+        self._tokens = 0.0
+        self._updated = self._blocked_until
+
+
+class PriorityGate:
+    """
+    Очередь к общему TokenBucket: когда токенов не хватает,
+    первым получает токен ожидающий с меньшим номером приоритета.
+    """
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump_task: asyncio.Task | None = None
+
+    async def acquire(self, priority: int = 0):
+        if not self._waiters and self.bucket.try_acquire() <= 0:
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        while self._waiters:
+            delay = self.bucket.try_acquire()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            # Токен уже взят: отдаём его первому не отменённому ожидающему
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    future.set_result(None)
+                    break
+
+
+class SendRateLimiter:
+    """
+    Лимиты отправки Telegram: общий на бота и отдельный на каждый чат.
+    Группы (отрицательный chat_id) ограничены ~20 сообщениями в минуту, личные чаты — ~1 в секунду.
+    chat_per_minute — свой лимит для отдельных чатов (например, чата поддержки, куда пишет только бот).
+    """
+
+    def __init__(
+        self,
+        global_rate: float,
+        chat_rate: float,
+        group_per_minute: int,
+        chat_per_minute: dict[int | str, float] | None = None,
+    ):
+        self._global = PriorityGate(TokenBucket(global_rate, max(global_rate, 1)))
+        self._chat_rate = chat_rate
+        self._group_per_minute = group_per_minute
+        self._chat_per_minute = chat_per_minute or {}
+        self._chats = TTLCache(_CHAT_BUCKETS_SIZE, ttl=_CHAT_BUCKETS_TTL)
+        self.retry_after_count = 0
+
+    def _chat_bucket(self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is MISSING:
+            per_minute = self._chat_per_minute.get(chat_id)
+            if per_minute is not None:
+                bucket = TokenBucket(per_minute / 60, max(per_minute / 60, 1))
+            # Строковый chat_id — это @username канала или группы
+            elif isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self._group_per_minute / 60, self._group_per_minute)
+            else:
+                bucket = TokenBucket(self._chat_rate, 1)
+            self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def acquire(self, chat_id: int | str, priority: int = 0) -> float:
+        """Ждёт место сначала в лимите чата, затем в общем; возвращает время ожидания"""
+        started = time.monotonic()
+        await self._chat_bucket(chat_id).acquire()
+        await self._global.acquire(priority)
+        return time.monotonic() - started
+
+    async def wait_unblocked(self, chat_id: int | str) -> float:
+        """Ждёт конца паузы чата после RetryAfter, не расходуя токенов; возвращает время ожидания"""
+        started = time.monotonic()
+        bucket = self._chat_bucket(chat_id)
+        while True:
+            delay = bucket.blocked_for()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+        return time.monotonic() - started
+
+    def retry_after(self, chat_id: int | str, seconds: float):
+        self.retry_after_count += 1
+        self._chat_bucket(chat_id).block_for(seconds)
@@ -0,0 +1,346 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+SUPPORT_REMINDER = "support"
+TECH_REMINDER = "tech"
+CLOSE_REMINDER = "close"
+AUTO_CLOSE = "auto_close"
+
+# Не спим дольше этого, даже если ближайший дедлайн далеко
+_MAX_SLEEP_SECONDS = 300
+# Повтор после неудачной отправки напоминания
+_RETRY_DELAY = timedelta(minutes=1)
+# Дедлайн сработал, но claim его не вернул (часы БД отстают) или упал: повтор через 5, 10, 20... секунд
+_CLAIM_RETRY_DELAY = timedelta(seconds=5)
+_CLAIM_RETRIES = 5
+
+
+def as_utc(dt: datetime | None) -> datetime | None:
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+@dataclass
+class TicketTimers:
+    thread_id: Optional[int]
+    tech_thread_id: Optional[int] = None
+    last_client: Optional[datetime] = None
+    last_support: Optional[datetime] = None
+    support_sent: bool = False
+    tech_sent: bool = False
+    close_sent: bool = False
+
+
+class ReminderSource(NamedTuple):
+    """
+    claim   — помечает в БД и возвращает все просроченные тикеты этого типа (UPDATE ... RETURNING)
+    deliver — отправляет напоминание по одной возвращённой строке
+    release — снимает отметку с тикетов, которым отправить не удалось
+    """
+    claim: Callable[[], Awaitable[list]]
+    deliver: Callable[[object], Awaitable[None]]
+    release: Optional[Callable[[list[int]], Awaitable[None]]] = None
+
+
+class ReminderScheduler:
+    """
+    Планировщик напоминаний на min-heap по времени срабатывания.
+    Каждый открытый тикет держит до четырёх дедлайнов (support, tech, close, auto_close);
+    изменения активности в database.py пересчитывают только дедлайны затронутого тикета.
+    Устаревшие записи в куче не удаляются, а пропускаются при извлечении.
+    Сроки в памяти нужны только чтобы знать, когда проснуться: какие тикеты просрочены,
+    решает БД — один claim на тип возвращает сразу всю пачку.
+    """
+
+    def __init__(
+        self,
+        sources: dict[str, ReminderSource],
+        client_overdue: timedelta,
+        close_overdue: timedelta,
+        auto_close_after: timedelta,
+        auto_close_enabled: bool,
+        tech_chat_enabled: bool,
+        concurrency: int = 10,
+    ):
+        self._sources = sources
+        self._concurrency = max(concurrency, 1)
+        # Тайминги последнего прохода по каждому типу напоминаний
+        self._last_cycles: dict[str, dict] = {}
+        self._client_overdue = client_overdue
+        self._close_overdue = close_overdue
+        self._auto_close_after = auto_close_after
+        self._auto_close_enabled = auto_close_enabled
+        self._tech_chat_enabled = tech_chat_enabled
+        self._tickets: dict[int, TicketTimers] = {}
+        self._heap: list[tuple[datetime, int, int, str]] = []
+        self._deadlines: dict[tuple[int, str], tuple[datetime, int]] = {}
+        # Сколько раз подряд сработавший дедлайн не был забран claim
+        self._claim_misses: dict[tuple[int, str], int] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        # События, пришедшие пока выполняется запрос для load(), применяются повторно
+        self._replay: Optional[list[tuple[str, int, dict]]] = None
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+    def begin_load(self):
+        """Вызывается перед запросом открытых тикетов для load()"""
+        self._replay = []
+
+    def load(self, records):
+        """Пересобирает кучу по строкам открытых тикетов (один запрос при старте)"""
+        replay, self._replay = self._replay or [], None
+        self._tickets.clear()
+        self._heap.clear()
+        self._deadlines.clear()
+        self._claim_misses.clear()
+        for record in records:
+            self._tickets[record["user_id"]] = TicketTimers(
+                thread_id=record["thread_id"],
+                tech_thread_id=record["tech_thread_id"],
+                last_client=as_utc(record["last_client_message_time"]),
+                last_support=as_utc(record["last_support_message_time"]),
+                support_sent=bool(record["support_reminder_sent"]),
+                tech_sent=bool(record["tech_reminder_sent"]),
+                close_sent=bool(record["close_reminder_sent"]),
+            )
+        for event, user_id, data in replay:
+            self.handle_event(event, user_id, **data)
+        for user_id in self._tickets:
+            self._reschedule(user_id)
+        self._wakeup.set()
+        logger.info(f"⏰ Reminder scheduler loaded {len(self._tickets)} open tickets, {len(self._deadlines)} deadlines")
+
+    def handle_event(self, event: str, user_id: int, **data):
+        """Слушатель изменений тикетов из database.py"""
+        if self._replay is not None:
+            self._replay.append((event, user_id, data))
+        if event == "opened":
+            self._tickets[user_id] = TicketTimers(
+                thread_id=data.get("thread_id"),
+                last_client=as_utc(data.get("last_client")),
+                last_support=as_utc(data.get("last_support")),
+                close_sent=bool(data.get("close_sent")),
+            )
+        elif event == "closed":
+            self._tickets.pop(user_id, None)
+        else:
+            timers = self._tickets.get(user_id)
+            if timers is None:
+                return
+            if event == "client_activity":
+                timers.last_client = as_utc(data["at"])
+                timers.support_sent = False
+                timers.tech_sent = False
+                timers.close_sent = False
+            elif event == "support_activity":
+                timers.last_support = as_utc(data["at"])
+                timers.close_sent = False
+            elif event == "tech_thread":
+                timers.tech_thread_id = data.get("tech_thread_id")
+                timers.tech_sent = False
+            elif event == "reminder_sent":
+                setattr(timers, f"{data['kind']}_sent", True)
+            else:
+                return
+        self._reschedule(user_id)
+
+    def _due_times(self, timers: TicketTimers) -> dict[str, Optional[datetime]]:
+        due: dict[str, Optional[datetime]] = {
+            SUPPORT_REMINDER: None,
+            TECH_REMINDER: None,
+            CLOSE_REMINDER: None,
+            AUTO_CLOSE: None,
+        }
+        if timers.thread_id and timers.last_client and not timers.support_sent:
+            due[SUPPORT_REMINDER] = timers.last_client + self._client_overdue
+        if (
+            timers.tech_thread_id
+            and self._tech_chat_enabled
+            and timers.last_client
+            and not timers.tech_sent
+        ):
+            due[TECH_REMINDER] = timers.last_client + self._client_overdue
+        if timers.thread_id and timers.last_support and not timers.close_sent:
+            due[CLOSE_REMINDER] = timers.last_support + self._close_overdue
+        if (
+            self._auto_close_enabled
+            and timers.thread_id
+            and timers.last_support
+            and (not timers.last_client or timers.last_support > timers.last_client)
+        ):
+            due[AUTO_CLOSE] = timers.last_support + self._auto_close_after
+        return due
+
+    def _reschedule(self, user_id: int):
+        timers = self._tickets.get(user_id)
+        due_times = self._due_times(timers) if timers else dict.fromkeys(
+            (SUPPORT_REMINDER, TECH_REMINDER, CLOSE_REMINDER, AUTO_CLOSE)
+        )
+        for kind, due in due_times.items():
+            self._set_deadline(user_id, kind, due)
+
+    def _set_deadline(self, user_id: int, kind: str, due: Optional[datetime], claim_retry: bool = False):
+        key = (user_id, kind)
+        if not claim_retry:
+            self._claim_misses.pop(key, None)
+        if due is None:
+            self._deadlines.pop(key, None)
+            return
+        current = self._deadlines.get(key)
+        if current and current[0] == due:
+            return
+        seq = next(self._seq)
+        self._deadlines[key] = (due, seq)
+        heapq.heappush(self._heap, (due, seq, user_id, kind))
+        if self._heap[0][1] == seq:
+            self._wakeup.set()
+        self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        if len(self._heap) > 2 * len(self._deadlines) + 1024:
+            self._heap = [(due, seq, uid, kind) for (uid, kind), (due, seq) in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self, now: datetime) -> list[tuple[int, str]]:
+        due_items = []
+        while self._heap and self._heap[0][0] <= now:
+            due, seq, user_id, kind = heapq.heappop(self._heap)
+            if self._deadlines.get((user_id, kind)) != (due, seq):
+                continue  # Дедлайн был перенесён или отменён
+            del self._deadlines[(user_id, kind)]
+            due_items.append((user_id, kind))
+        return due_items
+
+    def _seconds_until_next(self, now: datetime) -> float:
+        while self._heap and self._deadlines.get((self._heap[0][2], self._heap[0][3])) != (self._heap[0][0], self._heap[0][1]):
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return _MAX_SLEEP_SECONDS
+        return min(max((self._heap[0][0] - now).total_seconds(), 0.0), _MAX_SLEEP_SECONDS)
+
+    async def _process_kind(self, kind: str, expected: frozenset[int] = frozenset()):
+        """expected — тикеты, чьи дедлайны этого типа сработали в памяти и сняты с кучи"""
+        source = self._sources.get(kind)
+        if source is None:
+            return
+        started = time.monotonic()
+        try:
+            records = await source.claim()
+        except asyncio.CancelledError:
+            self._rearm_unclaimed(kind, expected)
+            raise
+        except Exception as exc:
+            logger.error(f"Failed to claim due {kind} reminders: {exc}", exc_info=True)
+            self._rearm_unclaimed(kind, expected)
+            return
+        claimed_users = {record["user_id"] for record in records}
+        for user_id in claimed_users:
+            self._claim_misses.pop((user_id, kind), None)
+        self._rearm_unclaimed(kind, expected - claimed_users)
+        claimed = time.monotonic()
+
+        # Напоминания в разные темы уходят параллельно; темп задаёт очередь отправки (outbound.py)
+        semaphore = asyncio.Semaphore(self._concurrency)
+        failed = []
+
+        async def deliver(record):
+            async with semaphore:
+                try:
+                    await source.deliver(record)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as exc:
+                    logger.error(f"Failed to process {kind} reminder for user {record['user_id']}: {exc}", exc_info=True)
+                    failed.append(record["user_id"])
+
+        await asyncio.gather(*(deliver(record) for record in records))
+        if failed and source.release is not None:
+            await self._release(kind, source, failed)
+
+        if records:
+            finished = time.monotonic()
+            cycle = {
+                "claimed": len(records),
+                "failed": len(failed),
+                "claim_ms": round((claimed - started) * 1000, 1),
+                "dispatch_ms": round((finished - claimed) * 1000, 1),
+                "total_ms": round((finished - started) * 1000, 1),
+            }
+            self._last_cycles[kind] = cycle
+            logger.info(
+                f"⏰ {kind} reminders: {cycle['claimed']} due, {cycle['failed']} failed, "
+                f"claim {cycle['claim_ms']} ms, dispatch {cycle['dispatch_ms']} ms"
+            )
+
+    def _rearm_unclaimed(self, kind: str, user_ids):
+        """
+        Дедлайн снят с кучи, но claim тикет не вернул или упал. Без повтора напоминание ждало бы
+        полного прохода (до _MAX_SLEEP_SECONDS); повторы идут с растущей задержкой и ограничены:
+        тикет, уже обработанный другим процессом, перестаёт опрашиваться.
+        """
+        now = datetime.now(timezone.utc)
+        for user_id in user_ids:
+            key = (user_id, kind)
+            if user_id not in self._tickets or key in self._deadlines:
+                continue  # Тикет закрыт или событие уже назначило новый дедлайн
+            misses = self._claim_misses.get(key, 0) + 1
+            if misses > _CLAIM_RETRIES:
+                self._claim_misses.pop(key, None)
+                logger.warning(f"⏰ {kind} reminder for user {user_id} not claimed after {_CLAIM_RETRIES} retries, leaving it to the sweep")
+                continue
+            self._claim_misses[key] = misses
+            self._set_deadline(user_id, kind, now + _CLAIM_RETRY_DELAY * 2 ** (misses - 1), claim_retry=True)
+
+    def stats(self) -> dict:
+        return {
+            "tickets": len(self._tickets),
+            "deadlines": len(self._deadlines),
+            "last_cycles": dict(self._last_cycles),
+        }
+
+    async def _release(self, kind: str, source: ReminderSource, user_ids: list[int]):
+        try:
+            await source.release(user_ids)
+        except Exception as exc:
+            logger.error(f"Failed to release {kind} reminder claims: {exc}", exc_info=True)
+            return
+        retry_at = datetime.now(timezone.utc) + _RETRY_DELAY
+        for user_id in user_ids:
+            timers = self._tickets.get(user_id)
+            if timers is None:
+                continue
+            setattr(timers, f"{kind}_sent", False)
+            self._set_deadline(user_id, kind, retry_at)
+
+    async def sweep(self):
+        """Полный проход по всем типам — ловит тикеты, изменённые другими процессами"""
+        await asyncio.gather(*(self._process_kind(kind) for kind in self._sources))
+
+    async def run(self):
+        while True:
+            now = datetime.now(timezone.utc)
+            due: dict[str, set[int]] = {}
+            for user_id, kind in self._pop_due(now):
+                due.setdefault(kind, set()).add(user_id)
+            if due:
+                await asyncio.gather(*(self._process_kind(kind, frozenset(users)) for kind, users in due.items()))
+
+            timeout = self._seconds_until_next(datetime.now(timezone.utc))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
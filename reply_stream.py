@@ -0,0 +1,149 @@
+import asyncio
+import html
+import logging
+import re
+import time
+from typing import Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+logger = logging.getLogger(__name__)
+
+# Теги и недописанный тег в конце: промежуточный текст отправляется без parse_mode
+_TAG_RE = re.compile(r"<[^>]*>|<[^>]*$")
+
+
+def _preview(text: str) -> str:
+    return html.unescape(_TAG_RE.sub("", text)).strip()
+
+
+class ReplyStream:
+    """
+    Один ответ клиенту, который пишется по мере генерации: первый фрагмент уходит
+    отдельным сообщением, дальше оно правится не чаще раза в interval секунд.
+    update() не ждёт Telegram — правка идёт в фоне, пока читается поток.
+    """
+
+    def __init__(self, streamer: "ReplyStreamer", chat_id: int):
+        self.streamer = streamer
+        self.bot = streamer.bot
+        self.chat_id = chat_id
+        self.started = time.perf_counter()
+        self.message_id: Optional[int] = None
+        self.ttfb_ms: Optional[float] = None
+        self._shown = ""
+        self._pending = ""
+        self._last_push = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._broken = False
+        self.finished = False  # Окончательный текст доставлен клиенту
+
+    def update(self, text: str):
+        """Накопленный текст ответа; отправляется, если пора и предыдущая отправка завершилась"""
+        if self._broken:
+            return
+        self._pending = text
+        if self._task is not None and not self._task.done():
+            return
+        if self.message_id is None:
+            if len(text) < self.streamer.min_chars:
+                return
+        elif time.perf_counter() - self._last_push < self.streamer.interval:
+            return
+        self._task = asyncio.create_task(self._push())
+
+    async def _push(self):
+        text = _preview(self._pending)
+        if not text or text == self._shown:
+            return
+        try:
+            if self.message_id is None:
+                message = await self.bot.send_message(chat_id=self.chat_id, text=text)
+                self.message_id = message.message_id
+                self.ttfb_ms = (time.perf_counter() - self.started) * 1000
+            else:
+                await self.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self.message_id)
+                self.streamer.edits += 1
+            self._shown = text
+        except TelegramAPIError as e:
+            # Дальше без промежуточных правок: финальный текст всё равно будет отправлен
+            self._broken = True
+            self.streamer.edit_failures += 1
+            logger.warning(f"Streaming update failed for chat {self.chat_id}: {e}")
+        finally:
+            self._last_push = time.perf_counter()
+
+    async def _settle(self):
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def finish(self, text_html: str):
+        """Окончательный текст с разметкой: правкой показанного сообщения или новым сообщением"""
+        await self._settle()
+        if self.message_id is None:
+            await self.bot.send_message(chat_id=self.chat_id, text=text_html, parse_mode="HTML")
+            self.finished = True
+            self.ttfb_ms = (time.perf_counter() - self.started) * 1000
+            self.streamer.record(self.ttfb_ms, streamed=False)
+            return
+        # Без разметки и с тем же текстом Telegram отвечает "message is not modified"
+        if _TAG_RE.search(text_html) or _preview(text_html) != self._shown:
+            await self.bot.edit_message_text(
+                text=text_html,
+                chat_id=self.chat_id,
+                message_id=self.message_id,
+                parse_mode="HTML"
+            )
+        self.finished = True
+        self.streamer.record(self.ttfb_ms, streamed=True)
+
+    async def abort(self):
+        """Ответа не будет (ошибка посреди генерации или доставки): показанный фрагмент удаляется"""
+        if self.finished:
+            return  # Полный ответ уже у клиента
+        self._broken = True
+        await self._settle()
+        if self.message_id is None:
+            return
+        try:
+            await self.bot.delete_message(chat_id=self.chat_id, message_id=self.message_id)
+        except TelegramAPIError as e:
+            logger.warning(f"Failed to delete partial reply in chat {self.chat_id}: {e}")
+
+
+class ReplyStreamer:
+    """Настройки потоковых ответов и общая статистика времени до первого сообщения клиенту"""
+
+    def __init__(self, bot: Bot, interval: float = 1.5, min_chars: int = 40):
+        self.bot = bot
+        self.interval = interval
+        self.min_chars = min_chars
+        self.streamed = 0
+        self.unstreamed = 0
+        self.edits = 0
+        self.edit_failures = 0
+        self.ttfb_ms_total = 0.0
+        self.ttfb_ms_max = 0.0
+
+    def start(self, chat_id: int) -> ReplyStream:
+        return ReplyStream(self, chat_id)
+
+    def record(self, ttfb_ms: float, streamed: bool):
+        if streamed:
+            self.streamed += 1
+        else:
+            self.unstreamed += 1
+        self.ttfb_ms_total += ttfb_ms
+        self.ttfb_ms_max = max(self.ttfb_ms_max, ttfb_ms)
+
+    def stats(self) -> dict:
+        replies = self.streamed + self.unstreamed
+        return {
+            "streamed": self.streamed,
+            "unstreamed": self.unstreamed,
+            "edits": self.edits,
+            "edit_failures": self.edit_failures,
+            "ttfb_ms_avg": round(self.ttfb_ms_total / replies, 1) if replies else 0.0,
+            "ttfb_ms_max": round(self.ttfb_ms_max, 1),
+        }
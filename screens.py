@@ -0,0 +1,185 @@
+import logging
+from typing import NamedTuple, Optional
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import TRANSLATIONS, FAQ_QUESTIONS
+from utils import MessageToHtmlConverter
+
+logger = logging.getLogger(__name__)
+
+# Экраны меню; тема (topic) — третья часть ключа кеша
+START_SCREEN = "start_screen"
+SUBPAGE = "subpage"
+FAQ_ANSWER = "faq_answer"          # topic = "<тема>_question<N>", как в callback_data
+COOPERATION = "cooperation"
+ERROR = "error"
+TICKET_ALREADY_OPEN = "ticket_already_open"
+DESCRIBE_ISSUE = "describe_issue"
+
+
+class RenderedScreen(NamedTuple):
+    html: str
+    markup: Optional[InlineKeyboardMarkup]
+
+
+# (lang, screen, topic) -> готовый HTML и клавиатура; заполняется один раз, объекты общие для всех запросов
+_screens: dict[tuple[str, str, Optional[str]], RenderedScreen] = {}
+_texts: dict[tuple[str, str], str] = {}
+
+
+def _build_language_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="🇺🇸 English", callback_data="lang_en"),
+            InlineKeyboardButton(text="🇷🇺 Русский", callback_data="lang_ru")
+        ],
+    ])
+
+
+def _build_topics_keyboard(lang: str) -> InlineKeyboardMarkup:
+    topics = TRANSLATIONS[lang]["topics"]
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text=topics["balance"], callback_data="topic_balance"),
+            InlineKeyboardButton(text=topics["bugs"], callback_data="topic_bugs"),
+        ],
+        [
+            InlineKeyboardButton(text=topics["withdrop"], callback_data="topic_withdrop"),
+            InlineKeyboardButton(text=topics["other"], callback_data="topic_other"),
+        ],
+        [
+            InlineKeyboardButton(text=topics["cooperation"], callback_data="topic_cooperation")
+        ]
+    ])
+
+
+def _build_back_to_topics_keyboard(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=TRANSLATIONS[lang]["back"], callback_data="back_to_topics")]
+    ])
+
+
+def _build_topic_subpage(topic: str, lang: str) -> tuple[str, InlineKeyboardMarkup]:
+    if topic not in FAQ_QUESTIONS:
+        logger.error(f"Invalid topic in FAQ_QUESTIONS: {topic}")
+        return TRANSLATIONS[lang]["error"], _build_back_to_topics_keyboard(lang)
+
+    try:
+        faq = FAQ_QUESTIONS[topic][lang]
+        subpage_text = TRANSLATIONS[lang]["select_topic"]
+        # Для багов вопрос сразу ведёт к оператору с подтемой
+        prefix = "contact" if topic == "bugs" else "faq"
+        suffix = "subtopic" if topic == "bugs" else "question"
+        faq_buttons = [
+            [InlineKeyboardButton(
+                text=faq[f"question{i}"],
+                callback_data=f"{prefix}_{topic}_{suffix}{i}"
+            )] for i in range(1, 10) if f"question{i}" in faq
+        ]
+        action_buttons = [
+            [InlineKeyboardButton(
+                text=TRANSLATIONS[lang].get("back", "Back"),
+                callback_data="back_to_topics"
+            )]
+        ]
+        return subpage_text, InlineKeyboardMarkup(inline_keyboard=faq_buttons + action_buttons)
+    except Exception as e:
+        logger.error(f"Error creating subpage for topic {topic}, lang {lang}: {e}")
+        return TRANSLATIONS[lang]["error"], _build_back_to_topics_keyboard(lang)
+
+
+def _build_faq_answer_keyboard(lang: str, topic: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
+            text=TRANSLATIONS[lang].get("contact_operator", "Contact operator"),
+            callback_data=f"contact_{topic}"
+        )],
+        [InlineKeyboardButton(
+            text=TRANSLATIONS[lang].get("back", "Back"),
+            callback_data="back_to_subpage"
+        )]
+    ])
+
+
+def _build_cooperation_keyboard(lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
+            text=TRANSLATIONS[lang].get("contact_operator", "Contact operator"),
+            callback_data="contact_cooperation"
+        )],
+        [InlineKeyboardButton(
+            text=TRANSLATIONS[lang].get("back", "Back"),
+            callback_data="back_to_topics"
+        )]
+    ])
+
+
+def _html(text: str) -> str:
+    return MessageToHtmlConverter(text, None).html
+
+
+def build_screen_cache():
+    """Рендерит все статические экраны и клавиатуры для всех языков из TRANSLATIONS и FAQ_QUESTIONS"""
+    _screens.clear()
+    _texts.clear()
+    for lang, translations in TRANSLATIONS.items():
+        for key, value in translations.items():
+            if isinstance(value, str):
+                _texts[(lang, key)] = _html(value)
+
+        back = _build_back_to_topics_keyboard(lang)
+        _screens[(lang, START_SCREEN, None)] = RenderedScreen(
+            _texts[(lang, "start_screen")], _build_topics_keyboard(lang)
+        )
+        for key in (ERROR, TICKET_ALREADY_OPEN, DESCRIBE_ISSUE):
+            _screens[(lang, key, None)] = RenderedScreen(_texts[(lang, key)], back)
+        _screens[(lang, COOPERATION, None)] = RenderedScreen(
+            _html(translations.get("cooperation_message", "Please provide details about your cooperation proposal.")),
+            _build_cooperation_keyboard(lang),
+        )
+
+        for topic, faq_by_lang in FAQ_QUESTIONS.items():
+            text, markup = _build_topic_subpage(topic, lang)
+            _screens[(lang, SUBPAGE, topic)] = RenderedScreen(_html(text), markup)
+            keyboard = _build_faq_answer_keyboard(lang, topic)
+            faq = faq_by_lang.get(lang)
+            if not faq:
+                continue
+            for i in range(1, 10):
+                if f"question{i}" not in faq or f"answer{i}" not in faq:
+                    continue
+                answer_text = f"📩 <b>{faq[f'question{i}']}</b>\n\n{faq[f'answer{i}']}"
+                _screens[(lang, FAQ_ANSWER, f"{topic}_question{i}")] = RenderedScreen(_html(answer_text), keyboard)
+    logger.info(f"Screen cache built: {len(_screens)} screens, {len(_texts)} texts")
+
+
+def get_screen(lang: str, screen: str, topic: Optional[str] = None) -> RenderedScreen:
+    """Готовый экран; KeyError, если такого экрана нет (например, неизвестный вопрос FAQ)"""
+    if not _screens:
+        build_screen_cache()
+    return _screens[(lang, screen, topic)]
+
+
+def render_text(lang: str, key: str) -> str:
+    """HTML статической строки TRANSLATIONS[lang][key]"""
+    if not _texts:
+        build_screen_cache()
+    return _texts[(lang, key)]
+
+
+def create_language_keyboard() -> InlineKeyboardMarkup:
+    return _LANGUAGE_KEYBOARD
+
+
+def create_topic_subpage(topic: str, lang: str) -> tuple[str, InlineKeyboardMarkup]:
+    """HTML и клавиатура подстраницы темы; для неизвестной темы — экран ошибки с кнопкой «назад»"""
+    try:
+        screen = get_screen(lang, SUBPAGE, topic)
+    except KeyError:
+        logger.error(f"Invalid topic in FAQ_QUESTIONS: {topic}")
+        screen = get_screen(lang, ERROR)
+    return screen.html, screen.markup
+
+
+_LANGUAGE_KEYBOARD = _build_language_keyboard()
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from answer_cache import normalize
+from cache import TTLCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+# (первое сообщение, тема, язык) -> название или None, если ИИ не ответил
+TitleGenerator = Callable[[str, str, str], Awaitable[Optional[str]]]
+
+
+def _forget(tasks: dict, key, task: asyncio.Task):
+    if tasks.get(key) is task:
+        del tasks[key]
+
+
+class ThreadTitleUpdater:
+    """
+    ИИ-названия тем форума в фоне: тема создаётся с обычным названием, а сгенерированное
+    применяется позже через edit_forum_topic. На одну тему — одна задача; одинаковые первые
+    сообщения (та же тема и язык) делят одну генерацию и её результат.
+    Если название темы сменилось по другой причине (эскалация, закрытие), задачу отменяют через cancel().
+    С wait_for_reply название сначала ждут из ответа ИИ клиенту (provide), отдельная генерация —
+    только если его там не оказалось.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        chat_id: int,
+        generate: TitleGenerator,
+        timeout: float = 10.0,
+        cache_size: int = 1000,
+        cache_ttl: float = 3600,
+    ):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.generate = generate
+        self.timeout = timeout
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._inflight: dict[tuple, asyncio.Task] = {}
+        self._offers: dict[int, asyncio.Future] = {}
+        self._titles = TTLCache(cache_size, cache_ttl)
+        self.applied = 0
+        self.from_reply = 0
+        self.shared = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.cancelled = 0
+
+    def schedule(
+        self,
+        thread_id: int,
+        user_id: int,
+        first_message: str,
+        topic: str,
+        lang: str,
+        wait_for_reply: bool = False,
+    ):
+        if not first_message or thread_id in self._tasks:
+            return
+        if wait_for_reply:
+            self._offers[thread_id] = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(self._apply(thread_id, user_id, first_message, topic, lang))
+        self._tasks[thread_id] = task
+        task.add_done_callback(lambda done: _forget(self._tasks, thread_id, done))
+
+    def awaiting(self, thread_id: int) -> bool:
+        """Ждёт ли тема название из ответа ИИ"""
+        return thread_id in self._offers
+
+    def provide(self, thread_id: int, title: Optional[str]):
+        """Название из ответа ИИ; None — в ответе его нет, генерируется отдельно"""
+        offer = self._offers.pop(thread_id, None)
+        if offer is not None and not offer.done():
+            offer.set_result(title)
+
+    def cancel(self, thread_id: int):
+        """Отменяет ещё не применённое название: тему переименовали иначе"""
+        self._offers.pop(thread_id, None)
+        task = self._tasks.pop(thread_id, None)
+        if task is not None and not task.done():
+            task.cancel()
+            self.cancelled += 1
+
+    async def _title_for(self, first_message: str, topic: str, lang: str) -> Optional[str]:
+        key = (topic, lang, normalize(first_message[:200]))
+        title = self._titles.get(key)
+        if title is not MISSING:
+            self.shared += 1
+            return title
+        generation = self._inflight.get(key)
+        if generation is None:
+            generation = asyncio.create_task(self.generate(first_message, topic, lang))
+            self._inflight[key] = generation
+            generation.add_done_callback(lambda done: _forget(self._inflight, key, done))
+        else:
+            self.shared += 1
+        # shield: таймаут или отмена одной темы не обрывает генерацию для остальных
+        title = await asyncio.wait_for(asyncio.shield(generation), self.timeout)
+        if title:
+            self._titles.set(key, title)
+        return title
+
+    async def _offered_title(self, thread_id: int) -> Optional[str]:
+        offer = self._offers.get(thread_id)
+        if offer is None:
+            return None
+        try:
+            title = await asyncio.wait_for(offer, self.timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱ No title from AI reply for thread {thread_id}, generating separately")
+            return None
+        finally:
+            self._offers.pop(thread_id, None)
+        if title:
+            self.from_reply += 1
+        return title
+
+    async def _apply(self, thread_id: int, user_id: int, first_message: str, topic: str, lang: str):
+        try:
+            title = await self._offered_title(thread_id) or await self._title_for(first_message, topic, lang)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning(f"⏱ Thread title generation timed out for thread {thread_id}, keeping fallback title")
+            return
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"Thread title generation failed for thread {thread_id}: {e}")
+            return
+        if not title:
+            return
+        try:
+            await self.bot.edit_forum_topic(
+                chat_id=self.chat_id,
+                message_thread_id=thread_id,
+                name=f"{title} | id{user_id}"
+            )
+            self.applied += 1
+            logger.info(f"✨ Thread {thread_id} renamed to AI title: '{title}'")
+        except TelegramAPIError as e:
+            self.failures += 1
+            logger.warning(f"Failed to apply AI title to thread {thread_id}: {e}")
+
+    async def close(self):
+        """Названия косметические: при остановке незавершённые задачи просто отменяются"""
+        tasks = list(self._tasks.values()) + list(self._inflight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info(f"Thread title updater stopped, stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._tasks),
+            "applied": self.applied,
+            "from_reply": self.from_reply,
+            "shared": self.shared,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "cancelled": self.cancelled,
+        }
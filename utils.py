@@ -1,4 +1,5 @@
 import random
+import re
 import string
 import logging
 from html import escape
@@ -40,7 +41,12 @@ _ENTITIES_TO_TAG: Dict[str, Union[None, _Tag, _TagMakerFunction]] = {
     'hashtag': None,
 }
 
-class MessageToHtmlConverter:
+class LegacyMessageToHtmlConverter:
+    """
+    Прежний движок: O(n²) на длинных сообщениях из-за пересчёта UTF-16 смещений для каждого перевода строки.
+    Оставлен как эталон для benchmarks/bench_html_converter.py и как запасной путь
+    для сущностей со смещениями вне границ символов (там он же и бросает ошибку декодирования).
+    """
     def __init__(self, message: Optional[str], entities: Optional[List[object]], buttons: Optional[List] = None):
         self.html = ''
         self.buttons = buttons
@@ -116,6 +122,105 @@ class MessageToHtmlConverter:
         if i not in self._positions:
             self._positions[i] = _PositionChange([], [], False)
 
+
+_ASTRAL_RE = re.compile('[\U00010000-\U0010FFFF]')
+
+
+def _render_entities_html(message: str, entities: List[object]) -> Optional[str]:
+    """
+    Однопроходный рендер: UTF-16 смещения сущностей переводятся в индексы символов
+    по списку символов вне BMP (они занимают две единицы UTF-16), текст собирается через join.
+    Возвращает None, если смещение попадает внутрь суррогатной пары или отрицательно.
+    """
+    # Индексы символов, занимающих две единицы UTF-16 (эмодзи и т.п.)
+    astral = [m.start() for m in _ASTRAL_RE.finditer(message)]
+    message_b16 = None
+
+    # Смещение в единицах UTF-16 -> (открывающие теги, закрывающие теги)
+    opens: Dict[int, List[str]] = {}
+    closes: Dict[int, List[str]] = {}
+    boundaries = set()
+    for e in entities:
+        start = e.offset
+        end = e.offset + e.length
+        boundaries.add(start)
+        boundaries.add(end)
+        tag = _ENTITIES_TO_TAG.get(e.type)
+        if tag is None:
+            continue
+        if callable(tag):
+            if message_b16 is None:
+                message_b16 = message.encode(_UTF_16)
+            tag = tag(e, message_b16[start * 2:end * 2].decode(_UTF_16))
+        opens.setdefault(start, []).append(tag.opening)
+        closes.setdefault(end, []).append(tag.closing)
+
+    # Перевод смещений UTF-16 в индексы символов двумя указателями по отсортированным спискам
+    unit_to_char: Dict[int, int] = {}
+    k = 0
+    for unit in sorted(boundaries):
+        if unit < 0:
+            return None
+        while k < len(astral) and astral[k] + k < unit:
+            if unit == astral[k] + k + 1:
+                return None
+            k += 1
+        unit_to_char[unit] = unit - k
+
+    # Индекс символа -> (закрыть, перевод строки, открыть); порядок внутри позиции как у прежнего движка
+    events: Dict[int, list] = {}
+    for unit, char_index in unit_to_char.items():
+        to_close = closes.get(unit)
+        to_open = opens.get(unit)
+        if to_close or to_open:
+            events[char_index] = [to_close, False, to_open]
+    newline = message.find('\n')
+    while newline != -1:
+        event = events.get(newline)
+        if event is None:
+            events[newline] = [None, True, None]
+        else:
+            event[1] = True
+        newline = message.find('\n', newline + 1)
+
+    parts: List[str] = []
+    append = parts.append
+    prev = 0
+    for index in sorted(events):
+        if index > prev:
+            append(escape(message[prev:index]))
+        to_close, br, to_open = events[index]
+        if to_close:
+            parts.extend(reversed(to_close))
+        if br:
+            append('\n')
+            prev = index + 1
+        else:
+            prev = index
+        if to_open:
+            parts.extend(to_open)
+    if prev < len(message):
+        append(escape(message[prev:]))
+    return ''.join(parts)
+
+
+class MessageToHtmlConverter:
+    def __init__(self, message: Optional[str], entities: Optional[List[object]], buttons: Optional[List] = None):
+        self.buttons = buttons
+        if message is None:
+            self.html = ''
+            return
+        if not entities:
+            self.html = message
+            return
+
+        html = _render_entities_html(message, entities)
+        if html is None:
+            html = LegacyMessageToHtmlConverter(message, entities).html
+        self.html = html
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Generated HTML for {len(entities)} entities: {self.html}")
+
     def get_reply_markup(self) -> Optional[InlineKeyboardMarkup]:
         if not self.buttons:
             logger.debug("No buttons provided")
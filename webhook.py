@@ -0,0 +1,129 @@
+import asyncio
+import hmac
+import logging
+import time
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Приём обновлений Telegram по вебхуку.
+    HTTP-обработчик только проверяет секрет и кладёт обновление в ограниченную очередь;
+    разбирают её несколько воркеров через dp.feed_update.
+    Если очередь полна дольше enqueue_timeout, Telegram получает 503 и повторит доставку позже.
+    При остановке новые запросы не принимаются, а уже принятые обновления дорабатываются.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        secret: str,
+        path: str = "/webhook",
+        queue_size: int = 1000,
+        workers: int = 8,
+        enqueue_timeout: float = 2.0,
+    ):
+        self._dp = dp
+        self._bot = bot
+        self._secret = secret
+        self._path = path
+        self._queue: asyncio.Queue[tuple[Update, float]] = asyncio.Queue(maxsize=queue_size)
+        self._workers_count = max(workers, 1)
+        self._workers: list[asyncio.Task] = []
+        self._enqueue_timeout = enqueue_timeout
+        self._runner: web.AppRunner | None = None
+        self._accepting = False
+        self._stats = {
+            "received": 0,
+            "rejected_secret": 0,
+            "rejected_full": 0,
+            "processed": 0,
+            "failed": 0,
+            "max_queue_depth": 0,
+            "max_queue_wait_ms": 0.0,
+        }
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self._path, self._handle)
+        app.router.add_get("/healthz", self._health)
+        return app
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        if not self._accepting:
+            return web.Response(status=503, text="shutting down")
+        # Сравнение за постоянное время: секрет не подбирается по времени ответа
+        provided = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(provided, self._secret):
+            self._stats["rejected_secret"] += 1
+            return web.Response(status=401, text="invalid secret token")
+
+        try:
+            payload = await request.json(loads=self._bot.session.json_loads)
+            update = Update.model_validate(payload, context={"bot": self._bot})
+        except Exception as exc:
+            logger.warning(f"Malformed webhook payload: {exc}")
+            return web.Response(status=400, text="malformed update")
+
+        try:
+            await asyncio.wait_for(self._queue.put((update, time.monotonic())), timeout=self._enqueue_timeout)
+        except asyncio.TimeoutError:
+            self._stats["rejected_full"] += 1
+            logger.warning(f"Webhook queue is full ({self._queue.qsize()}), update {update.update_id} deferred to Telegram")
+            return web.Response(status=503, text="queue is full")
+
+        self._stats["received"] += 1
+        self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._queue.qsize())
+        return web.Response(status=200)
+
+    async def _health(self, request: web.Request) -> web.Response:
+        return web.json_response({"accepting": self._accepting, **self.stats()})
+
+    async def _worker(self):
+        while True:
+            update, enqueued_at = await self._queue.get()
+            waited_ms = (time.monotonic() - enqueued_at) * 1000
+            self._stats["max_queue_wait_ms"] = max(self._stats["max_queue_wait_ms"], waited_ms)
+            try:
+                await self._dp.feed_update(self._bot, update)
+                self._stats["processed"] += 1
+            except Exception as exc:
+                self._stats["failed"] += 1
+                logger.error(f"Failed to process update {update.update_id}: {exc}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def start(self, host: str, port: int):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+        self._runner = web.AppRunner(self.build_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._accepting = True
+        logger.info(f"Webhook server listening on {host}:{port}{self._path} ({self._workers_count} workers)")
+
+    async def stop(self, drain_timeout: float = 30.0):
+        """Перестаёт принимать обновления, дорабатывает очередь и останавливает воркеров"""
+        self._accepting = False
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Webhook queue drain timed out, {self._queue.qsize()} updates dropped")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info(f"Webhook server stopped, stats: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {**self._stats, "queue_depth": self._queue.qsize()}